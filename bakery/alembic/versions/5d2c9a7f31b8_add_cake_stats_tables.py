@@ -0,0 +1,127 @@
+"""Add cake stats tables
+
+Revision ID: 5d2c9a7f31b8
+Revises: 88f336a1e764
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5d2c9a7f31b8"
+down_revision: Union[str, None] = "88f336a1e764"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SQLITE_MINUTE = "(CAST(strftime('%s', 'now') AS INTEGER) / 60)"
+SQLITE_COUNT_CHANGES = {
+    ("INSERT", "created"): """
+        UPDATE cake_counts SET count = count + 1 WHERE "yumFactor" = new."yumFactor"
+        """,
+    ("UPDATE", "updated"): """
+        UPDATE cake_counts
+        SET count = count + ("yumFactor" = new."yumFactor") - ("yumFactor" = old."yumFactor")
+        WHERE "yumFactor" IN (old."yumFactor", new."yumFactor")
+        """,
+    ("DELETE", "deleted"): """
+        UPDATE cake_counts SET count = count - 1 WHERE "yumFactor" = old."yumFactor"
+        """,
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "cake_counts",
+        sa.Column("yumFactor", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("yumFactor"),
+    )
+    op.create_table(
+        "cake_writes",
+        sa.Column("minute", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("operation", sa.String(length=10), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("minute", "operation"),
+    )
+    # Count the cakes that already exist
+    op.execute(
+        """
+        INSERT INTO cake_counts ("yumFactor", count)
+        SELECT value, (SELECT count(*) FROM cakes WHERE "yumFactor" = value)
+        FROM (VALUES (1), (2), (3), (4), (5)) AS yum_factors (value)
+        """
+        if op.get_bind().dialect.name == "postgresql"
+        else """
+        INSERT INTO cake_counts ("yumFactor", count)
+        SELECT column1, (SELECT count(*) FROM cakes WHERE "yumFactor" = column1)
+        FROM (VALUES (1), (2), (3), (4), (5))
+        """
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            """
+            CREATE FUNCTION cake_stats_track() RETURNS trigger AS $$
+            DECLARE
+                current_minute integer := (floor(extract(epoch FROM now()) / 60)::integer);
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    UPDATE cake_counts SET count = count - 1
+                    WHERE "yumFactor" = OLD."yumFactor";
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    UPDATE cake_counts SET count = count + 1
+                    WHERE "yumFactor" = NEW."yumFactor";
+                END IF;
+                INSERT INTO cake_writes (minute, operation, count)
+                VALUES (
+                    current_minute,
+                    CASE TG_OP
+                        WHEN 'INSERT' THEN 'created'
+                        WHEN 'UPDATE' THEN 'updated'
+                        ELSE 'deleted'
+                    END,
+                    1
+                )
+                ON CONFLICT (minute, operation) DO UPDATE SET count = cake_writes.count + 1;
+                DELETE FROM cake_writes WHERE minute <= current_minute - 1440;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        op.execute(
+            """
+            CREATE TRIGGER cake_stats_track AFTER INSERT OR UPDATE OR DELETE ON cakes
+            FOR EACH ROW EXECUTE FUNCTION cake_stats_track()
+            """
+        )
+    elif op.get_bind().dialect.name == "sqlite":
+        for (event, operation), count_change in SQLITE_COUNT_CHANGES.items():
+            op.execute(
+                f"""
+                CREATE TRIGGER cake_stats_{event.lower()} AFTER {event} ON cakes BEGIN
+                    {count_change};
+                    INSERT INTO cake_writes (minute, operation, count)
+                    VALUES ({SQLITE_MINUTE}, '{operation}', 1)
+                    ON CONFLICT (minute, operation) DO UPDATE SET count = count + 1;
+                    DELETE FROM cake_writes WHERE minute <= {SQLITE_MINUTE} - 1440;
+                END
+                """
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TRIGGER cake_stats_track ON cakes")
+        op.execute("DROP FUNCTION cake_stats_track()")
+    elif op.get_bind().dialect.name == "sqlite":
+        for event, _ in SQLITE_COUNT_CHANGES:
+            op.execute(f"DROP TRIGGER cake_stats_{event.lower()}")
+
+    op.drop_table("cake_writes")
+    op.drop_table("cake_counts")
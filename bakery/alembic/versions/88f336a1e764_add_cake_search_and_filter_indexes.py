@@ -0,0 +1,79 @@
+"""Add cake search and filter indexes
+
+Revision ID: 88f336a1e764
+Revises: b048cc7059e4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "88f336a1e764"
+down_revision: Union[str, None] = "b048cc7059e4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_cakes_yumFactor_id", "cakes", ["yumFactor", "id"], unique=False
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            """
+            ALTER TABLE cakes ADD COLUMN search tsvector GENERATED ALWAYS AS
+            (to_tsvector('english', name || ' ' || comment)) STORED
+            """
+        )
+        op.execute("CREATE INDEX ix_cakes_search ON cakes USING gin (search)")
+    elif op.get_bind().dialect.name == "sqlite":
+        op.execute(
+            """
+            CREATE VIRTUAL TABLE cakes_fts
+            USING fts5(name, comment, content='cakes', content_rowid='id')
+            """
+        )
+        op.execute(
+            """
+            CREATE TRIGGER cakes_fts_insert AFTER INSERT ON cakes BEGIN
+                INSERT INTO cakes_fts(rowid, name, comment)
+                VALUES (new.id, new.name, new.comment);
+            END
+            """
+        )
+        op.execute(
+            """
+            CREATE TRIGGER cakes_fts_delete AFTER DELETE ON cakes BEGIN
+                INSERT INTO cakes_fts(cakes_fts, rowid, name, comment)
+                VALUES ('delete', old.id, old.name, old.comment);
+            END
+            """
+        )
+        op.execute(
+            """
+            CREATE TRIGGER cakes_fts_update AFTER UPDATE ON cakes BEGIN
+                INSERT INTO cakes_fts(cakes_fts, rowid, name, comment)
+                VALUES ('delete', old.id, old.name, old.comment);
+                INSERT INTO cakes_fts(rowid, name, comment)
+                VALUES (new.id, new.name, new.comment);
+            END
+            """
+        )
+        # Index the cakes that already exist
+        op.execute("INSERT INTO cakes_fts(cakes_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX ix_cakes_search")
+        op.execute("ALTER TABLE cakes DROP COLUMN search")
+    elif op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER cakes_fts_update")
+        op.execute("DROP TRIGGER cakes_fts_delete")
+        op.execute("DROP TRIGGER cakes_fts_insert")
+        op.execute("DROP TABLE cakes_fts")
+
+    op.drop_index("ix_cakes_yumFactor_id", table_name="cakes")
@@ -0,0 +1,135 @@
+"""Add cake change log
+
+Revision ID: c41e8b6d20f7
+Revises: 5d2c9a7f31b8
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c41e8b6d20f7"
+down_revision: Union[str, None] = "5d2c9a7f31b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SQLITE_TRIGGERS = {
+    ("INSERT", "created"): "new",
+    ("UPDATE", "updated"): "new",
+    ("DELETE", "deleted"): "old",
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "cake_changes",
+        sa.Column("seq", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("cake_id", sa.Integer(), nullable=False),
+        sa.Column("operation", sa.String(length=10), nullable=False),
+        sa.Column("name", sa.String(length=30), nullable=True),
+        sa.Column("comment", sa.String(length=200), nullable=True),
+        sa.Column("imageUrl", sa.String(), nullable=True),
+        sa.Column("yumFactor", sa.Integer(), nullable=True),
+        sa.Column("changed_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+    )
+    op.create_index(
+        "ix_cake_changes_cake_id_seq", "cake_changes", ["cake_id", "seq"], unique=False
+    )
+    op.create_table(
+        "cake_change_feed",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("last_seq", sa.BigInteger(), nullable=False),
+        sa.Column("purged_seq", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    # The cakes that already exist start the log, as creations in the order of their ids
+    op.execute(
+        """
+        INSERT INTO cake_changes
+        (seq, cake_id, operation, name, comment, "imageUrl", "yumFactor", changed_at)
+        SELECT row_number() OVER (ORDER BY id), id, 'created', name, comment, "imageUrl",
+        "yumFactor", CURRENT_TIMESTAMP
+        FROM cakes
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO cake_change_feed (id, last_seq, purged_seq)
+        SELECT 1, count(*), 0 FROM cakes
+        """
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            """
+            CREATE FUNCTION cake_changes_track() RETURNS trigger AS $$
+            DECLARE
+                next_seq bigint;
+            BEGIN
+                UPDATE cake_change_feed SET last_seq = last_seq + 1
+                RETURNING last_seq INTO next_seq;
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO cake_changes (seq, cake_id, operation, changed_at)
+                    VALUES (next_seq, OLD.id, 'deleted', now());
+                ELSE
+                    INSERT INTO cake_changes
+                    (seq, cake_id, operation, name, comment, "imageUrl", "yumFactor", changed_at)
+                    VALUES (
+                        next_seq,
+                        NEW.id,
+                        CASE TG_OP WHEN 'INSERT' THEN 'created' ELSE 'updated' END,
+                        NEW.name,
+                        NEW.comment,
+                        NEW."imageUrl",
+                        NEW."yumFactor",
+                        now()
+                    );
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        op.execute(
+            """
+            CREATE TRIGGER cake_changes_track AFTER INSERT OR UPDATE OR DELETE ON cakes
+            FOR EACH ROW EXECUTE FUNCTION cake_changes_track()
+            """
+        )
+    elif op.get_bind().dialect.name == "sqlite":
+        for (event, operation), row in SQLITE_TRIGGERS.items():
+            values = (
+                f'{row}.name, {row}.comment, {row}."imageUrl", {row}."yumFactor"'
+                if row == "new"
+                else "NULL, NULL, NULL, NULL"
+            )
+            op.execute(
+                f"""
+                CREATE TRIGGER cake_changes_{event.lower()} AFTER {event} ON cakes BEGIN
+                    UPDATE cake_change_feed SET last_seq = last_seq + 1;
+                    INSERT INTO cake_changes
+                    (seq, cake_id, operation, name, comment, "imageUrl", "yumFactor", changed_at)
+                    SELECT last_seq, {row}.id, '{operation}', {values}, CURRENT_TIMESTAMP
+                    FROM cake_change_feed;
+                END
+                """
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TRIGGER cake_changes_track ON cakes")
+        op.execute("DROP FUNCTION cake_changes_track()")
+    elif op.get_bind().dialect.name == "sqlite":
+        for event, _ in SQLITE_TRIGGERS:
+            op.execute(f"DROP TRIGGER cake_changes_{event.lower()}")
+
+    op.drop_table("cake_change_feed")
+    op.drop_index("ix_cake_changes_cake_id_seq", table_name="cake_changes")
+    op.drop_table("cake_changes")
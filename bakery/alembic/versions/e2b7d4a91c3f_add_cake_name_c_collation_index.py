@@ -0,0 +1,29 @@
+"""Add cake name C collation index
+
+Revision ID: e2b7d4a91c3f
+Revises: c41e8b6d20f7
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2b7d4a91c3f"
+down_revision: Union[str, None] = "c41e8b6d20f7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Name prefix filters are ranges compared in the "C" collation on Postgres; SQLite's default
+    # collation already compares code points, so its name index serves them as it is
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute('CREATE INDEX ix_cakes_name_c ON cakes (name COLLATE "C")')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX ix_cakes_name_c")
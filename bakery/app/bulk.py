@@ -0,0 +1,53 @@
+from typing import List, Tuple
+
+from pydantic import ValidationError
+
+from .models import Cake
+from .schemas import BulkItemResult
+
+
+def validate_items(items: List[dict], schema) -> Tuple[list, List[BulkItemResult]]:
+    """
+    The function validates every item of a bulk request on its own, first with the schema, then
+    with the validators of the `Cake` model, so that one bad item can be reported without failing
+    the others.
+
+    :return: a tuple of the valid items, as (index, data) pairs, and the results of the invalid
+    items.
+    """
+    valid, invalid = [], []
+    for index, item in enumerate(items):
+        try:
+            data = schema.model_validate(item).model_dump()
+            # A transient instance runs the model's own rules, such as the minimum lengths
+            Cake(**data)
+        except ValidationError as e:
+            errors = e.errors(include_url=False, include_context=False)
+            invalid.append(_invalid(index, item, errors))
+        except ValueError as e:
+            invalid.append(_invalid(index, item, [{"msg": str(e)}]))
+        else:
+            valid.append((index, data))
+    return valid, invalid
+
+
+def _invalid(index, item, errors):
+    cake_id = item.get("id") if isinstance(item.get("id"), int) else None
+    return BulkItemResult(index=index, id=cake_id, status="invalid", errors=errors)
+
+
+def not_found(index: int, cake_id: int) -> BulkItemResult:
+    return BulkItemResult(
+        index=index, id=cake_id, status="not_found", errors=[{"msg": "Cake not found"}]
+    )
+
+
+def skipped(results: List[BulkItemResult]) -> List[BulkItemResult]:
+    """
+    The function marks the items that would have succeeded as skipped, once an all-or-nothing
+    request has failed.
+    """
+    for result in results:
+        if result.errors is None:
+            result.status = "skipped"
+    return results
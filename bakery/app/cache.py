@@ -0,0 +1,126 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Request, Response
+
+# The rendered cake and list page responses are kept in memory, in each worker process. Writes
+# invalidate the entries of the worker that handled them; the other workers' entries expire
+# after CACHE_TTL_SECONDS. A size of 0 turns the cache off.
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+
+
+class Rendered(NamedTuple):
+    body: bytes
+    etag: str
+    # The cursor of the next page, for list pages
+    next_cursor: Optional[str] = None
+
+
+def render(body: bytes, next_cursor: Optional[str] = None) -> Rendered:
+    """
+    The function pairs a JSON response body with its strong ETag, the hash of its bytes.
+    """
+    return Rendered(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"', next_cursor)
+
+
+class ResponseCache:
+    """
+    A least recently used cache of rendered responses. Entries expire `ttl` seconds after they
+    were stored, and the least recently used entries are evicted once the total size of the
+    bodies exceeds `max_bytes`.
+
+    Single cakes are cached under `("cake", id)` and list pages under `("page", ...)`. Any
+    write may move cakes between pages, so every write drops all the pages.
+
+    :param max_bytes: The maximum total size of the bodies kept in the cache
+    :param ttl: The number of seconds an entry stays valid
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # Incremented by every invalidation, see `set`
+        self.generation = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[Rendered]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        rendered, expires = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return rendered
+
+    def set(self, key, rendered: Rendered, generation: int):
+        """
+        The function stores a response read from the database while the cache was at
+        `generation`. A response read before a write, but stored after the write invalidated
+        the cache, is stale and so dropped.
+        """
+        if generation != self.generation or len(rendered.body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (rendered, time.monotonic() + self.ttl)
+        self.size += len(rendered.body)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, cake_ids=()):
+        """
+        The function drops the given cakes and every list page, after a write.
+        """
+        self.generation += 1
+        for cake_id in cake_ids:
+            if ("cake", cake_id) in self._entries:
+                self._remove(("cake", cake_id))
+        for key in [key for key in self._entries if key[0] == "page"]:
+            self._remove(key)
+
+    def _remove(self, key):
+        rendered, _ = self._entries.pop(key)
+        self.size -= len(rendered.body)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self.size = 0
+
+
+response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+    The function tells whether the client already holds the current version of a response,
+    from the ETags of its `If-None-Match` header.
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, which ignores the W/ prefix
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def json_response(request: Request, rendered: Rendered, headers=None) -> Response:
+    """
+    The function answers with a rendered body, or with a 304 and no body when the client
+    already holds it.
+    """
+    headers = {**(headers or {}), "ETag": rendered.etag}
+    if not_modified(request, rendered.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(rendered.body, media_type="application/json", headers=headers)
@@ -0,0 +1,109 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from .models import CakeChange, ChangeFeed
+
+# How long tombstones are kept by compaction, i.e. how long a consumer may stop reading the
+# feed and still catch up from where it was rather than from the start
+CHANGE_RETENTION_DAYS = float(os.getenv("CHANGE_RETENTION_DAYS", "7"))
+
+
+class ChangesPurged(Exception):
+    """
+    The changes after the requested sequence number include deletions that compaction removed.
+    """
+
+
+class Compaction(NamedTuple):
+    superseded: int
+    tombstones: int
+
+
+async def get_changes(db: AsyncSession, since: int = 0, limit: int = 100) -> list:
+    """
+    The function reads the changes after the sequence number `since`, in order. The sequence
+    number is the primary key of the log, so a page is a seek whatever the length of the log.
+
+    :param db: The database session
+    :param since: The sequence number of the last change the consumer has seen, 0 for none
+    :param limit: The number of changes to return
+    :return: a list of rows.
+    :raises ChangesPurged: if tombstones after `since` were removed by compaction. A consumer
+    starting from 0 gets the latest change of every cake, so it can always sync from scratch.
+    """
+    if since:
+        purged_seq = await db.scalar(select(ChangeFeed.purged_seq))
+        if since < purged_seq:
+            raise ChangesPurged()
+    query = (
+        select(*CakeChange.__table__.c)
+        .where(CakeChange.seq > since)
+        .order_by(CakeChange.seq)
+        .limit(limit)
+    )
+    return (await db.execute(query)).all()
+
+
+def change_dict(change) -> dict:
+    cake = None
+    if change.operation != "deleted":
+        cake = {
+            "id": change.cake_id,
+            "name": change.name,
+            "comment": change.comment,
+            "imageUrl": change.imageUrl,
+            "yumFactor": change.yumFactor,
+        }
+    return {
+        "seq": change.seq,
+        "operation": change.operation,
+        "id": change.cake_id,
+        "changedAt": change.changed_at,
+        "cake": cake,
+    }
+
+
+async def compact_changes(
+    db: AsyncSession, retention_days: float = CHANGE_RETENTION_DAYS
+) -> Compaction:
+    """
+    The function compacts the change log: it removes every change followed by a newer change of
+    the same cake, which holds the cake as it is now, then the tombstones older than
+    `retention_days`. What is left is the latest state of every cake and the recent deletions.
+    The highest removed tombstone is recorded, so that `get_changes` turns away consumers that
+    would miss it.
+
+    :param db: The database session
+    :param retention_days: How long tombstones are kept
+    :return: the numbers of superseded changes and tombstones removed.
+    """
+    newer = aliased(CakeChange)
+    superseded = await db.execute(
+        delete(CakeChange)
+        .where(
+            exists().where(
+                newer.cake_id == CakeChange.cake_id, newer.seq > CakeChange.seq
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    expired = (CakeChange.operation == "deleted", CakeChange.changed_at < cutoff)
+    purged_seq = await db.scalar(select(func.max(CakeChange.seq)).where(*expired))
+    tombstones = await db.execute(
+        delete(CakeChange).where(*expired).execution_options(synchronize_session=False)
+    )
+    if purged_seq is not None:
+        await db.execute(
+            update(ChangeFeed)
+            .where(ChangeFeed.purged_seq < purged_seq)
+            .values(purged_seq=purged_seq)
+        )
+    await db.commit()
+    return Compaction(superseded.rowcount, tombstones.rowcount)
@@ -0,0 +1,134 @@
+"""
+Maintenance commands for the bakery database, run offline against `DATABASE_URL`.
+
+Usage (from the bakery directory):
+
+    python -m app.cli export --output cakes.ndjson
+    python -m app.cli import cakes.csv --keep-ids
+    python -m app.cli rebuild-stats
+    python -m app.cli compact-changes --retention-days 7
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+from . import changes, crud, transfer
+from .database import SessionLocal, engine
+
+
+def guess_format(path, format):
+    if format:
+        return format
+    extension = os.path.splitext(path or "")[1].lstrip(".").lower()
+    return extension if extension in transfer.FORMATS else "ndjson"
+
+
+async def export_command(args):
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async with SessionLocal() as db:
+            async for chunk in transfer.export_cakes(
+                db, guess_format(args.output, args.format), args.batch_size
+            ):
+                output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+async def import_command(args):
+    input = open(args.input, "rb") if args.input != "-" else sys.stdin.buffer
+    try:
+        async with SessionLocal() as db:
+            result = await transfer.import_cakes(
+                db,
+                transfer.iterate_file(input),
+                guess_format(args.input, args.format),
+                args.keep_ids,
+                args.batch_size,
+            )
+    finally:
+        if args.input != "-":
+            input.close()
+    print(f"Imported {result.imported} cakes, {result.failed} failed", file=sys.stderr)
+    for error in result.errors:
+        print(f"  line {error['line']}: {error['errors']}", file=sys.stderr)
+    return 1 if result.failed else 0
+
+
+async def rebuild_stats_command(args):
+    async with SessionLocal() as db:
+        total = await crud.rebuild_cake_stats(db)
+    print(f"Counted {total} cakes", file=sys.stderr)
+
+
+async def compact_changes_command(args):
+    async with SessionLocal() as db:
+        result = await changes.compact_changes(db, args.retention_days)
+    print(
+        f"Removed {result.superseded} superseded changes "
+        f"and {result.tombstones} tombstones",
+        file=sys.stderr,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Dump every cake")
+    export_parser.add_argument(
+        "--output", help="The file to write, standard output if omitted"
+    )
+    export_parser.set_defaults(run=export_command)
+
+    import_parser = commands.add_parser("import", help="Add the cakes of a dump")
+    import_parser.add_argument(
+        "input", help="The file to read, or - for standard input"
+    )
+    import_parser.add_argument(
+        "--keep-ids",
+        action="store_true",
+        help="Keep the ids of the dump, to restore it",
+    )
+    import_parser.set_defaults(run=import_command)
+
+    rebuild_parser = commands.add_parser(
+        "rebuild-stats", help="Recount the cakes behind /api/cakes/stats"
+    )
+    rebuild_parser.set_defaults(run=rebuild_stats_command)
+
+    compact_parser = commands.add_parser(
+        "compact-changes", help="Drop superseded changes and old tombstones"
+    )
+    compact_parser.add_argument(
+        "--retention-days",
+        type=float,
+        default=changes.CHANGE_RETENTION_DAYS,
+        help="How long tombstones are kept, CHANGE_RETENTION_DAYS (7) by default",
+    )
+    compact_parser.set_defaults(run=compact_changes_command)
+
+    for command in (export_parser, import_parser):
+        command.add_argument(
+            "--format",
+            choices=list(transfer.FORMATS),
+            help="ndjson or csv, guessed from the file extension by default",
+        )
+        command.add_argument("--batch-size", type=int, default=transfer.BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+
+    async def _run():
+        try:
+            return await args.run(args)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(_run()) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,258 @@
-from sqlalchemy.orm import Session
+import sys
+from typing import List, Optional
 
-from .models import Cake
+from sqlalchemy import (
+    Integer,
+    and_,
+    case,
+    delete,
+    func,
+    insert,
+    literal_column,
+    select,
+    text,
+    union_all,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from .models import (
+    CURRENT_MINUTE,
+    WRITE_RETENTION_MINUTES,
+    Cake,
+    CakeCount,
+    CakeWrite,
+)
 
-def create_cake(db: Session, cake_data: dict) -> Cake:
+# The reads select these columns as plain rows rather than loading `Cake` objects, which skips
+# building ORM instances and tracking them in the session. Rows have the same attributes.
+CAKE_COLUMNS = (Cake.id, Cake.name, Cake.comment, Cake.imageUrl, Cake.yumFactor)
+
+# The windows of the write rates, in minutes; the current minute counts as one
+WRITE_WINDOWS = {"lastMinute": 1, "lastHour": 60, "lastDay": WRITE_RETENTION_MINUTES}
+
+
+async def create_cake(db: AsyncSession, cake_data: dict) -> Cake:
     cake = Cake(**cake_data)
     db.add(cake)
-    db.commit()
-    db.refresh(cake)
+    await db.commit()
+    await db.refresh(cake)
     return cake
 
 
-def get_cake(db: Session, cake_id: int):
-    return db.query(Cake).filter(Cake.id == cake_id).first()
+async def get_cake(db: AsyncSession, cake_id: int):
+    statement = select(*CAKE_COLUMNS).where(Cake.id == cake_id)
+    return (await db.execute(statement)).first()
+
+
+def prefix_range(prefix: str):
+    """
+    The function returns the bounds of the strings that start with `prefix`, so that a prefix
+    filter is a range over the `name` index. The bounds only hold when strings are compared code
+    point by code point, see `name_starts_with`.
+
+    :return: a tuple of the lowest string and the first string above the range, or `None` when
+    no string is above it.
+    """
+    # U+10FFFF has no next character, so the range is bounded by the last character that has one
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, None
+    return prefix, stem[:-1] + chr(ord(stem[-1]) + 1)
+
+
+def name_starts_with(dialect: str, prefix: str):
+    """
+    The function returns the condition matching the cakes whose name starts with `prefix`, as a
+    range over a name index. Unlike `LIKE 'prefix%'`, a range uses the index on SQLite, where LIKE
+    ignores case. SQLite's default collation compares code points; Postgres compares in the
+    column's collation, where under a linguistic one such as en_US.UTF-8 'Abc' sorts between 'ab'
+    and 'ac'. There the range is compared in the "C" collation, on the `ix_cakes_name_c` index.
+    """
+    name = Cake.name.collate("C") if dialect == "postgresql" else Cake.name
+    lowest, above = prefix_range(prefix)
+    if above is None:
+        return name >= lowest
+    return and_(name >= lowest, name < above)
+
+
+def search_terms(search: str) -> str:
+    # Every word is quoted, so the punctuation FTS5 treats as syntax is searched for literally
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in search.split())
 
 
-def get_cakes(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Cake).offset(skip).limit(limit).all()
+def match_cakes(dialect: str, search: str):
+    """
+    The function returns the condition matching the cakes whose name or comment contains every
+    word of `search`, through the full-text index of the database.
+    """
+    if dialect == "postgresql":
+        return literal_column("cakes.search").op("@@")(
+            func.plainto_tsquery("english", search)
+        )
+    matches = text("SELECT rowid FROM cakes_fts WHERE cakes_fts MATCH :terms")
+    return Cake.id.in_(matches.bindparams(terms=search_terms(search)))
+
+
+def yum_factors(
+    yum_factor: Optional[int] = None,
+    min_yum_factor: Optional[int] = None,
+    max_yum_factor: Optional[int] = None,
+) -> List[int]:
+    """
+    The function returns the yum factors, between 1 and 5, that the yumFactor filters allow.
+    """
+    values = range(min_yum_factor or 1, (max_yum_factor or 5) + 1)
+    return [value for value in values if yum_factor in (None, value)]
+
+
+async def get_cakes(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    name: Optional[str] = None,
+    yum_factor: Optional[int] = None,
+    min_yum_factor: Optional[int] = None,
+    max_yum_factor: Optional[int] = None,
+    search: Optional[str] = None,
+):
+    # Seeking past the last seen id uses the primary key index, however deep the page is
+    query = select(*CAKE_COLUMNS).order_by(Cake.id)
+    if after_id is not None:
+        query = query.where(Cake.id > after_id)
+    if name:
+        query = query.where(name_starts_with(db.get_bind().dialect.name, name))
+    if search and search.strip():
+        query = query.where(match_cakes(db.get_bind().dialect.name, search))
+
+    values = yum_factors(yum_factor, min_yum_factor, max_yum_factor)
+    if not values:
+        return []
+    if len(values) == 1:
+        query = query.where(Cake.yumFactor == values[0])
+    elif len(values) < 5:
+        # The databases answer a range by reading every cake in it and sorting them by id.
+        # A seek on the (yumFactor, id) index for each value, merged, only reads the page.
+        pages = [
+            select(query.where(Cake.yumFactor == value).limit(skip + limit).subquery())
+            for value in values
+        ]
+        merged = union_all(*pages).subquery()
+        query = select(*merged.c).order_by(merged.c.id)
+
+    if skip:
+        query = query.offset(skip)
+    return (await db.execute(query.limit(limit))).all()
+
+
+async def update_cake(db: AsyncSession, cake_id: int, updated_cake_data: dict):
+    # A transient instance runs the model's validators, which an UPDATE statement bypasses
+    Cake(**updated_cake_data)
+    statement = (
+        update(Cake)
+        .where(Cake.id == cake_id)
+        .values(**updated_cake_data)
+        .returning(Cake)
+    )
+    # One UPDATE ... RETURNING: no row back means there is no such cake
+    db_cake = (await db.scalars(statement)).one_or_none()
+    await db.commit()
+    return db_cake
 
 
-def update_cake(db: Session, cake_id: int, updated_cake_data: dict):
-    db_cake = db.query(Cake).filter(Cake.id == cake_id).first()
-    if db_cake is None:
-        return None  # or raise an exception, depending on your design choice
-    for key, value in updated_cake_data.items():
-        setattr(db_cake, key, value)
-    db.commit()
+async def delete_cake(db: AsyncSession, cake_id: int):
+    # One DELETE ... RETURNING, which returns the deleted cake, or None when there is none
+    statement = delete(Cake).where(Cake.id == cake_id).returning(Cake)
+    db_cake = (await db.scalars(statement)).one_or_none()
+    await db.commit()
     return db_cake
 
 
-def delete_cake(db: Session, cake_id: int):
-    db_cake = db.query(Cake).filter(Cake.id == cake_id).first()
-    db.delete(db_cake)
-    db.commit()
+# The bulk functions below leave committing to the caller, so that a whole bulk request is applied
+# in a single transaction
+
+
+async def existing_cake_ids(db: AsyncSession, cake_ids: List[int]) -> set:
+    return set(await db.scalars(select(Cake.id).where(Cake.id.in_(cake_ids))))
+
+
+async def create_cakes(db: AsyncSession, cakes_data: List[dict]) -> List[int]:
+    # One executemany INSERT ... RETURNING for the whole list, ids in the order of the list
+    if not cakes_data:
+        return []
+    statement = insert(Cake).returning(Cake.id, sort_by_parameter_order=True)
+    return list(await db.scalars(statement, cakes_data))
+
+
+async def update_cakes(db: AsyncSession, updated_cakes_data: List[dict]):
+    # Each dictionary holds the id of the cake and its new values
+    if updated_cakes_data:
+        await db.execute(update(Cake), updated_cakes_data)
+
+
+async def delete_cakes(db: AsyncSession, cake_ids: List[int]):
+    if cake_ids:
+        await db.execute(delete(Cake).where(Cake.id.in_(cake_ids)))
+
+
+def current_minute(dialect: str):
+    return literal_column(CURRENT_MINUTE[dialect], Integer)
+
+
+async def get_cake_stats(db: AsyncSession) -> dict:
+    """
+    The function reads the statistics of the catalog from the summary tables kept by the
+    triggers on cakes: at most five counts and the write counts of the last day, whatever the
+    number of cakes.
+
+    :param db: The database session
+    :return: the total number of cakes, the number of each yumFactor, and the number of cakes
+    created, updated and deleted in each window of `WRITE_WINDOWS`.
+    """
+    counts = dict(
+        (await db.execute(select(CakeCount.yumFactor, CakeCount.count))).all()
+    )
+
+    now = current_minute(db.get_bind().dialect.name)
+    sums = [
+        func.sum(case((CakeWrite.minute > now - minutes, CakeWrite.count), else_=0))
+        for minutes in WRITE_WINDOWS.values()
+    ]
+    query = (
+        select(CakeWrite.operation, *sums)
+        .where(CakeWrite.minute > now - WRITE_RETENTION_MINUTES)
+        .group_by(CakeWrite.operation)
+    )
+    writes = {window: {} for window in WRITE_WINDOWS}
+    for operation, *totals in await db.execute(query):
+        for window, total in zip(WRITE_WINDOWS, totals):
+            writes[window][operation] = total
+
+    return {"total": sum(counts.values()), "yumFactors": counts, "writes": writes}
+
+
+async def rebuild_cake_stats(db: AsyncSession) -> int:
+    """
+    The function recounts the cakes of each yumFactor from the cakes table, e.g. after rows were
+    copied in with the triggers disabled, and drops the write counts older than a day. It reads
+    every cake, so it is a maintenance command rather than part of a request.
+
+    :param db: The database session
+    :return: the number of cakes.
+    """
+    # Updating the counts first holds back the writes, whose triggers update them too, until the
+    # recount commits; their changes then apply on top of it
+    await db.execute(update(CakeCount).values(count=0))
+    counts = select(Cake.yumFactor, func.count()).group_by(Cake.yumFactor)
+    counts = dict((await db.execute(counts)).all())
+    await db.execute(
+        update(CakeCount),
+        [{"yumFactor": value, "count": counts.get(value, 0)} for value in range(1, 6)],
+    )
+    now = current_minute(db.get_bind().dialect.name)
+    await db.execute(
+        delete(CakeWrite).where(CakeWrite.minute <= now - WRITE_RETENTION_MINUTES)
+    )
+    await db.commit()
+    return sum(counts.values())
@@ -1,13 +1,110 @@
 import os
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import NullPool, StaticPool
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./cake.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool: "queue" keeps up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections open,
+# "null" opens a connection per session (e.g. behind an external pooler such as PgBouncer)
+DB_POOL = os.getenv("DB_POOL", "queue")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Server databases only: connections are replaced after DB_POOL_RECYCLE seconds, and checked
+# before use so that connections dropped by the server are not handed out
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite only: set on every new connection. WAL lets readers carry on while a write is in
+# progress, and the busy timeout makes writers wait for the lock instead of failing
+# with "database is locked"
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative sizes are in KiB
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+}
+
+# The async driver of each backend, used when the database URL names a sync one (or none)
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def async_database_url(url):
+    """
+    The function returns a database URL that uses the async driver of its backend, so that
+    `DATABASE_URL` can keep the plain `sqlite://` or `postgresql://` form Alembic uses.
+
+    :param url: A database URL
+    :return: the URL, with an async driver.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if url.get_dialect().is_async or backend not in ASYNC_DRIVERS:
+        return url
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def pool_options(url, pool=None):
+    """
+    The function returns the connection pool options of an engine for its backend.
+
+    :param url: The database URL
+    :param pool: "queue" or "null", `DB_POOL` by default
+    :return: keyword arguments for `create_async_engine`.
+    """
+    pool = pool or DB_POOL
+    if pool == "null":
+        return {"poolclass": NullPool}
+    if pool != "queue":
+        raise ValueError(f"Unknown connection pool: {pool}")
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # Every connection to an in-memory database would get a database of its own
+        return {"poolclass": StaticPool}
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if url.get_backend_name() != "sqlite":
+        options["pool_recycle"] = DB_POOL_RECYCLE
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # The busy timeout goes first, as switching the journal mode may wait for a lock
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def make_engine(url=SQLALCHEMY_DATABASE_URL, pool=None, **kwargs):
+    """
+    The function creates the async engine of a database, with the connection pool of its
+    backend and, for SQLite, the pragmas of `SQLITE_PRAGMAS` set on every connection.
+
+    :param url: The database URL, `DATABASE_URL` by default
+    :param pool: "queue" or "null", `DB_POOL` by default
+    :param kwargs: Further arguments for `create_async_engine`
+    :return: the engine.
+    """
+    url = async_database_url(url)
+    engine = create_async_engine(url, **{**pool_options(url, pool), **kwargs})
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+engine = make_engine()
+# Objects stay loaded after a commit, since an async session cannot lazily refresh them
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
@@ -1,11 +1,35 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, FastAPI, HTTPException, status
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import crud
+from . import bulk, changes, crud, transfer
+from .cache import json_response, render, response_cache
 from .database import SessionLocal
-from .schemas import Cake, CakeCreate
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .schemas import (
+    BulkItemResult,
+    BulkResult,
+    Cake,
+    CakeBulkDelete,
+    CakeBulkUpdateItem,
+    CakeBulkWrite,
+    CakeCreate,
+    CakeStats,
+    ChangePage,
+    ImportResult,
+)
 
 description = (
     "This is a fancy Cake Bakery API. You can find all sorts of cakes here!\n\n"
@@ -36,15 +60,12 @@ app = FastAPI(
 router = APIRouter()
 
 
-def get_db():
+async def get_db():
     """
     The function returns a database session and ensures that it is closed after use.
     """
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 @router.post(
@@ -59,8 +80,178 @@ def get_db():
         We'll return you the cake you added with its unique ID.
         """,
 )
-def create_cake(cake: CakeCreate, db: Session = Depends(get_db)):
-    return crud.create_cake(db=db, cake_data=cake.model_dump())
+async def create_cake(cake: CakeCreate, db: AsyncSession = Depends(get_db)):
+    db_cake = await crud.create_cake(db=db, cake_data=cake.model_dump())
+    response_cache.invalidate()
+    return db_cake
+
+
+async def bulk_result(
+    db: AsyncSession, response: Response, atomic: bool, results: List[BulkItemResult]
+):
+    """
+    The function commits or rolls back the transaction of a bulk request and reports the result
+    of every item, in the order of the request. An all-or-nothing request with a failed item is
+    rolled back and answered with a 422 status.
+    """
+    results = sorted(results, key=lambda result: result.index)
+    failed = any(result.errors is not None for result in results)
+    if atomic and failed:
+        await db.rollback()
+        response.status_code = 422
+        return BulkResult(committed=False, results=bulk.skipped(results))
+    await db.commit()
+    response_cache.invalidate(result.id for result in results if result.errors is None)
+    return BulkResult(committed=True, results=results)
+
+
+bulk_description = """
+    Each item is validated on its own and the result of every item is returned, in the order
+    of the request. All the changes are applied in a single transaction. By default (`atomic`)
+    a single failed item rolls the whole request back, and the request fails with a 422 status;
+    with `atomic` set to false the valid items are applied and the failed ones reported.
+    At most 1000 items are accepted per request.
+    """
+
+
+@router.post(
+    "/cakes/bulk",
+    tags=["Cakes"],
+    response_model=BulkResult,
+    summary="Add many cakes",
+    description="Add many cakes to the bakery at once." + bulk_description,
+)
+async def create_cakes(
+    body: CakeBulkWrite, response: Response, db: AsyncSession = Depends(get_db)
+):
+    valid, results = bulk.validate_items(body.items, CakeCreate)
+    if valid and not (body.atomic and results):
+        cake_ids = await crud.create_cakes(db, [data for _, data in valid])
+        results += [
+            BulkItemResult(index=index, id=cake_id, status="created")
+            for (index, _), cake_id in zip(valid, cake_ids)
+        ]
+    else:
+        results += [BulkItemResult(index=index, status="created") for index, _ in valid]
+    return await bulk_result(db, response, body.atomic, results)
+
+
+@router.put(
+    "/cakes/bulk",
+    tags=["Cakes"],
+    response_model=BulkResult,
+    summary="Change many cakes",
+    description="Change many cakes at once, each item holding the `id` of the cake."
+    + bulk_description,
+)
+async def update_cakes(
+    body: CakeBulkWrite, response: Response, db: AsyncSession = Depends(get_db)
+):
+    valid, results = bulk.validate_items(body.items, CakeBulkUpdateItem)
+    existing = await crud.existing_cake_ids(db, [data["id"] for _, data in valid])
+    found = []
+    for index, data in valid:
+        if data["id"] in existing:
+            found.append((index, data))
+        else:
+            results.append(bulk.not_found(index, data["id"]))
+    if not (body.atomic and results):
+        await crud.update_cakes(db, [data for _, data in found])
+    results += [
+        BulkItemResult(index=index, id=data["id"], status="updated")
+        for index, data in found
+    ]
+    return await bulk_result(db, response, body.atomic, results)
+
+
+@router.delete(
+    "/cakes/bulk",
+    tags=["Cakes"],
+    response_model=BulkResult,
+    summary="Remove many cakes",
+    description="Remove many cakes from the bakery at once, by their unique IDs."
+    + bulk_description,
+)
+async def delete_cakes(
+    body: CakeBulkDelete, response: Response, db: AsyncSession = Depends(get_db)
+):
+    existing = await crud.existing_cake_ids(db, body.ids)
+    results = [
+        (
+            BulkItemResult(index=index, id=cake_id, status="deleted")
+            if cake_id in existing
+            else bulk.not_found(index, cake_id)
+        )
+        for index, cake_id in enumerate(body.ids)
+    ]
+    if not (body.atomic and len(existing) < len(set(body.ids))):
+        await crud.delete_cakes(db, list(existing))
+    return await bulk_result(db, response, body.atomic, results)
+
+
+@router.get(
+    "/cakes/export",
+    tags=["Cakes"],
+    response_class=StreamingResponse,
+    summary="Export all cakes",
+    description="""
+    Download every cake in the bakery, ordered by ID, as NDJSON (one JSON object per line) or
+    CSV with a header row. The dump is streamed as it is read from the database, however many
+    cakes there are.
+    """,
+)
+async def export_cakes(
+    format: Literal["ndjson", "csv"] = "ndjson", db: AsyncSession = Depends(get_db)
+):
+    return StreamingResponse(
+        transfer.export_cakes(db, format),
+        media_type=transfer.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="cakes.{format}"'},
+    )
+
+
+@router.post(
+    "/cakes/import",
+    tags=["Cakes"],
+    response_model=ImportResult,
+    summary="Import cakes",
+    description="""
+    Add the cakes of an NDJSON or CSV dump, as made by the export, sent as the request body.
+    The body is read as it arrives and the cakes are added in batches, one transaction each.
+    Invalid rows are skipped and reported by line number. With `keep_ids` the cakes keep the
+    IDs of the dump, to restore it into an empty bakery; otherwise they get new ones.
+    """,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {media_type: {} for media_type in transfer.FORMATS.values()},
+        }
+    },
+)
+async def import_cakes(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    keep_ids: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    result = await transfer.import_cakes(db, request.stream(), format, keep_ids)
+    response_cache.invalidate()
+    return result
+
+
+@router.get(
+    "/cakes/stats",
+    tags=["Cakes"],
+    response_model=CakeStats,
+    summary="Catalog statistics",
+    description="""
+    The number of cakes, in total and for each yumFactor, and the number of cakes created,
+    updated and deleted in the last minute, hour and day (the current minute counts as one).
+    The figures are kept up to date by every write, so they are read without counting cakes.
+    """,
+)
+async def read_cake_stats(db: AsyncSession = Depends(get_db)):
+    return await crud.get_cake_stats(db)
 
 
 @router.get(
@@ -70,11 +261,17 @@ def create_cake(cake: CakeCreate, db: Session = Depends(get_db)):
     summary="Retrieve a cake",
     description="Retrieve a cake from the bakery by providing it's unique ID.",
 )
-def read_cake(cake_id: int, db: Session = Depends(get_db)):
-    db_cake = crud.get_cake(db, cake_id=cake_id)
-    if db_cake is None:
-        raise HTTPException(status_code=404, detail="Cake not found")
-    return db_cake
+async def read_cake(cake_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    key = ("cake", cake_id)
+    rendered = response_cache.get(key)
+    if rendered is None:
+        generation = response_cache.generation
+        db_cake = await crud.get_cake(db, cake_id=cake_id)
+        if db_cake is None:
+            raise HTTPException(status_code=404, detail="Cake not found")
+        rendered = render(orjson.dumps(db_cake._asdict()))
+        response_cache.set(key, rendered, generation)
+    return json_response(request, rendered)
 
 
 @router.get(
@@ -83,13 +280,73 @@ def read_cake(cake_id: int, db: Session = Depends(get_db)):
     response_model=List[Cake],
     summary="List all cakes",
     description="""
-    Retrieve a list of all cakes in the bakery. 
-    You can provide a limit and skip parameter to paginate the results.
+    Retrieve a list of all cakes in the bakery, ordered by ID.
+    Pass the `after` cursor of the previous page, and optionally a `limit`, to page through them.
+    When there are more cakes, the cursor of the next page is returned in the `X-Next-Cursor`
+    header, and the URL of the next page in the `Link` header.
+    The `skip` parameter is still supported, but deep pages are faster with a cursor.
+    Narrow the list down with a `name` prefix, an exact `yumFactor` or a range of them, and
+    `q`, words to find in the name or comment of the cakes. The filters are kept in the URL of
+    the next page.
     """,
 )
-def read_cakes(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    cakes = crud.get_cakes(db, skip=skip, limit=limit)
-    return cakes
+async def read_cakes(
+    request: Request,
+    skip: int = 0,
+    limit: int = 10,
+    after: Optional[str] = None,
+    name: Optional[str] = Query(
+        None,
+        max_length=30,
+        description="Cakes whose name starts with this (case-sensitive)",
+    ),
+    yum_factor: Optional[int] = Query(None, alias="yumFactor", ge=1, le=5),
+    min_yum_factor: Optional[int] = Query(None, alias="minYumFactor", ge=1, le=5),
+    max_yum_factor: Optional[int] = Query(None, alias="maxYumFactor", ge=1, le=5),
+    q: Optional[str] = Query(
+        None,
+        max_length=100,
+        description="Cakes whose name or comment has all these words",
+    ),
+    db: AsyncSession = Depends(get_db),
+):
+    after_id = None
+    if after is not None:
+        try:
+            after_id = int(decode_cursor(after)["id"])
+        except (InvalidCursor, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    filters = {
+        "name": name,
+        "yum_factor": yum_factor,
+        "min_yum_factor": min_yum_factor,
+        "max_yum_factor": max_yum_factor,
+        "search": q,
+    }
+    key = ("page", skip, limit, after_id, *filters.values())
+    rendered = response_cache.get(key)
+    if rendered is None:
+        generation = response_cache.generation
+        # Fetch one extra cake to know whether there is a next page
+        cakes = await crud.get_cakes(
+            db, skip=skip, limit=limit + 1, after_id=after_id, **filters
+        )
+        has_next_page = len(cakes) > limit
+        cakes = cakes[: max(limit, 0)]
+        cursor = encode_cursor(id=cakes[-1].id) if has_next_page and cakes else None
+        body = orjson.dumps([cake._asdict() for cake in cakes])
+        rendered = render(body, next_cursor=cursor)
+        response_cache.set(key, rendered, generation)
+
+    headers = {}
+    if rendered.next_cursor is not None:
+        next_url = request.url.remove_query_params("skip").include_query_params(
+            after=rendered.next_cursor, limit=limit
+        )
+        headers["X-Next-Cursor"] = rendered.next_cursor
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return json_response(request, rendered, headers)
 
 
 @router.put(
@@ -99,10 +356,13 @@ def read_cakes(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
     summary="Change a cake",
     description="Change a cake in the bakery by providing it's unique ID and updated data.",
 )
-def update_cake(cake_id: int, cake: CakeCreate, db: Session = Depends(get_db)):
-    updated_cake = crud.update_cake(
+async def update_cake(
+    cake_id: int, cake: CakeCreate, db: AsyncSession = Depends(get_db)
+):
+    updated_cake = await crud.update_cake(
         db, cake_id=cake_id, updated_cake_data=cake.model_dump()
     )
+    response_cache.invalidate([cake_id])
     if updated_cake is None:
         raise HTTPException(status_code=404, detail="Cake not found")
     return updated_cake
@@ -115,12 +375,51 @@ def update_cake(cake_id: int, cake: CakeCreate, db: Session = Depends(get_db)):
     summary="Remove a cake",
     description="Remove a cake from the bakery by providing it's unique ID.",
 )
-def delete_cake(cake_id: int, db: Session = Depends(get_db)):
-    db_cake = crud.get_cake(db, cake_id=cake_id)
+async def delete_cake(cake_id: int, db: AsyncSession = Depends(get_db)):
+    db_cake = await crud.delete_cake(db, cake_id=cake_id)
+    response_cache.invalidate([cake_id])
     if db_cake is None:
         raise HTTPException(status_code=404, detail="Cake not found")
-    crud.delete_cake(db, cake_id=cake_id)
     return db_cake
 
 
+@router.get(
+    "/changes",
+    tags=["Changes"],
+    response_model=ChangePage,
+    summary="Follow the changes",
+    description="""
+    Page through the log of every cake created, updated and deleted, in order. Each change has
+    a sequence number `seq`; pass the `next` value of a page as `since` to get the changes that
+    followed, and keep polling with it once `hasMore` is false. Creations and updates hold the
+    cake as written, deletions only its `id` (`cake` is null).
+    The log is compacted: only the latest change of each cake is kept, and deletions only for a
+    few days. Start from `since=0` to get every cake; a consumer whose `since` is older than the
+    deletions kept gets a 410 error and has to start over from 0.
+    """,
+)
+async def read_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        # Fetch one extra change to know whether there are more
+        rows = await changes.get_changes(db, since=since, limit=limit + 1)
+    except changes.ChangesPurged:
+        raise HTTPException(
+            status_code=410, detail="Changes since this seq were compacted away"
+        )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    body = {
+        "changes": [changes.change_dict(row) for row in rows],
+        "next": rows[-1].seq if rows else since,
+        "hasMore": has_more,
+    }
+    return Response(
+        orjson.dumps(body, option=orjson.OPT_NAIVE_UTC), media_type="application/json"
+    )
+
+
 app.include_router(router, prefix="/api")
@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    event,
+)
 from sqlalchemy.orm import validates
 
 from .database import Base
@@ -12,6 +21,9 @@ class Cake(Base):
     imageUrl = Column(String, nullable=False)
     yumFactor = Column(Integer, nullable=False)
 
+    # Filtering on yumFactor while paging by id seeks straight to the next cakes
+    __table_args__ = (Index("ix_cakes_yumFactor_id", "yumFactor", "id"),)
+
     @validates("name")
     def validate_name(self, key, value):
         if len(value) > 30:
@@ -33,3 +45,278 @@ class Cake(Base):
         if not 1 <= value <= 5:
             raise ValueError("yumFactor must be between 1 and 5")
         return value
+
+
+# Full-text search over name and comment, which the model does not map: an FTS5 table kept in
+# sync by triggers on SQLite, a generated tsvector column with a GIN index on Postgres. The
+# Alembic migrations create the same objects.
+SQLITE_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS cakes_fts
+    USING fts5(name, comment, content='cakes', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cakes_fts_insert AFTER INSERT ON cakes BEGIN
+        INSERT INTO cakes_fts(rowid, name, comment) VALUES (new.id, new.name, new.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cakes_fts_delete AFTER DELETE ON cakes BEGIN
+        INSERT INTO cakes_fts(cakes_fts, rowid, name, comment)
+        VALUES ('delete', old.id, old.name, old.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cakes_fts_update AFTER UPDATE ON cakes BEGIN
+        INSERT INTO cakes_fts(cakes_fts, rowid, name, comment)
+        VALUES ('delete', old.id, old.name, old.comment);
+        INSERT INTO cakes_fts(rowid, name, comment) VALUES (new.id, new.name, new.comment);
+    END
+    """,
+]
+POSTGRES_SEARCH_DDL = [
+    """
+    ALTER TABLE cakes ADD COLUMN search tsvector GENERATED ALWAYS AS
+    (to_tsvector('english', name || ' ' || comment)) STORED
+    """,
+    "CREATE INDEX ix_cakes_search ON cakes USING gin (search)",
+]
+
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(
+        Cake.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(
+        Cake.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+# Name prefix filters compare in the "C" collation on Postgres, see `crud.name_starts_with`
+event.listen(
+    Cake.__table__,
+    "after_create",
+    DDL('CREATE INDEX ix_cakes_name_c ON cakes (name COLLATE "C")').execute_if(
+        dialect="postgresql"
+    ),
+)
+# The triggers go with the table, but the FTS5 table has to be dropped on its own
+event.listen(
+    Cake.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS cakes_fts").execute_if(dialect="sqlite"),
+)
+
+
+class CakeCount(Base):
+    # The number of cakes of each yumFactor, one row per value
+    __tablename__ = "cake_counts"
+    yumFactor = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class CakeWrite(Base):
+    # The number of cakes created, updated or deleted in each minute, for the write rates
+    __tablename__ = "cake_writes"
+    minute = Column(Integer, primary_key=True, autoincrement=False)
+    operation = Column(String(10), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# The catalog statistics are kept up to date by triggers on cakes, in the transaction of every
+# write however it is made, so reading them never counts the cakes. Minutes are counted since the
+# epoch, and the writes of the last day are kept. The Alembic migrations create the same objects.
+WRITE_RETENTION_MINUTES = 24 * 60
+CURRENT_MINUTE = {
+    "sqlite": "(CAST(strftime('%s', 'now') AS INTEGER) / 60)",
+    "postgresql": "(floor(extract(epoch FROM now()) / 60)::integer)",
+}
+
+SEED_COUNTS_DDL = 'INSERT INTO cake_counts ("yumFactor", count) VALUES {}'.format(
+    ", ".join(f"({value}, 0)" for value in range(1, 6))
+)
+
+
+def sqlite_stats_trigger(event, operation, count_change):
+    minute = CURRENT_MINUTE["sqlite"]
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS cake_stats_{event.lower()} AFTER {event} ON cakes BEGIN
+        {count_change};
+        INSERT INTO cake_writes (minute, operation, count) VALUES ({minute}, '{operation}', 1)
+        ON CONFLICT (minute, operation) DO UPDATE SET count = count + 1;
+        DELETE FROM cake_writes WHERE minute <= {minute} - {WRITE_RETENTION_MINUTES};
+    END
+    """
+
+
+SQLITE_STATS_DDL = [
+    sqlite_stats_trigger(
+        "INSERT",
+        "created",
+        'UPDATE cake_counts SET count = count + 1 WHERE "yumFactor" = new."yumFactor"',
+    ),
+    sqlite_stats_trigger(
+        "UPDATE",
+        "updated",
+        """
+        UPDATE cake_counts
+        SET count = count + ("yumFactor" = new."yumFactor") - ("yumFactor" = old."yumFactor")
+        WHERE "yumFactor" IN (old."yumFactor", new."yumFactor")
+        """,
+    ),
+    sqlite_stats_trigger(
+        "DELETE",
+        "deleted",
+        'UPDATE cake_counts SET count = count - 1 WHERE "yumFactor" = old."yumFactor"',
+    ),
+]
+POSTGRES_STATS_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION cake_stats_track() RETURNS trigger AS $$
+    DECLARE
+        current_minute integer := {CURRENT_MINUTE["postgresql"]};
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE cake_counts SET count = count - 1 WHERE "yumFactor" = OLD."yumFactor";
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE cake_counts SET count = count + 1 WHERE "yumFactor" = NEW."yumFactor";
+        END IF;
+        INSERT INTO cake_writes (minute, operation, count)
+        VALUES (
+            current_minute,
+            CASE TG_OP WHEN 'INSERT' THEN 'created' WHEN 'UPDATE' THEN 'updated' ELSE 'deleted' END,
+            1
+        )
+        ON CONFLICT (minute, operation) DO UPDATE SET count = cake_writes.count + 1;
+        DELETE FROM cake_writes WHERE minute <= current_minute - {WRITE_RETENTION_MINUTES};
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER cake_stats_track AFTER INSERT OR UPDATE OR DELETE ON cakes
+    FOR EACH ROW EXECUTE FUNCTION cake_stats_track()
+    """,
+]
+
+event.listen(CakeCount.__table__, "after_create", DDL(SEED_COUNTS_DDL))
+for statement in SQLITE_STATS_DDL:
+    # DDL formats its statement with %, which strftime uses too
+    statement = DDL(statement.replace("%", "%%"))
+    event.listen(Cake.__table__, "after_create", statement.execute_if(dialect="sqlite"))
+for statement in POSTGRES_STATS_DDL:
+    event.listen(
+        Cake.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+event.listen(
+    Cake.__table__,
+    "after_drop",
+    DDL("DROP FUNCTION IF EXISTS cake_stats_track()").execute_if(dialect="postgresql"),
+)
+
+
+class CakeChange(Base):
+    # One row per created, updated or deleted cake, in the order of `seq`. Creations and updates
+    # hold the cake as it was written; deletions are tombstones, with the id only.
+    __tablename__ = "cake_changes"
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    cake_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)
+    name = Column(String(30))
+    comment = Column(String(200))
+    imageUrl = Column(String)
+    yumFactor = Column(Integer)
+    changed_at = Column(DateTime(timezone=True), nullable=False)
+
+    # Compaction looks for newer changes of the same cake
+    __table_args__ = (Index("ix_cake_changes_cake_id_seq", "cake_id", "seq"),)
+
+
+class ChangeFeed(Base):
+    # A single row: the last sequence number handed out, and the highest one compaction removed
+    # a tombstone at, below which a consumer may have missed deletions
+    __tablename__ = "cake_change_feed"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    last_seq = Column(BigInteger, nullable=False, default=0)
+    purged_seq = Column(BigInteger, nullable=False, default=0)
+
+
+# The change log is written by triggers on cakes too. Every change first increments the feed row,
+# which stays locked until the write commits, so sequence numbers are handed out in commit order
+# and a consumer reading past a number never misses a change committed later with a lower one.
+SEED_FEED_DDL = (
+    "INSERT INTO cake_change_feed (id, last_seq, purged_seq) VALUES (1, 0, 0)"
+)
+
+
+def sqlite_changes_trigger(event, operation, row):
+    values = (
+        f'{row}.name, {row}.comment, {row}."imageUrl", {row}."yumFactor"'
+        if row == "new"
+        else "NULL, NULL, NULL, NULL"
+    )
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS cake_changes_{event.lower()} AFTER {event} ON cakes BEGIN
+        UPDATE cake_change_feed SET last_seq = last_seq + 1;
+        INSERT INTO cake_changes
+        (seq, cake_id, operation, name, comment, "imageUrl", "yumFactor", changed_at)
+        SELECT last_seq, {row}.id, '{operation}', {values}, CURRENT_TIMESTAMP
+        FROM cake_change_feed;
+    END
+    """
+
+
+SQLITE_CHANGES_DDL = [
+    sqlite_changes_trigger("INSERT", "created", "new"),
+    sqlite_changes_trigger("UPDATE", "updated", "new"),
+    sqlite_changes_trigger("DELETE", "deleted", "old"),
+]
+POSTGRES_CHANGES_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION cake_changes_track() RETURNS trigger AS $$
+    DECLARE
+        next_seq bigint;
+    BEGIN
+        UPDATE cake_change_feed SET last_seq = last_seq + 1 RETURNING last_seq INTO next_seq;
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO cake_changes (seq, cake_id, operation, changed_at)
+            VALUES (next_seq, OLD.id, 'deleted', now());
+        ELSE
+            INSERT INTO cake_changes
+            (seq, cake_id, operation, name, comment, "imageUrl", "yumFactor", changed_at)
+            VALUES (
+                next_seq,
+                NEW.id,
+                CASE TG_OP WHEN 'INSERT' THEN 'created' ELSE 'updated' END,
+                NEW.name,
+                NEW.comment,
+                NEW."imageUrl",
+                NEW."yumFactor",
+                now()
+            );
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER cake_changes_track AFTER INSERT OR UPDATE OR DELETE ON cakes
+    FOR EACH ROW EXECUTE FUNCTION cake_changes_track()
+    """,
+]
+
+event.listen(ChangeFeed.__table__, "after_create", DDL(SEED_FEED_DDL))
+for statement in SQLITE_CHANGES_DDL:
+    event.listen(
+        Cake.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+for statement in POSTGRES_CHANGES_DDL:
+    event.listen(
+        Cake.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+event.listen(
+    Cake.__table__,
+    "after_drop",
+    DDL("DROP FUNCTION IF EXISTS cake_changes_track()").execute_if(
+        dialect="postgresql"
+    ),
+)
@@ -0,0 +1,31 @@
+import base64
+import binascii
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(**keys) -> str:
+    """
+    The function turns the sort keys of the last item of a page into an opaque cursor, which the
+    client passes back to fetch the page that follows it.
+    """
+    raw = json.dumps(keys, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    The function reads the sort keys back from a cursor made by `encode_cursor`, and raises
+    `InvalidCursor` if the cursor was not made by it.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        keys = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(keys, dict):
+        raise InvalidCursor("Invalid cursor")
+    return keys
@@ -1,4 +1,10 @@
-from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+# The largest number of cakes accepted by one bulk request
+BULK_MAX_ITEMS = 1000
 
 
 class CakeBase(BaseModel):
@@ -15,7 +21,75 @@ class CakeCreate(CakeBase):
 
 
 class Cake(CakeBase):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+
+
+class CakeBulkUpdateItem(CakeCreate):
+    id: int
+
+
+class CakeBulkWrite(BaseModel):
+    # Items are validated one by one, so a bad item can be reported without failing the request
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+    atomic: bool = True
+
+
+class CakeBulkDelete(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+    atomic: bool = True
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    status: str
+    errors: Optional[List[Dict[str, Any]]] = None
+
+
+class BulkResult(BaseModel):
+    committed: bool
+    results: List[BulkItemResult]
+
+
+class ImportResult(BaseModel):
+    imported: int
+    failed: int
+    # The first invalid rows, by line number
+    errors: List[Dict[str, Any]]
+
+
+class WriteCounts(BaseModel):
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+class RecentWrites(BaseModel):
+    lastMinute: WriteCounts
+    lastHour: WriteCounts
+    lastDay: WriteCounts
+
+
+class CakeStats(BaseModel):
+    total: int
+    # The number of cakes of each yumFactor, from 1 to 5
+    yumFactors: Dict[int, int]
+    writes: RecentWrites
+
+
+class CakeChange(BaseModel):
+    seq: int
+    operation: Literal["created", "updated", "deleted"]
     id: int
+    changedAt: datetime
+    # The cake as written, or None for a deletion
+    cake: Optional[Cake]
+
 
-    class ConfigDict:
-        from_attributes = True
+class ChangePage(BaseModel):
+    changes: List[CakeChange]
+    # The `since` of the next request
+    next: int
+    hasMore: bool
@@ -0,0 +1,243 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterable, Tuple, Union
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import bulk, crud
+from .models import Cake
+from .schemas import CakeBulkUpdateItem, CakeCreate, ImportResult
+
+# The columns of a dump, in the order of the CSV header
+FIELDS = ("id", "name", "comment", "imageUrl", "yumFactor")
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# Rows read from the database, or written to it, at a time
+BATCH_SIZE = 1000
+# Invalid rows reported in detail by an import; the others are only counted
+MAX_REPORTED_ERRORS = 100
+# Bytes in one line of an import; a longer line is skipped and reported as an invalid row
+MAX_LINE_BYTES = 1024 * 1024
+
+
+async def export_cakes(
+    db: AsyncSession, format: str = "ndjson", batch_size: int = BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    The function streams every cake, ordered by id, as NDJSON or CSV. The rows are read through
+    a server-side cursor `batch_size` at a time, so memory use does not grow with the table.
+
+    :param db: The database session
+    :param format: "ndjson" or "csv"
+    :param batch_size: The number of rows read, and encoded into one chunk, at a time
+    :return: an async iterator of encoded chunks.
+    """
+    statement = (
+        select(*(getattr(Cake, field) for field in FIELDS))
+        .order_by(Cake.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(statement)
+    if format == "csv":
+        yield encode_csv([FIELDS])
+    async for rows in result.partitions():
+        if format == "csv":
+            yield encode_csv(rows)
+        else:
+            yield "".join(
+                json.dumps(dict(zip(FIELDS, row))) + "\n" for row in rows
+            ).encode()
+
+
+def encode_csv(rows: Iterable[tuple]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def read_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int = MAX_LINE_BYTES
+) -> AsyncIterator[Tuple[int, Union[str, ValueError]]]:
+    """
+    The function splits a stream of bytes into numbered lines, whatever the size of the chunks,
+    holding no more than one line (and one chunk) in memory. A line longer than
+    `max_line_bytes`, whose rest is skipped rather than kept, or that is not valid UTF-8 comes
+    as a ValueError in place of its text, so it can be reported as an invalid row.
+
+    :param chunks: An async iterator of bytes
+    :param max_line_bytes: The length, in bytes, past which a line is rejected
+    :return: an async iterator of line numbers and lines, or errors.
+    """
+    number = 0
+    pending = bytearray()
+    too_long = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if not too_long:
+                pending += chunk[start:] if end == -1 else chunk[start:end]
+                if len(pending) > max_line_bytes:
+                    too_long = True
+                    pending.clear()
+            if end == -1:
+                break
+            number += 1
+            yield number, decode_line(pending, too_long, max_line_bytes)
+            pending.clear()
+            too_long = False
+            start = end + 1
+    if pending or too_long:
+        yield number + 1, decode_line(pending, too_long, max_line_bytes)
+
+
+def decode_line(
+    line: bytearray, too_long: bool, max_line_bytes: int
+) -> Union[str, ValueError]:
+    if too_long:
+        return ValueError(f"Line is longer than {max_line_bytes} bytes")
+    try:
+        return line.decode()
+    except UnicodeDecodeError as e:
+        return ValueError(f"Line is not valid UTF-8: {e.reason} at byte {e.start}")
+
+
+async def parse_ndjson(lines) -> AsyncIterator[Tuple[int, object]]:
+    async for number, line in lines:
+        if isinstance(line, Exception):
+            yield number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, e
+
+
+async def parse_csv(lines) -> AsyncIterator[Tuple[int, object]]:
+    """
+    The function parses CSV with a header row into dictionaries, one record at a time. Quoted
+    values may hold line breaks, so lines are gathered until their quotes are balanced.
+    """
+    header = None
+    record, first = "", None
+    async for number, line in lines:
+        # A line that could not be read spoils the record it belongs to
+        if isinstance(line, Exception):
+            yield first or number, line
+            record, first = "", None
+            continue
+        record += line + "\n"
+        first = first or number
+        # Quotes inside values are doubled, so a complete record holds an even number of them
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record, start, first = "", first, None
+        if not values:
+            continue
+        if header is None:
+            header = values
+        elif len(values) != len(header):
+            yield start, ValueError(f"Expected {len(header)} values, got {len(values)}")
+        else:
+            yield start, dict(zip(header, values))
+    if record:
+        yield first, ValueError("Unterminated quoted value")
+
+
+async def import_cakes(
+    db: AsyncSession,
+    chunks: AsyncIterator[bytes],
+    format: str = "ndjson",
+    keep_ids: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> ImportResult:
+    """
+    The function reads cakes from a stream of NDJSON or CSV, as written by `export_cakes`, and
+    adds them in one transaction per `batch_size` rows. Invalid rows are skipped and reported
+    by line number; a batch the database rejects (e.g. an id that is already taken) is rolled
+    back and reported as a whole.
+
+    :param db: The database session
+    :param chunks: An async iterator of bytes
+    :param format: "ndjson" or "csv"
+    :param keep_ids: Whether to keep the ids of the rows, to restore a dump, or to number the
+    cakes anew
+    :param batch_size: The number of rows added per transaction
+    :return: the counts of imported and failed rows, and the first errors.
+    """
+    parse = parse_csv if format == "csv" else parse_ndjson
+    result = ImportResult(imported=0, failed=0, errors=[])
+    batch = []
+
+    async for number, item in parse(read_lines(chunks, MAX_LINE_BYTES)):
+        batch.append((number, item))
+        if len(batch) >= batch_size:
+            await _import_batch(db, batch, keep_ids, result)
+            batch = []
+    if batch:
+        await _import_batch(db, batch, keep_ids, result)
+
+    if keep_ids and db.get_bind().dialect.name == "postgresql":
+        # Explicit ids do not advance the sequence, which would then hand them out again
+        await db.execute(
+            text(
+                "SELECT setval(pg_get_serial_sequence('cakes', 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM cakes"
+            )
+        )
+        await db.commit()
+    return result
+
+
+async def _import_batch(db, batch, keep_ids, result):
+    numbers = [number for number, _ in batch]
+    items, failures = [], []
+    for number, item in batch:
+        if isinstance(item, Exception):
+            failures.append((number, [{"msg": str(item)}]))
+        elif not isinstance(item, dict):
+            failures.append((number, [{"msg": "Expected an object"}]))
+        else:
+            if not keep_ids:
+                item = {key: value for key, value in item.items() if key != "id"}
+            items.append((number, item))
+
+    schema = CakeBulkUpdateItem if keep_ids else CakeCreate
+    valid, invalid = bulk.validate_items([item for _, item in items], schema)
+    failures += [(items[entry.index][0], entry.errors) for entry in invalid]
+
+    result.failed += len(failures)
+    if valid:
+        try:
+            await crud.create_cakes(db, [data for _, data in valid])
+            await db.commit()
+            result.imported += len(valid)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            message = (
+                f"Rows {numbers[0]} to {numbers[-1]} rejected: {getattr(e, 'orig', e)}"
+            )
+            failures.append((numbers[0], [{"msg": message}]))
+            result.failed += len(valid)
+
+    failures.sort(key=lambda failure: failure[0])
+    for number, errors in failures[: MAX_REPORTED_ERRORS - len(result.errors)]:
+        result.errors.append({"line": number, "errors": errors})
+
+
+def iterate_file(file, chunk_size=64 * 1024) -> AsyncIterator[bytes]:
+    """
+    The function reads a binary file as an async iterator of chunks, for `import_cakes`.
+    """
+
+    async def _chunks():
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+    return _chunks()
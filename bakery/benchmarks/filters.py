@@ -0,0 +1,106 @@
+"""
+Time the filters of the cake list on a large cakes table.
+
+The table is filled with `--rows` cakes in a temporary SQLite database, each with a comment of a
+few words drawn from a vocabulary, then the first page of each filter is fetched through
+`crud.get_cakes`: a name prefix, yumFactor equality and range, full-text searches and their
+combinations. Every filter is answered from an index, so each page should take well under
+10 ms, whatever the size of the table.
+
+Usage (from the bakery directory):
+
+    python -m benchmarks.filters --rows 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud
+from app.database import Base, make_engine
+from app.models import Cake
+
+# Words a comment is made of, each in about 4 comments out of 1000
+VOCABULARY = [f"word{i}" for i in range(1000)]
+
+FILTERS = {
+    "name prefix": {"name": "Cake number 12345"},
+    "yumFactor =": {"yum_factor": 3},
+    "yumFactor range": {"min_yum_factor": 2, "max_yum_factor": 4},
+    "yumFactor = (deep)": {"yum_factor": 3, "after_id": "middle"},
+    "search, one word": {"search": "word42"},
+    "search, two words": {"search": "word42 word7"},
+    "search + yumFactor": {"search": "word42", "yum_factor": 5},
+    "prefix + search": {"name": "Cake number 9", "search": "word42"},
+}
+
+
+def fill(engine, rows, chunk=50_000, seed=0):
+    rng = random.Random(seed)
+    with engine.begin() as connection:
+        for start in range(0, rows, chunk):
+            connection.execute(
+                insert(Cake),
+                [
+                    {
+                        "name": f"Cake number {i}",
+                        "comment": " ".join(rng.sample(VOCABULARY, 4)),
+                        "imageUrl": "http://example.com/cake.jpg",
+                        "yumFactor": i % 5 + 1,
+                    }
+                    for i in range(start, min(start + chunk, rows))
+                ],
+            )
+
+
+async def time_filters(path, rows, limit, repeat):
+    engine = make_engine(f"sqlite:///{path}")
+    results = {}
+    async with async_sessionmaker(bind=engine)() as db:
+        for label, filters in FILTERS.items():
+            if filters.get("after_id") == "middle":
+                filters = {**filters, "after_id": rows // 2}
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                page = await crud.get_cakes(db, limit=limit, **filters)
+                timings.append((time.perf_counter() - start) * 1000)
+                db.expunge_all()
+            results[label] = (statistics.median(timings), max(timings), len(page))
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        start = time.perf_counter()
+        fill(engine, args.rows)
+        print(f"Inserted {args.rows} cakes in {time.perf_counter() - start:.1f} s\n")
+        engine.dispose()
+
+        results = asyncio.run(time_filters(path, args.rows, args.limit, args.repeat))
+
+    print(f"{'filter':<22}{'median ms':>11}{'max ms':>9}{'cakes':>7}")
+    for label, (median_ms, max_ms, count) in results.items():
+        flag = "" if median_ms < 10 else "  over 10 ms"
+        print(f"{label:<22}{median_ms:>11.2f}{max_ms:>9.2f}{count:>7}{flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Load test the bakery API over HTTP and report its requests per second.
+
+A uvicorn server is started on a temporary SQLite database filled with `--rows` cakes, then
+`--requests` requests are sent at each concurrency: mostly single cake reads, with some list
+pages and new cakes. The suite reports the requests per second, the latency percentiles and the
+number of failed requests, and can write them as JSON.
+
+To compare two versions of the API, serve each from its own checkout with `--app-dir`, e.g. the
+sync endpoints of an older commit against the async ones:
+
+    git worktree add /tmp/bakery-sync <commit>
+    python -m benchmarks.load --app-dir /tmp/bakery-sync/bakery --output sync.json
+    python -m benchmarks.load --output async.json
+
+Or point `--url` at a server that is already running. Usage (from the bakery directory):
+
+    python -m benchmarks.load --rows 10000 --requests 5000 --concurrency 1 16 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+from app.database import Base
+from benchmarks.pagination import fill
+
+# The share of each kind of request in the load
+MIX = (("read", 0.8), ("list", 0.15), ("create", 0.05))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_dir, database_path, workers):
+    port = free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database_path}"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)]
+        + ["--workers", str(workers), "--log-level", "warning"],
+        cwd=app_dir,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/api/cakes/", params={"limit": 1})
+            return server, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server did not start")
+
+
+def percentiles(timings):
+    timings = sorted(t * 1000 for t in timings)
+    quantiles = statistics.quantiles(timings, n=100)
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": quantiles[49],
+        "p90_ms": quantiles[89],
+        "p99_ms": quantiles[98],
+    }
+
+
+def plan(requests, rows, seed=0):
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    return [
+        (rng.choices(kinds, weights)[0], rng.randint(1, rows)) for _ in range(requests)
+    ]
+
+
+async def send(client, kind, cake_id):
+    if kind == "read":
+        return await client.get(f"/api/cakes/{cake_id}")
+    if kind == "list":
+        return await client.get("/api/cakes/", params={"skip": cake_id, "limit": 10})
+    return await client.post(
+        "/api/cakes/",
+        json={
+            "name": "Load cake",
+            "comment": "A cake for the load test",
+            "imageUrl": "http://example.com/cake.jpg",
+            "yumFactor": 3,
+        },
+    )
+
+
+async def run_load(url, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+
+        async def _send(kind, cake_id):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await send(client, kind, cake_id)
+                    failures += response.status_code >= 400
+                except httpx.HTTPError:
+                    failures += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(_send(*request) for request in requests))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(requests),
+        "failures": failures,
+        "requests_per_second": len(requests) / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Load an already running server instead")
+    parser.add_argument("--app-dir", default=".", help="The bakery checkout to serve")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--output", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        url = args.url
+        if url is None:
+            database_path = os.path.join(directory, "load.db")
+            engine = create_engine(f"sqlite:///{database_path}")
+            Base.metadata.create_all(bind=engine)
+            fill(engine, args.rows)
+            engine.dispose()
+            server, url = start_server(args.app_dir, database_path, args.workers)
+
+        try:
+            requests = plan(args.requests, args.rows)
+            # Warm the server and its connection pool up before measuring
+            asyncio.run(run_load(url, requests[:200], max(args.concurrency)))
+            results = [
+                asyncio.run(run_load(url, requests, concurrency))
+                for concurrency in args.concurrency
+            ]
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print(f"{'concurrency':>12}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'failed':>8}")
+    for run in results:
+        print(
+            f"{run['concurrency']:>12}{run['requests_per_second']:>10.1f}"
+            f"{run['latency']['p50_ms']:>9.1f}{run['latency']['p99_ms']:>9.1f}"
+            f"{run['failures']:>8}"
+        )
+
+    if args.output:
+        meta = {"url": args.url, "app_dir": args.app_dir, "rows": args.rows}
+        with open(args.output, "w") as file:
+            json.dump({"meta": meta, "results": results}, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
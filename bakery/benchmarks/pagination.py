@@ -0,0 +1,98 @@
+"""
+Compare offset pagination (`skip`) with keyset pagination (`after`) on a large cakes table.
+
+The table is filled with `--rows` cakes in a temporary SQLite database, then a page is fetched at
+increasing depths with both methods. Offset pages get slower the deeper they are, since every
+skipped row is still read; keyset pages seek straight to their first row through the primary key.
+
+Usage (from the bakery directory):
+
+    python -m benchmarks.pagination --rows 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import crud
+from app.database import Base
+from app.models import Cake
+
+
+def fill(engine, rows, chunk=50_000):
+    with engine.begin() as connection:
+        for start in range(0, rows, chunk):
+            connection.execute(
+                insert(Cake),
+                [
+                    {
+                        "name": f"Cake number {i}",
+                        "comment": "A cake for the benchmark",
+                        "imageUrl": "http://example.com/cake.jpg",
+                        "yumFactor": i % 5 + 1,
+                    }
+                    for i in range(start, min(start + chunk, rows))
+                ],
+            )
+
+
+async def time_page(fetch, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = await fetch()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), page
+
+
+async def compare(path, rows, limit, repeat):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with async_sessionmaker(bind=engine)() as db:
+        depths = [0, 1_000, 10_000, 100_000, rows // 2, rows - limit]
+        print(f"{'depth':>10}{'skip ms':>10}{'after ms':>10}{'speedup':>9}")
+        for depth in sorted(d for d in set(depths) if 0 <= d < rows):
+            # The id of the last cake before the page, as a cursor would carry it
+            after_id = None
+            if depth:
+                after_id = (await crud.get_cakes(db, skip=depth - 1, limit=1))[0].id
+            offset_ms, by_offset = await time_page(
+                lambda: crud.get_cakes(db, skip=depth, limit=limit), repeat
+            )
+            keyset_ms, by_keyset = await time_page(
+                lambda: crud.get_cakes(db, limit=limit, after_id=after_id), repeat
+            )
+            assert [c.id for c in by_offset] == [c.id for c in by_keyset]
+            print(
+                f"{depth:>10}{offset_ms:>10.2f}{keyset_ms:>10.2f}"
+                f"{offset_ms / keyset_ms:>8.1f}x"
+            )
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        start = time.perf_counter()
+        fill(engine, args.rows)
+        print(f"Inserted {args.rows} cakes in {time.perf_counter() - start:.1f} s\n")
+        engine.dispose()
+
+        asyncio.run(compare(path, args.rows, args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Compare the serialization of cake list pages: ORM objects validated through the response model,
+as the list endpoint used to answer, against column rows encoded with orjson, as it does now.
+
+The cakes table is filled with `--rows` cakes in a temporary SQLite database. For each page
+size, the suite times:
+
+- the read and encoding of a page on its own, both ways,
+- the requests per second of the whole list endpoint over ASGI, with the response cache off,
+  against a copy of the former endpoint (ORM objects returned through `response_model`).
+
+Usage (from the bakery directory):
+
+    python -m benchmarks.serialization --rows 100000 --pages 10 100 1000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import httpx
+import orjson
+from fastapi import Depends
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.cache import response_cache
+from app.database import Base, make_engine
+from app.main import app, get_db
+from app.models import Cake
+from app.schemas import Cake as CakeSchema
+from benchmarks.pagination import fill
+
+cake_list = TypeAdapter(List[CakeSchema])
+
+
+@app.get("/benchmark/orm-cakes/", response_model=List[CakeSchema])
+async def read_orm_cakes(skip: int = 0, limit: int = 10, db=Depends(get_db)):
+    # The list endpoint as it was: ORM objects, validated and encoded by FastAPI
+    query = select(Cake).order_by(Cake.id).offset(skip).limit(limit)
+    return list(await db.scalars(query))
+
+
+async def orm_page(db: AsyncSession, limit):
+    query = select(Cake).order_by(Cake.id).limit(limit)
+    cakes = list(await db.scalars(query))
+    body = cake_list.dump_json(cake_list.validate_python(cakes))
+    # Loaded objects stay in the session's identity map
+    db.expunge_all()
+    return body
+
+
+async def row_page(db: AsyncSession, limit):
+    cakes = await crud.get_cakes(db, limit=limit)
+    return orjson.dumps([cake._asdict() for cake in cakes])
+
+
+async def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def requests_per_second(client, path, limit, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        response = await client.get(path, params={"skip": i, "limit": limit})
+        response.raise_for_status()
+    return requests / (time.perf_counter() - start)
+
+
+async def compare(path, pages, repeat, requests):
+    engine = make_engine(f"sqlite:///{path}")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def _get_db():
+        async with sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = _get_db
+    response_cache.max_bytes = 0
+    transport = httpx.ASGITransport(app=app)
+
+    results = []
+    async with (
+        sessions() as db,
+        httpx.AsyncClient(transport=transport, base_url="http://bakery") as client,
+    ):
+        for limit in pages:
+            assert orjson.loads(await orm_page(db, limit)) == orjson.loads(
+                await row_page(db, limit)
+            )
+            orm_ms = await time_calls(lambda: orm_page(db, limit), repeat)
+            row_ms = await time_calls(lambda: row_page(db, limit), repeat)
+            orm_rps = await requests_per_second(
+                client, "/benchmark/orm-cakes/", limit, requests
+            )
+            row_rps = await requests_per_second(client, "/api/cakes/", limit, requests)
+            results.append((limit, orm_ms, row_ms, orm_rps, row_rps))
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        fill(engine, args.rows)
+        engine.dispose()
+
+        results = asyncio.run(compare(path, args.pages, args.repeat, args.requests))
+
+    print(f"{'':>6}{'page ms':>20}{'':>8}{'list endpoint req/s':>27}")
+    print(
+        f"{'limit':>6}{'orm':>10}{'rows':>10}{'speedup':>9}{'orm':>10}{'rows':>10}{'speedup':>9}"
+    )
+    for limit, orm_ms, row_ms, orm_rps, row_rps in results:
+        print(
+            f"{limit:>6}{orm_ms:>10.2f}{row_ms:>10.2f}{orm_ms / row_ms:>8.1f}x"
+            f"{orm_rps:>10.0f}{row_rps:>10.0f}{row_rps / orm_rps:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,50 @@
 # tests/conftest.py
 
+import asyncio
+
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from app.database import Base
+from app.cache import response_cache
+from app.database import Base, make_engine
 
 # Use a different database for testing
-TEST_DATABASE_URL = "sqlite:///./test.db"
+TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def run_sync(engine, fn):
+    async with engine.begin() as connection:
+        await connection.run_sync(fn)
 
 
 @pytest.fixture(scope="function")
 def test_engine():
-    # Create an SQLite engine for testing
-    engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+    # The test client runs every request in its own event loop, so connections are not pooled
+    engine = make_engine(TEST_DATABASE_URL, pool="null")
     return engine
 
 
 @pytest.fixture(scope="function")
 def setup_database(test_engine):
     # Create all tables
-    Base.metadata.create_all(bind=test_engine)
+    asyncio.run(run_sync(test_engine, Base.metadata.create_all))
     yield
     # Drop all tables after the test is done
-    Base.metadata.drop_all(bind=test_engine)
+    asyncio.run(run_sync(test_engine, Base.metadata.drop_all))
 
 
 @pytest.fixture(scope="function")
 def db_session(test_engine, setup_database):
-    SessionLocal = sessionmaker(bind=test_engine)
-    session = SessionLocal()
-    yield session
-    session.close()
+    # A factory rather than a session, so that every request opens its own
+    return async_sessionmaker(bind=test_engine, expire_on_commit=False)
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    # Every test starts from a new database, in which the cached ids mean other cakes
+    response_cache.clear()
@@ -10,8 +10,9 @@ client = TestClient(app)
 
 @pytest.fixture
 def override_get_db(db_session):
-    def _override_db():
-        yield db_session
+    async def _override_db():
+        async with db_session() as session:
+            yield session
 
     return _override_db
 
@@ -166,3 +167,337 @@ def test_create_cake_invalid_url(override_get_db):
         == "String should match pattern '^http[s]?://.+'"
     )
     assert response_json["detail"][0]["type"] == "string_pattern_mismatch"
+
+
+def create_cakes(count):
+    return [
+        client.post(
+            "/api/cakes/",
+            json={
+                "name": f"Cake number {i}",
+                "comment": "A paged cake",
+                "imageUrl": "http://example.com/cake.jpg",
+                "yumFactor": 3,
+            },
+        ).json()["id"]
+        for i in range(count)
+    ]
+
+
+def test_get_cakes_with_cursor(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(5)
+
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/api/cakes/", params=params)
+        assert response.status_code == 200
+        seen += [cake["id"] for cake in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert "after=" in response.headers["Link"]
+        params = {"limit": 2, "after": cursor}
+
+    assert seen == cake_ids
+
+
+def test_get_cakes_cursor_is_stable_under_deletes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(4)
+
+    first_page = client.get("/api/cakes/", params={"limit": 2})
+    client.delete(f"/api/cakes/{cake_ids[0]}")
+    second_page = client.get(
+        "/api/cakes/",
+        params={"limit": 2, "after": first_page.headers["X-Next-Cursor"]},
+    )
+
+    assert [cake["id"] for cake in second_page.json()] == cake_ids[2:]
+
+
+def test_get_cakes_with_skip(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(3)
+
+    response = client.get("/api/cakes/", params={"skip": 1, "limit": 1})
+
+    assert [cake["id"] for cake in response.json()] == cake_ids[1:2]
+
+
+def test_get_cakes_invalid_cursor(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.get("/api/cakes/", params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def cake_json(name, **changes):
+    return {
+        "name": name,
+        "comment": "A bulk cake",
+        "imageUrl": "http://example.com/cake.jpg",
+        "yumFactor": 3,
+        **changes,
+    }
+
+
+def test_bulk_create_cakes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.post(
+        "/api/cakes/bulk",
+        json={"items": [cake_json("Bulk Cake 1"), cake_json("Bulk Cake 2")]},
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["committed"] is True
+    assert [result["status"] for result in data["results"]] == ["created", "created"]
+    cake_id = data["results"][1]["id"]
+    assert client.get(f"/api/cakes/{cake_id}").json()["name"] == "Bulk Cake 2"
+
+
+def test_bulk_create_cakes_is_all_or_nothing(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.post(
+        "/api/cakes/bulk",
+        json={
+            "items": [
+                cake_json("Bulk Cake 1"),
+                cake_json("Bulk Cake 2", imageUrl="example.com/cake.jpg"),
+                # Too short for the model's own validation
+                cake_json("Tiny"),
+            ]
+        },
+    )
+
+    assert response.status_code == 422
+    data = response.json()
+    assert data["committed"] is False
+    assert [result["status"] for result in data["results"]] == [
+        "skipped",
+        "invalid",
+        "invalid",
+    ]
+    assert data["results"][1]["errors"][0]["loc"] == ["imageUrl"]
+    assert "fewer than 5 characters" in data["results"][2]["errors"][0]["msg"]
+    assert client.get("/api/cakes/").json() == []
+
+
+def test_bulk_create_cakes_best_effort(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.post(
+        "/api/cakes/bulk",
+        json={"items": [cake_json("Tiny"), cake_json("Bulk Cake 2")], "atomic": False},
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["committed"] is True
+    assert [result["status"] for result in data["results"]] == ["invalid", "created"]
+    assert [cake["name"] for cake in client.get("/api/cakes/").json()] == [
+        "Bulk Cake 2"
+    ]
+
+
+def test_bulk_update_cakes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(2)
+
+    response = client.put(
+        "/api/cakes/bulk",
+        json={
+            "items": [
+                cake_json("Updated Cake", id=cake_ids[0], yumFactor=5),
+                cake_json("Missing Cake", id=9999),
+            ],
+            "atomic": False,
+        },
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(result["id"], result["status"]) for result in results] == [
+        (cake_ids[0], "updated"),
+        (9999, "not_found"),
+    ]
+    cake = client.get(f"/api/cakes/{cake_ids[0]}").json()
+    assert (cake["name"], cake["yumFactor"]) == ("Updated Cake", 5)
+
+
+def test_bulk_update_cakes_rolls_back_on_missing_cake(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(1)
+
+    response = client.put(
+        "/api/cakes/bulk",
+        json={
+            "items": [
+                cake_json("Updated Cake", id=cake_ids[0]),
+                cake_json("Missing", id=9999),
+            ]
+        },
+    )
+
+    assert response.status_code == 422
+    assert [result["status"] for result in response.json()["results"]] == [
+        "skipped",
+        "not_found",
+    ]
+    assert client.get(f"/api/cakes/{cake_ids[0]}").json()["name"] == "Cake number 0"
+
+
+def test_bulk_delete_cakes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(3)
+
+    rejected = client.request(
+        "DELETE", "/api/cakes/bulk", json={"ids": [cake_ids[0], 9999]}
+    )
+    assert rejected.status_code == 422
+    assert len(client.get("/api/cakes/").json()) == 3
+
+    response = client.request("DELETE", "/api/cakes/bulk", json={"ids": cake_ids[:2]})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == [
+        "deleted"
+    ] * 2
+    assert [cake["id"] for cake in client.get("/api/cakes/").json()] == cake_ids[2:]
+
+
+def test_read_cake_conditional_get(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    (cake_id,) = create_cakes(1)
+
+    response = client.get(f"/api/cakes/{cake_id}")
+    etag = response.headers["ETag"]
+    not_modified = client.get(f"/api/cakes/{cake_id}", headers={"If-None-Match": etag})
+
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+    client.put(f"/api/cakes/{cake_id}", json=cake_json("Changed Cake"))
+    changed = client.get(f"/api/cakes/{cake_id}", headers={"If-None-Match": etag})
+
+    assert changed.status_code == 200
+    assert changed.json()["name"] == "Changed Cake"
+    assert changed.headers["ETag"] != etag
+
+
+def test_get_cakes_cache_is_invalidated_by_writes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(3)
+
+    first = client.get("/api/cakes/", params={"limit": 2})
+    cached = client.get(
+        "/api/cakes/",
+        params={"limit": 2},
+        headers={"If-None-Match": first.headers["ETag"]},
+    )
+    assert cached.status_code == 304
+    assert cached.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+    client.delete(f"/api/cakes/{cake_ids[0]}")
+    after_delete = client.get("/api/cakes/", params={"limit": 2})
+    assert [cake["id"] for cake in after_delete.json()] == cake_ids[1:]
+
+    assert len(client.get("/api/cakes/", params={"limit": 5}).json()) == 2
+    client.post("/api/cakes/bulk", json={"items": [cake_json("Bulk Cake 1")]})
+    assert len(client.get("/api/cakes/", params={"limit": 5}).json()) == 3
+
+
+def test_get_cakes_with_filters(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    client.post(
+        "/api/cakes/bulk",
+        json={
+            "items": [
+                cake_json("Lemon drizzle", comment="Sharp and sticky", yumFactor=4),
+                cake_json("Lemon meringue", comment="Fluffy and sharp", yumFactor=2),
+                cake_json("Chocolate fudge", comment="Rich and sticky", yumFactor=5),
+            ]
+        },
+    )
+
+    def names(**params):
+        return [
+            cake["name"] for cake in client.get("/api/cakes/", params=params).json()
+        ]
+
+    assert names(name="Lemon") == ["Lemon drizzle", "Lemon meringue"]
+    assert names(name="lemon") == []
+    assert names(yumFactor=5) == ["Chocolate fudge"]
+    assert names(minYumFactor=3, maxYumFactor=4) == ["Lemon drizzle"]
+    assert names(q="sticky") == ["Lemon drizzle", "Chocolate fudge"]
+    assert names(q="STICKY rich") == ["Chocolate fudge"]
+    assert names(q='sharp "drizzle') == ["Lemon drizzle"]
+    assert names(q="sticky", name="Lemon", yumFactor=4) == ["Lemon drizzle"]
+    # Case matters: upper case names sort apart from lower case ones, outside the range
+    client.post(
+        "/api/cakes/bulk",
+        json={
+            "items": [
+                cake_json("lemon posset", yumFactor=3),
+                cake_json("LEMON SURPRISE", yumFactor=3),
+                cake_json("LeMon curd tart", yumFactor=3),
+            ]
+        },
+    )
+    assert names(name="lem") == ["lemon posset"]
+    assert names(name="Lem") == ["Lemon drizzle", "Lemon meringue"]
+    assert names(name="LEM") == ["LEMON SURPRISE"]
+    # The highest code point has no successor to bound the range with
+    assert names(name="\U0010ffff") == []
+    assert names(name="Lemon\U0010ffff") == []
+
+
+def test_get_cakes_filters_follow_the_cursor(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    create_cakes(5)
+
+    first = client.get("/api/cakes/", params={"limit": 1, "name": "Cake number"})
+    assert "name=Cake+number" in first.headers["Link"]
+
+    response = client.get(
+        "/api/cakes/",
+        params={"limit": 1, "name": "Cake number 3"},
+    )
+    assert [cake["name"] for cake in response.json()] == ["Cake number 3"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_search_follows_updates_and_deletes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    (cake_id,) = create_cakes(1)
+
+    client.put(f"/api/cakes/{cake_id}", json=cake_json("Carrot cake", comment="Spiced"))
+    assert len(client.get("/api/cakes/", params={"q": "spiced"}).json()) == 1
+    assert client.get("/api/cakes/", params={"q": "paged"}).json() == []
+
+    client.delete(f"/api/cakes/{cake_id}")
+    assert client.get("/api/cakes/", params={"q": "spiced"}).json() == []
+
+
+def test_get_cakes_invalid_filter(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.get("/api/cakes/", params={"yumFactor": 6})
+    assert response.status_code == 422
+
+
+def test_cake_stats_follow_writes(override_get_db):
+    app.dependency_overrides[get_db] = override_get_db
+    cake_ids = create_cakes(3)
+    client.post("/api/cakes/bulk", json={"items": [cake_json("Bulk Cake 1")]})
+    client.put(f"/api/cakes/{cake_ids[0]}", json=cake_json("Changed Cake", yumFactor=5))
+    client.delete(f"/api/cakes/{cake_ids[1]}")
+    # A rolled back bulk request is not counted
+    client.request("DELETE", "/api/cakes/bulk", json={"ids": [cake_ids[2], 9999]})
+
+    response = client.get("/api/cakes/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["total"] == 3
+    assert stats["yumFactors"] == {"1": 0, "2": 0, "3": 2, "4": 0, "5": 1}
+    assert stats["writes"]["lastDay"] == {"created": 4, "updated": 1, "deleted": 1}
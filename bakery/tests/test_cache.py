@@ -0,0 +1,49 @@
+# tests/test_cache.py
+
+from app.cache import ResponseCache, render
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_bytes=10, ttl=60)
+    cache.set(("cake", 1), render(b"1234"), cache.generation)
+    cache.set(("cake", 2), render(b"5678"), cache.generation)
+    cache.get(("cake", 1))
+    cache.set(("cake", 3), render(b"9012"), cache.generation)
+
+    assert cache.get(("cake", 2)) is None
+    assert cache.get(("cake", 1)).body == b"1234"
+    assert cache.size == 8
+
+
+def test_response_cache_expires_entries():
+    cache = ResponseCache(max_bytes=10, ttl=0)
+    cache.set(("cake", 1), render(b"1234"), cache.generation)
+
+    assert cache.get(("cake", 1)) is None
+
+
+def test_response_cache_invalidates_cakes_and_pages():
+    cache = ResponseCache(max_bytes=100, ttl=60)
+    for key in [("cake", 1), ("cake", 2), ("page", 0, 10, None)]:
+        cache.set(key, render(b"[]"), cache.generation)
+
+    cache.invalidate([1])
+
+    assert cache.get(("cake", 1)) is None
+    assert cache.get(("page", 0, 10, None)) is None
+    assert cache.get(("cake", 2)) is not None
+
+
+def test_response_cache_drops_responses_read_before_a_write():
+    cache = ResponseCache(max_bytes=100, ttl=60)
+    generation = cache.generation
+    cache.invalidate([1])
+    cache.set(("cake", 1), render(b"{}"), generation)
+
+    assert cache.get(("cake", 1)) is None
+
+
+def test_render_etag_is_strong_and_follows_the_body():
+    assert render(b"{}").etag == render(b"{}").etag
+    assert render(b"{}").etag != render(b"[]").etag
+    assert render(b"{}").etag.startswith('"')
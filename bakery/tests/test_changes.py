@@ -0,0 +1,118 @@
+# tests/test_changes.py
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+from app import changes
+from app.main import app, get_db
+from app.models import CakeChange
+
+client = TestClient(app)
+
+
+def cake_json(name, **changes):
+    return {
+        "name": name,
+        "comment": "A followed cake",
+        "imageUrl": "http://example.com/cake.jpg",
+        "yumFactor": 3,
+        **changes,
+    }
+
+
+@pytest.fixture
+def api(db_session):
+    async def _override_db():
+        async with db_session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = _override_db
+    yield client
+    app.dependency_overrides.pop(get_db)
+
+
+def compact(db_session, retention_days=7, expire_tombstones=False):
+    async def _compact():
+        async with db_session() as db:
+            if expire_tombstones:
+                await db.execute(
+                    update(CakeChange).values(
+                        changed_at=datetime(2000, 1, 1, tzinfo=timezone.utc)
+                    )
+                )
+            return await changes.compact_changes(db, retention_days)
+
+    return asyncio.run(_compact())
+
+
+def read_all(api, since=0, limit=2):
+    pages = []
+    while True:
+        page = api.get("/api/changes", params={"since": since, "limit": limit}).json()
+        pages.append(page)
+        since = page["next"]
+        if not page["hasMore"]:
+            return pages
+
+
+def test_changes_follow_writes_in_order(api):
+    first = api.post("/api/cakes/", json=cake_json("First Cake")).json()["id"]
+    bulk = api.post(
+        "/api/cakes/bulk", json={"items": [cake_json("Bulk Cake 1")]}
+    ).json()
+    api.put(f"/api/cakes/{first}", json=cake_json("Changed Cake", yumFactor=5))
+    api.delete(f"/api/cakes/{first}")
+    # A rolled back bulk request leaves no change behind
+    api.request("DELETE", "/api/cakes/bulk", json={"ids": [first, 9999]})
+
+    pages = read_all(api)
+    log = [change for page in pages for change in page["changes"]]
+    assert [page["hasMore"] for page in pages] == [True, False]
+    assert [change["seq"] for change in log] == [1, 2, 3, 4]
+    assert [(change["operation"], change["id"]) for change in log] == [
+        ("created", first),
+        ("created", bulk["results"][0]["id"]),
+        ("updated", first),
+        ("deleted", first),
+    ]
+    assert log[2]["cake"]["yumFactor"] == 5
+    assert log[3]["cake"] is None
+    assert log[0]["changedAt"].endswith("+00:00")
+
+    caught_up = api.get("/api/changes", params={"since": 4}).json()
+    assert caught_up == {"changes": [], "next": 4, "hasMore": False}
+
+
+def test_compaction_keeps_latest_changes(api, db_session):
+    kept = api.post("/api/cakes/", json=cake_json("Kept Cake")).json()["id"]
+    gone = api.post("/api/cakes/", json=cake_json("Gone Cake")).json()["id"]
+    api.put(f"/api/cakes/{kept}", json=cake_json("Kept Cake", comment="Changed"))
+    api.delete(f"/api/cakes/{gone}")
+
+    assert compact(db_session) == (2, 0)
+    log = api.get("/api/changes").json()["changes"]
+    assert [(change["seq"], change["operation"]) for change in log] == [
+        (3, "updated"),
+        (4, "deleted"),
+    ]
+    assert log[0]["cake"]["comment"] == "Changed"
+    assert api.get("/api/changes", params={"since": 1}).status_code == 200
+
+
+def test_expired_tombstones_turn_old_consumers_away(api, db_session):
+    cake_ids = [
+        api.post("/api/cakes/", json=cake_json(f"Cake number {i}")).json()["id"]
+        for i in range(2)
+    ]
+    api.delete(f"/api/cakes/{cake_ids[0]}")
+
+    assert compact(db_session, expire_tombstones=True) == (1, 1)
+    assert api.get("/api/changes", params={"since": 1}).status_code == 410
+    assert api.get("/api/changes", params={"since": 3}).status_code == 200
+    # Starting over gets every cake there is
+    log = api.get("/api/changes", params={"since": 0}).json()["changes"]
+    assert [change["id"] for change in log] == [cake_ids[1]]
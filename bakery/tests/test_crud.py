@@ -1,35 +1,43 @@
 # tests/test_crud.py
 
+from contextlib import contextmanager
+
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import event, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app import crud
-from app.models import Base
+from app.models import Base, CakeCount
 
 # Test database URL (use an in-memory SQLite database for testing)
-TEST_DATABASE_URL = "sqlite:///:memory:"
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+
+pytestmark = pytest.mark.anyio
 
 
-@pytest.fixture(scope="module")
-def db_session():
+@pytest.fixture
+async def db_session():
     # Create an in-memory SQLite database for testing
-    engine = create_engine(TEST_DATABASE_URL, echo=True)
-    Base.metadata.create_all(bind=engine)
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = TestingSessionLocal()
-    yield db
-    db.close()
+    engine = create_async_engine(TEST_DATABASE_URL, echo=True)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    TestingSessionLocal = async_sessionmaker(
+        autoflush=False, bind=engine, expire_on_commit=False
+    )
+    async with TestingSessionLocal() as db:
+        yield db
+    await engine.dispose()
 
 
-def test_create_cake_valid_data(db_session: Session):
+async def test_create_cake_valid_data(db_session: AsyncSession):
     cake_data = {
         "name": "Test Cake",
         "comment": "Delicious",
         "imageUrl": "http://example.com/cake.jpg",
         "yumFactor": 4,
     }
-    cake = crud.create_cake(db_session, cake_data)
+    cake = await crud.create_cake(db_session, cake_data)
     assert cake.id is not None
     assert cake.name == cake_data["name"]
     assert cake.comment == cake_data["comment"]
@@ -37,7 +45,7 @@ def test_create_cake_valid_data(db_session: Session):
     assert cake.yumFactor == cake_data["yumFactor"]
 
 
-def test_create_cake_invalid_data(db_session: Session):
+async def test_create_cake_invalid_data(db_session: AsyncSession):
     invalid_cake_data = {
         "name": "x" * 35,
         "comment": "Too long name",
@@ -45,44 +53,44 @@ def test_create_cake_invalid_data(db_session: Session):
         "yumFactor": 6,
     }
     with pytest.raises(ValueError):
-        crud.create_cake(db_session, invalid_cake_data)
+        await crud.create_cake(db_session, invalid_cake_data)
 
 
-def test_get_cake(db_session: Session):
+async def test_get_cake(db_session: AsyncSession):
     cake_data = {
         "name": "Sample Cake",
         "comment": "Tasty",
         "imageUrl": "http://example.com/sample_cake.jpg",
         "yumFactor": 3,
     }
-    cake = crud.create_cake(db_session, cake_data)
-    retrieved_cake = crud.get_cake(db_session, cake.id)
+    cake = await crud.create_cake(db_session, cake_data)
+    retrieved_cake = await crud.get_cake(db_session, cake.id)
     assert retrieved_cake.id == cake.id
     assert retrieved_cake.name == cake.name
     assert retrieved_cake.comment == cake.comment
 
 
-def test_get_cakes(db_session: Session):
+async def test_get_cakes(db_session: AsyncSession):
     # Assuming there are already some cakes in the database
-    cakes = crud.get_cakes(db_session, skip=0, limit=2)
+    cakes = await crud.get_cakes(db_session, skip=0, limit=2)
     assert len(cakes) <= 2
 
 
-def test_update_cake(db_session: Session):
+async def test_update_cake(db_session: AsyncSession):
     cake_data = {
         "name": "Update Cake",
         "comment": "Before update",
         "imageUrl": "http://example.com/update_cake.jpg",
         "yumFactor": 4,
     }
-    cake = crud.create_cake(db_session, cake_data)
+    cake = await crud.create_cake(db_session, cake_data)
     updated_data = {
         "name": "Updated Cake",
         "comment": "After update",
         "imageUrl": "http://example.com/updated_cake.jpg",
         "yumFactor": 5,
     }
-    updated_cake = crud.update_cake(db_session, cake.id, updated_data)
+    updated_cake = await crud.update_cake(db_session, cake.id, updated_data)
     assert updated_cake.id == cake.id
     assert updated_cake.name == updated_data["name"]
     assert updated_cake.comment == updated_data["comment"]
@@ -90,7 +98,7 @@ def test_update_cake(db_session: Session):
     assert updated_cake.yumFactor == updated_data["yumFactor"]
 
 
-def test_update_non_existent_cake(db_session: Session):
+async def test_update_non_existent_cake(db_session: AsyncSession):
     non_existent_cake_id = 999  # An ID assumed not to exist
     updated_data = {
         "name": "Non-Existent Cake",
@@ -98,18 +106,177 @@ def test_update_non_existent_cake(db_session: Session):
         "imageUrl": "http://example.com/non_existent.jpg",
         "yumFactor": 3,
     }
-    result = crud.update_cake(db_session, non_existent_cake_id, updated_data)
+    result = await crud.update_cake(db_session, non_existent_cake_id, updated_data)
     assert result is None  # Assert that None is returned for a non-existent cake
 
 
-def test_delete_cake(db_session: Session):
+async def test_delete_cake(db_session: AsyncSession):
     cake_data = {
         "name": "Delete Cake",
         "comment": "To be deleted",
         "imageUrl": "http://example.com/delete_cake.jpg",
         "yumFactor": 2,
     }
-    cake = crud.create_cake(db_session, cake_data)
-    crud.delete_cake(db_session, cake.id)
-    deleted_cake = crud.get_cake(db_session, cake.id)
+    cake = await crud.create_cake(db_session, cake_data)
+    await crud.delete_cake(db_session, cake.id)
+    deleted_cake = await crud.get_cake(db_session, cake.id)
     assert deleted_cake is None
+
+
+async def test_bulk_create_update_and_delete(db_session: AsyncSession):
+    cakes_data = [
+        {
+            "name": f"Bulk Cake {i}",
+            "comment": "Made in bulk",
+            "imageUrl": "http://example.com/bulk_cake.jpg",
+            "yumFactor": 3,
+        }
+        for i in range(3)
+    ]
+    cake_ids = await crud.create_cakes(db_session, cakes_data)
+    await crud.update_cakes(db_session, [{"id": cake_ids[0], "yumFactor": 5}])
+    await crud.delete_cakes(db_session, cake_ids[1:])
+    await db_session.commit()
+
+    assert await crud.existing_cake_ids(db_session, cake_ids) == {cake_ids[0]}
+    cake = await crud.get_cake(db_session, cake_ids[0])
+    assert cake.yumFactor == 5
+
+
+async def test_cake_stats_follow_bulk_writes(db_session: AsyncSession):
+    cakes_data = [
+        {
+            "name": f"Counted Cake {i}",
+            "comment": "Counted by triggers",
+            "imageUrl": "http://example.com/counted_cake.jpg",
+            "yumFactor": i % 2 + 1,
+        }
+        for i in range(4)
+    ]
+    cake_ids = await crud.create_cakes(db_session, cakes_data)
+    await crud.update_cakes(db_session, [{"id": cake_ids[0], "yumFactor": 5}])
+    await crud.delete_cakes(db_session, cake_ids[1:2])
+    await db_session.commit()
+
+    stats = await crud.get_cake_stats(db_session)
+    assert stats["total"] == 3
+    assert stats["yumFactors"] == {1: 1, 2: 1, 3: 0, 4: 0, 5: 1}
+    assert stats["writes"]["lastHour"] == {"created": 4, "updated": 1, "deleted": 1}
+
+
+async def test_rebuild_cake_stats(db_session: AsyncSession):
+    await crud.create_cakes(
+        db_session,
+        [
+            {
+                "name": f"Recounted Cake {i}",
+                "comment": "Counted again",
+                "imageUrl": "http://example.com/recounted_cake.jpg",
+                "yumFactor": 4,
+            }
+            for i in range(2)
+        ],
+    )
+    await db_session.execute(update(CakeCount).values(count=7))
+    await db_session.commit()
+
+    assert await crud.rebuild_cake_stats(db_session) == 2
+    stats = await crud.get_cake_stats(db_session)
+    assert stats["yumFactors"] == {1: 0, 2: 0, 3: 0, 4: 2, 5: 0}
+
+
+@contextmanager
+def count_statements(db_session: AsyncSession):
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0])
+
+    engine = db_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+
+async def test_update_and_delete_are_single_statements(db_session: AsyncSession):
+    cake_data = {
+        "name": "Single Cake",
+        "comment": "One statement each",
+        "imageUrl": "http://example.com/single_cake.jpg",
+        "yumFactor": 2,
+    }
+    cake = await crud.create_cake(db_session, cake_data)
+
+    with count_statements(db_session) as statements:
+        updated_cake = await crud.update_cake(
+            db_session, cake.id, {**cake_data, "yumFactor": 4}
+        )
+        deleted_cake = await crud.delete_cake(db_session, cake.id)
+        missing_cake = await crud.delete_cake(db_session, cake.id)
+
+    assert statements == ["UPDATE", "DELETE", "DELETE"]
+    assert updated_cake.yumFactor == deleted_cake.yumFactor == 4
+    assert missing_cake is None
+
+
+async def test_update_cake_invalid_data(db_session: AsyncSession):
+    invalid_cake_data = {
+        "name": "Tiny",
+        "comment": "Too short a name",
+        "imageUrl": "http://example.com/cake.jpg",
+        "yumFactor": 3,
+    }
+    with pytest.raises(ValueError):
+        await crud.update_cake(db_session, 1, invalid_cake_data)
+
+
+async def test_get_cakes_yum_factor_range_pages(db_session: AsyncSession):
+    cake_ids = await crud.create_cakes(
+        db_session,
+        [
+            {
+                "name": f"Range Cake {i}",
+                "comment": "In a range",
+                "imageUrl": "http://example.com/range_cake.jpg",
+                "yumFactor": i % 5 + 1,
+            }
+            for i in range(20)
+        ],
+    )
+    await db_session.commit()
+    in_range = [cake_id for i, cake_id in enumerate(cake_ids) if 2 <= i % 5 + 1 <= 4]
+
+    async def page(**kwargs):
+        cakes = await crud.get_cakes(
+            db_session, name="Range Cake", min_yum_factor=2, max_yum_factor=4, **kwargs
+        )
+        return [cake.id for cake in cakes]
+
+    assert await page(limit=100) == in_range
+    assert await page(limit=4, skip=3) == in_range[3:7]
+    assert await page(limit=4, after_id=in_range[5]) == in_range[6:10]
+    assert await page(limit=4, yum_factor=3) == in_range[1::3][:4]
+    assert await page(limit=4, yum_factor=5) == []
+
+
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("Lemon", ("Lemon", "Lemoo")),
+        ("Lemon\U0010ffff", ("Lemon\U0010ffff", "Lemoo")),
+        ("\U0010ffff\U0010ffff", ("\U0010ffff\U0010ffff", None)),
+    ],
+)
+def test_prefix_range(prefix, expected):
+    assert crud.prefix_range(prefix) == expected
+
+
+def test_name_starts_with_compares_code_points_on_postgres():
+    condition = crud.name_starts_with("postgresql", "ab")
+
+    sql = str(condition.compile(dialect=postgresql.dialect()))
+    assert sql.count('(cakes.name COLLATE "C") >=') == 1
+    assert sql.count('(cakes.name COLLATE "C") <') == 1
+    assert "COLLATE" not in str(crud.name_starts_with("sqlite", "ab"))
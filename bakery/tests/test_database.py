@@ -0,0 +1,91 @@
+# tests/test_database.py
+
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.pool import NullPool, StaticPool
+
+from app import crud
+from app.database import (
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    Base,
+    async_database_url,
+    make_engine,
+    pool_options,
+)
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("sqlite:///./cake.db", "sqlite+aiosqlite:///./cake.db"),
+        ("sqlite+aiosqlite:///./cake.db", "sqlite+aiosqlite:///./cake.db"),
+        ("postgresql://cake@db/bakery", "postgresql+asyncpg://cake@db/bakery"),
+        ("postgresql+psycopg2://cake@db/bakery", "postgresql+asyncpg://cake@db/bakery"),
+        ("postgresql+asyncpg://cake@db/bakery", "postgresql+asyncpg://cake@db/bakery"),
+    ],
+)
+def test_async_database_url(url, expected):
+    assert str(async_database_url(url)) == expected
+
+
+def test_pool_options():
+    sqlite = pool_options(make_url("sqlite+aiosqlite:///./cake.db"))
+    postgres = pool_options(make_url("postgresql+asyncpg://cake@db/bakery"))
+
+    assert sqlite["pool_size"] == postgres["pool_size"] == DB_POOL_SIZE
+    # Only connections to a server go stale
+    assert "pool_pre_ping" not in sqlite
+    assert postgres["pool_pre_ping"] is True
+    assert postgres["pool_recycle"] == DB_POOL_RECYCLE
+    assert pool_options(make_url("sqlite+aiosqlite://")) == {"poolclass": StaticPool}
+    assert pool_options(make_url("sqlite+aiosqlite:///./cake.db"), pool="null") == {
+        "poolclass": NullPool
+    }
+
+
+@pytest.mark.anyio
+async def test_make_engine_sets_sqlite_pragmas(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'cake.db'}")
+    try:
+        async with engine.connect() as connection:
+            pragmas = {
+                pragma: await connection.scalar(text(f"PRAGMA {pragma}"))
+                for pragma in ("journal_mode", "synchronous", "busy_timeout")
+            }
+    finally:
+        await engine.dispose()
+
+    # synchronous=NORMAL reads back as 1
+    assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000}
+
+
+@pytest.mark.anyio
+async def test_concurrent_writers_wait_for_the_lock(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'cake.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def _create(i):
+        async with sessions() as db:
+            return await crud.create_cake(
+                db,
+                {
+                    "name": f"Concurrent {i}",
+                    "comment": "Written alongside others",
+                    "imageUrl": "http://example.com/cake.jpg",
+                    "yumFactor": 3,
+                },
+            )
+
+    try:
+        cakes = await asyncio.gather(*(_create(i) for i in range(30)))
+    finally:
+        await engine.dispose()
+
+    assert len({cake.id for cake in cakes}) == 30
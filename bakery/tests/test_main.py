@@ -1,14 +1,16 @@
-from sqlalchemy.orm import Session
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.main import get_db
 
 
-def test_get_db():
+@pytest.mark.anyio
+async def test_get_db():
     generator = get_db()
-    db = next(generator)
+    db = await anext(generator)
     try:
-        assert isinstance(db, Session)
+        assert isinstance(db, AsyncSession)
     finally:
         # It's important to ensure the generator is properly exhausted
-        # to trigger the cleanup code (db.close() in this case).
-        next(generator, None)
+        # to trigger the cleanup code (closing the session in this case).
+        await anext(generator, None)
@@ -73,3 +73,16 @@ def test_yum_factor_range():
             imageUrl="http://example.com/cake.jpg",
             yumFactor=6,
         )
+
+
+def test_cake_schema_reads_attributes():
+    from app.schemas import Cake as CakeSchema
+
+    cake = Cake(
+        id=1,
+        name="Test Cake",
+        comment="Read from attributes",
+        imageUrl="http://example.com/cake.jpg",
+        yumFactor=3,
+    )
+    assert CakeSchema.model_validate(cake).name == "Test Cake"
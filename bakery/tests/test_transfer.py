@@ -0,0 +1,158 @@
+# tests/test_transfer.py
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import cli
+from app.main import app, get_db
+from app.transfer import parse_csv, read_lines
+
+client = TestClient(app)
+
+CAKES = [
+    {
+        "name": "Lemon drizzle",
+        "comment": 'A "sharp" cake,\nwith a crust',
+        "imageUrl": "http://example.com/lemon.jpg",
+        "yumFactor": 4,
+    },
+    {
+        "name": "Chocolate fudge",
+        "comment": "Rich and sticky",
+        "imageUrl": "http://example.com/fudge.jpg",
+        "yumFactor": 5,
+    },
+]
+
+
+@pytest.fixture
+def api(db_session):
+    async def _override_db():
+        async with db_session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = _override_db
+    client.post("/api/cakes/bulk", json={"items": CAKES})
+    yield client
+    app.dependency_overrides.pop(get_db)
+
+
+async def chunked(data, size):
+    for start in range(0, len(data), size):
+        end = start + size
+        yield data[start:end]
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_read_lines_across_chunks():
+    lines = asyncio.run(collect(read_lines(chunked("één\ntwee\n\ndrie".encode(), 3))))
+    assert lines == [(1, "één"), (2, "twee"), (3, ""), (4, "drie")]
+
+
+def test_read_lines_rejects_long_and_undecodable_lines():
+    data = b"short\n" + b"x" * 20 + b"\n\xff\xfe\nlast"
+    lines = asyncio.run(collect(read_lines(chunked(data, 3), max_line_bytes=10)))
+
+    assert [number for number, _ in lines] == [1, 2, 3, 4]
+    assert (lines[0][1], lines[3][1]) == ("short", "last")
+    assert "longer than 10 bytes" in str(lines[1][1])
+    assert "not valid UTF-8" in str(lines[2][1])
+
+
+def test_parse_csv_multiline_values():
+    data = b'name,comment\nLemon,"A ""sharp"" cake,\nwith a crust"\nFudge\n'
+    rows = asyncio.run(collect(parse_csv(read_lines(chunked(data, 5)))))
+
+    assert rows[0] == (2, {"name": "Lemon", "comment": 'A "sharp" cake,\nwith a crust'})
+    assert rows[1][0] == 4
+    assert isinstance(rows[1][1], ValueError)
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_export_and_import_round_trip(api, format):
+    export = api.get("/api/cakes/export", params={"format": format})
+    assert export.status_code == 200
+    assert export.headers["content-type"].startswith(
+        "application/x-ndjson" if format == "ndjson" else "text/csv"
+    )
+
+    response = api.post(
+        "/api/cakes/import", params={"format": format}, content=export.content
+    )
+
+    assert response.json() == {"imported": 2, "failed": 0, "errors": []}
+    cakes = api.get("/api/cakes/").json()
+    assert [cake["id"] for cake in cakes] == [1, 2, 3, 4]
+    assert [{k: v for k, v in cake.items() if k != "id"} for cake in cakes] == CAKES * 2
+
+
+def test_export_ndjson_lines(api):
+    lines = api.get("/api/cakes/export").text.splitlines()
+    assert [json.loads(line)["name"] for line in lines] == [
+        "Lemon drizzle",
+        "Chocolate fudge",
+    ]
+
+
+def test_import_reports_invalid_rows(api):
+    body = "\n".join(
+        [
+            json.dumps({**CAKES[0], "name": "Carrot cake"}),
+            "{not json",
+            json.dumps({**CAKES[0], "yumFactor": 9}),
+            json.dumps({**CAKES[0], "name": "Tiny"}),
+        ]
+    )
+
+    result = api.post("/api/cakes/import", content=body).json()
+
+    assert (result["imported"], result["failed"]) == (1, 3)
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4]
+
+
+def test_import_reports_unreadable_lines(api, monkeypatch):
+    monkeypatch.setattr("app.transfer.MAX_LINE_BYTES", 200)
+    body = b"\n".join(
+        [
+            json.dumps({**CAKES[0], "comment": "x" * 300}).encode(),
+            b'{"name": "\xff"}',
+            json.dumps({**CAKES[0], "name": "Carrot cake"}).encode(),
+        ]
+    )
+
+    result = api.post("/api/cakes/import", content=body).json()
+
+    assert (result["imported"], result["failed"]) == (1, 2)
+    assert [error["line"] for error in result["errors"]] == [1, 2]
+    assert "longer than 200 bytes" in result["errors"][0]["errors"][0]["msg"]
+
+
+def test_import_keep_ids_rejects_taken_ids(api):
+    export = api.get("/api/cakes/export").content
+
+    result = api.post("/api/cakes/import", params={"keep_ids": True}, content=export)
+
+    assert (result.json()["imported"], result.json()["failed"]) == (0, 2)
+    assert len(api.get("/api/cakes/").json()) == 2
+
+
+def test_cli_export_and_restore(api, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "SessionLocal", db_session)
+    dump = tmp_path / "cakes.csv"
+
+    assert cli.main(["export", "--output", str(dump)]) == 0
+    assert dump.read_text().splitlines()[0] == "id,name,comment,imageUrl,yumFactor"
+    api.request("DELETE", "/api/cakes/bulk", json={"ids": [1, 2]})
+    assert cli.main(["import", str(dump), "--keep-ids", "--batch-size", "1"]) == 0
+
+    cakes = api.get("/api/cakes/").json()
+    assert [(cake["id"], cake["name"]) for cake in cakes] == [
+        (1, "Lemon drizzle"),
+        (2, "Chocolate fudge"),
+    ]
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import deque
+
+from starlette.concurrency import run_in_threadpool
+
+from .interpreters import run_batch, run_inference
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """
+    Groups concurrent inference requests into batches. Images submitted while the interpreters are
+    busy, or within `max_wait_ms` of the first image of a batch, are written into one input tensor
+    and run through the model with a single `invoke()`. Each caller gets back its own slice of the
+    output.
+
+    At most one batch per interpreter in the pool is in flight at a time, so requests that arrive
+    while every interpreter is busy simply accumulate into the next batch.
+
+    :param pool: The `InterpreterPool` used to run the batches
+    :param max_batch_size: The maximum number of images in a batch
+    :param max_wait_ms: How long to wait for a batch to fill up before sending it anyway
+    """
+
+    def __init__(self, pool, max_batch_size=1, max_wait_ms=0.0):
+        if max_batch_size < 1:
+            raise ValueError("The maximum batch size must be at least 1")
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Cleared when the model turns out to have a fixed batch dimension
+        self.batchable = True
+        self._loop = None
+        self._task = None
+
+    def _ensure_started(self):
+        # The collector task belongs to the event loop of the caller that started it
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._pending = deque()
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.pool.size)
+        self._task = loop.create_task(self._collect())
+
+    async def submit(self, image):
+        """
+        Queue a preprocessed image for inference and wait for its result.
+
+        :param image: A preprocessed image of shape (1, height, width, 3)
+        :return: the model output for this image, with a batch dimension of one.
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._pending.append((image, future))
+        self._arrived.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _collect(self):
+        while True:
+            # Wait for an idle interpreter before gathering the next batch
+            await self._slots.acquire()
+            while not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                image, future = self._pending.popleft()
+                # Skip requests whose client has already gone away
+                if not future.cancelled():
+                    batch.append((image, future))
+
+            if batch:
+                self._loop.create_task(self._dispatch(batch))
+            else:
+                self._slots.release()
+
+    async def _dispatch(self, batch):
+        try:
+            outputs = await run_in_threadpool(
+                self._infer, [image for image, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+        finally:
+            self._slots.release()
+
+    def _infer(self, images):
+        with self.pool.checkout() as interpreter:
+            if self.batchable and len(images) > 1:
+                if any(image.shape != images[0].shape for image in images):
+                    raise ValueError("Images of different sizes cannot be batched")
+                try:
+                    output_data = run_batch(interpreter, images)
+                    # Keep the batch dimension of every image's output
+                    return [output_data[i, None] for i in range(len(images))]
+                except (RuntimeError, ValueError) as e:
+                    logger.warning(
+                        "Model does not accept batched input, running images one by one: %s",
+                        e,
+                    )
+                    self.batchable = False
+
+            return [run_inference(interpreter, image) for image in images]
+
+    async def close(self):
+        """
+        Stop gathering batches and fail any request that is still waiting to be scheduled.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("The batch scheduler was stopped"))
+        self._task = None
+        self._loop = None
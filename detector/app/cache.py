@@ -0,0 +1,281 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import suppress
+
+import numpy as np
+
+
+def content_key(data):
+    """
+    The function `content_key` identifies an image by the hash of its encoded bytes, so the same
+    picture served from different URLs shares a single cache entry.
+
+    :param data: The encoded image bytes
+    :return: the hex digest of the bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe, in-process least recently used cache. Entries expire `ttl` seconds after they
+    were stored, and the least recently used entries are evicted once the total size of the stored
+    values exceeds `max_bytes`.
+
+    :param max_bytes: The maximum total size of the values kept in the cache
+    :param ttl: The number of seconds an entry stays valid
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """
+    A small SQLite-backed key/value store shared by every worker process on the host. SQLite's WAL
+    mode lets the workers read concurrently while one of them writes.
+
+    Expired entries are purged at most every `purge_interval` seconds, on write. Whenever the
+    entries take up more than `max_bytes`, the ones closest to expiry, that is the oldest, are
+    evicted first.
+
+    :param path: The path of the SQLite database file
+    :param ttl: The number of seconds an entry stays valid
+    :param max_bytes: The maximum size of the pages holding entries. `None` for no limit
+    :param purge_interval: The minimum number of seconds between two purges of expired entries
+    """
+
+    def __init__(self, path, ttl, max_bytes=None, purge_interval=60):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)"
+            )
+            self._purge(time.time())
+            self._page_size = self._pragma("page_size")
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl),
+            )
+            if now >= self._next_purge:
+                self._purge(now)
+            if self.max_bytes is not None:
+                self._evict()
+
+    @property
+    def size(self):
+        """
+        The number of bytes of the database pages in use, including the free space inside them.
+        """
+        with self._lock:
+            return self._size()
+
+    def _pragma(self, name):
+        return self._connection.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def _size(self):
+        # Both counts are kept in the database header, so this does not scan the entries
+        pages = self._pragma("page_count") - self._pragma("freelist_count")
+        return pages * self._page_size
+
+    def _purge(self, now):
+        self._connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        self._next_purge = now + self.purge_interval
+
+    def _evict(self):
+        # Pages emptied by a deletion go back to the free list and are reused by later writes, so
+        # the file stops growing once the entries fit again
+        while self._size() > self.max_bytes:
+            count = self._connection.execute("SELECT count(*) FROM entries").fetchone()[
+                0
+            ]
+            if not count:
+                return
+            self._connection.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY expires LIMIT ?)",
+                (max(1, count // 10),),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def remove(self):
+        """
+        Close the store and delete its database file, along with SQLite's WAL and shared memory
+        files.
+        """
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            with suppress(FileNotFoundError):
+                os.remove(self.path + suffix)
+
+
+class DetectionCache:
+    """
+    Caches the per-class pixel histogram of every image the model has segmented, keyed by the hash
+    of the image bytes. A second, URL to hash, alias lets repeated URLs skip the download as well.
+
+    Lookups go to the in-process LRU first, then to the on-disk store shared with the other
+    workers. Hits from disk are promoted into memory.
+
+    :param namespace: A name that separates the entries of different models
+    :param max_bytes: The size budget of the in-process tier
+    :param ttl: The number of seconds an entry stays valid
+    :param directory: Where the on-disk tier is stored. `None` disables it
+    :param disk_max_bytes: The size budget of the on-disk tier, see `DiskCache`
+    """
+
+    def __init__(self, namespace, max_bytes, ttl, directory=None, disk_max_bytes=None):
+        self.memory = LRUCache(max_bytes, ttl)
+        self.disk = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk = DiskCache(
+                os.path.join(directory, f"{namespace}.sqlite3"),
+                ttl,
+                max_bytes=disk_max_bytes,
+            )
+
+    def _get(self, key, decode, size):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            stored = self.disk.get(key)
+            if stored is not None:
+                value = decode(stored)
+                self.memory.set(key, value, size(value))
+        return value
+
+    def get(self, digest):
+        """
+        Look up the class histogram of an image by the hash of its bytes.
+
+        :param digest: The `content_key` of the image
+        :return: the cached histogram, or `None`.
+        """
+        return self._get(
+            f"image:{digest}",
+            lambda stored: np.frombuffer(stored, dtype=np.int64),
+            lambda histogram: histogram.nbytes,
+        )
+
+    def set(self, digest, histogram):
+        histogram = np.asarray(histogram, dtype=np.int64)
+        self.memory.set(f"image:{digest}", histogram, histogram.nbytes)
+        if self.disk is not None:
+            self.disk.set(f"image:{digest}", histogram.tobytes())
+
+    def get_digest(self, url):
+        """
+        Look up the `content_key` of the image last downloaded from a URL.
+
+        :param url: The URL of the image
+        :return: the cached digest, or `None`.
+        """
+        return self._get(
+            f"url:{url}",
+            lambda stored: stored.decode(),
+            lambda digest: len(url) + len(digest),
+        )
+
+    def get_url(self, url):
+        """
+        Look up the class histogram of the image last downloaded from a URL.
+
+        :param url: The URL of the image
+        :return: the cached histogram, or `None`.
+        """
+        digest = self.get_digest(url)
+        return None if digest is None else self.get(digest)
+
+    def set_url(self, url, digest):
+        self.memory.set(f"url:{url}", digest, len(url) + len(digest))
+        if self.disk is not None:
+            self.disk.set(f"url:{url}", digest.encode())
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def remove(self):
+        """
+        Close the cache and delete its on-disk tier, once no version of the model will use it again.
+        """
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.remove()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+
+def _available_cpus():
+    # Respect CPU affinity (taskset, cgroup cpusets) where the platform reports it
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Path to the TFLite food segmentation model. The file is checked for changes every
+# MODEL_WATCH_INTERVAL seconds and hot-swapped when it is replaced; 0 disables the check.
+MODEL_PATH = os.getenv("MODEL_PATH", "1.tflite")
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "30"))
+
+# Bearer token required by POST /model/reload. Empty disables the endpoint.
+MODEL_RELOAD_TOKEN = os.getenv("MODEL_RELOAD_TOKEN", "")
+
+# Number of interpreters kept loaded in each process. Each interpreter serves one request at a time.
+INTERPRETER_POOL_SIZE = int(os.getenv("INTERPRETER_POOL_SIZE", "2"))
+
+# The HOST_CPUS cores available to the detector are shared by the WEB_CONCURRENCY uvicorn workers
+# (the variable uvicorn itself reads for --workers). Each interpreter runs INTERPRETER_THREADS
+# intra-op threads; 0 splits the cores evenly across every interpreter of every worker.
+# INTERPRETER_XNNPACK runs float operations on the XNNPACK delegate.
+HOST_CPUS = int(os.getenv("HOST_CPUS", str(_available_cpus())))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+INTERPRETER_THREADS = int(os.getenv("INTERPRETER_THREADS", "0"))
+INTERPRETER_XNNPACK = os.getenv("INTERPRETER_XNNPACK", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Concurrent requests are grouped into a single inference of up to BATCH_MAX_SIZE images. A batch
+# is sent as soon as it is full, or BATCH_MAX_WAIT_MS after its first image arrived.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Opt-in cascade: every image is first segmented at CASCADE_SIZE x CASCADE_SIZE pixels, and only run
+# at full resolution when its cake proportion lands within CASCADE_MARGIN of the requested
+# threshold. 0 disables the cascade. The low resolution model runs on CASCADE_POOL_SIZE
+# interpreters of its own, which count towards the split of HOST_CPUS.
+CASCADE_SIZE = int(os.getenv("CASCADE_SIZE", "0"))
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0.05"))
+CASCADE_POOL_SIZE = int(os.getenv("CASCADE_POOL_SIZE", str(INTERPRETER_POOL_SIZE)))
+
+# Segmentation results are cached by image content, in memory (up to CACHE_MAX_BYTES per worker)
+# and on disk in CACHE_DIR, shared by every worker on the host. An empty CACHE_DIR keeps the cache
+# in memory only. The on-disk cache of each model version is kept under CACHE_DISK_MAX_BYTES by
+# evicting its oldest entries, and is deleted once a new version of the model replaces it.
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+CACHE_DISK_MAX_BYTES = int(os.getenv("CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_DIR = os.getenv(
+    "CACHE_DIR", os.path.join(tempfile.gettempdir(), "cake-detector-cache")
+)
+
+# Image downloads share a keep-alive connection pool of FETCH_MAX_CONNECTIONS, with at most
+# FETCH_MAX_CONNECTIONS_PER_HOST concurrent downloads from any one host.
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "10"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "100"))
+FETCH_MAX_CONNECTIONS_PER_HOST = int(os.getenv("FETCH_MAX_CONNECTIONS_PER_HOST", "10"))
+
+# Decoding, preprocessing and postprocessing run on EXECUTOR_WORKERS threads or processes
+# (EXECUTOR_KIND). Up to EXECUTOR_MAX_QUEUE further requests may wait for a worker; beyond that the
+# detector answers 503 with a Retry-After of at least OVERLOAD_RETRY_AFTER seconds.
+EXECUTOR_KIND = os.getenv("EXECUTOR_KIND", "thread")
+EXECUTOR_WORKERS = int(
+    os.getenv("EXECUTOR_WORKERS", str(max(1, HOST_CPUS // WEB_CONCURRENCY)))
+)
+EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "32"))
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", "1"))
+
+# A request to /detect-cake/batch may hold up to BATCH_REQUEST_MAX_ITEMS images, of which
+# BATCH_REQUEST_CONCURRENCY are downloaded and processed at the same time.
+BATCH_REQUEST_MAX_ITEMS = int(os.getenv("BATCH_REQUEST_MAX_ITEMS", "1000"))
+BATCH_REQUEST_CONCURRENCY = int(os.getenv("BATCH_REQUEST_CONCURRENCY", "16"))
+
+# Largest image accepted as an upload to /detect-cake/upload or /detect-cake/raw
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(FETCH_MAX_BYTES)))
+
+# On trusted deployments, /detect-cake/local reads images from this directory. Empty disables it.
+LOCAL_IMAGE_ROOT = os.getenv("LOCAL_IMAGE_ROOT", "")
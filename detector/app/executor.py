@@ -0,0 +1,176 @@
+import asyncio
+import math
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import config
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request arrives while the CPU stage is already holding as many requests as it
+    is allowed to queue.
+
+    :param retry_after: The number of seconds the client should wait before trying again
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("The detector is overloaded, retry later")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, args):
+    # Runs in the worker: report when the job actually started so the caller can measure queueing
+    started = time.monotonic()
+    return started, fn(*args)
+
+
+class CPUStage:
+    """
+    Runs the CPU-heavy parts of a detection (decoding, preprocessing and postprocessing) on a pool
+    of worker threads or processes, so they never block the event loop.
+
+    Requests are admitted before they reach the stage. At most `workers + max_queue` requests are
+    admitted at once; any request beyond that fails fast with `Overloaded` instead of piling up in
+    memory.
+
+    :param kind: `"thread"` or `"process"`
+    :param workers: The number of worker threads or processes
+    :param max_queue: How many admitted requests may wait for a busy worker
+    :param retry_after: The minimum Retry-After, in seconds, suggested to rejected clients
+    """
+
+    # Number of recent jobs the queue wait statistics are computed over
+    window = 1024
+
+    def __init__(self, kind="thread", workers=1, max_queue=0, retry_after=1):
+        if kind == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="detector-cpu"
+            )
+        elif kind == "process":
+            # Forking a process that already runs threads is unsafe, so start clean interpreters
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            raise ValueError(f"Unknown executor kind '{kind}'")
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=self.window)
+        self._durations = deque(maxlen=self.window)
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    @contextmanager
+    def admit(self):
+        """
+        Reserve room for one request in the stage for the duration of the `with` block.
+
+        :return: a context manager that raises `Overloaded` when the stage is full.
+        """
+        if self.admitted >= self.capacity:
+            self.rejected += 1
+            raise Overloaded(self._estimate_retry_after())
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+
+    def _estimate_retry_after(self):
+        # Roughly how long the requests already admitted need to drain through the workers
+        if not self._durations:
+            return self.retry_after
+        average = sum(self._durations) / len(self._durations)
+        return max(self.retry_after, math.ceil(average * self.admitted / self.workers))
+
+    async def run(self, fn, *args):
+        """
+        Run a function on the stage's workers and wait for its result.
+
+        :param fn: The function to run. It must be picklable when the stage uses processes
+        :param args: The arguments of the function
+        :return: the return value of the function.
+        """
+        if self.kind == "process":
+            # Views into reusable download buffers cannot cross process boundaries
+            args = tuple(bytes(a) if isinstance(a, memoryview) else a for a in args)
+
+        submitted = time.monotonic()
+        self.waiting += 1
+        try:
+            started, result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed_call, fn, args
+            )
+        finally:
+            self.waiting -= 1
+        finished = time.monotonic()
+        self._waits.append(started - submitted)
+        self._durations.append(finished - started)
+        return result
+
+    def stats(self):
+        """
+        Report the current load of the stage, for sizing the fleet.
+
+        :return: a dictionary of the stage settings, queue depth and recent queue wait times.
+        """
+        waits = sorted(self._waits)
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": max(0, self.admitted - self.workers),
+            "waiting_jobs": self.waiting,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "avg": 1000 * sum(waits) / len(waits) if waits else 0.0,
+                "p95": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                "max": 1000 * waits[-1] if waits else 0.0,
+            },
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_stage = None
+
+
+def get_stage():
+    """
+    Return the process-wide CPU stage, starting its workers on first use.
+
+    :return: a `CPUStage` configured from the `EXECUTOR_*` settings.
+    """
+    global _stage
+    if _stage is None:
+        _stage = CPUStage(
+            kind=config.EXECUTOR_KIND,
+            workers=config.EXECUTOR_WORKERS,
+            max_queue=config.EXECUTOR_MAX_QUEUE,
+            retry_after=config.OVERLOAD_RETRY_AFTER,
+        )
+    return _stage
+
+
+def close_stage():
+    """
+    Stop the CPU stage's workers.
+    """
+    global _stage
+    if _stage is not None:
+        _stage.shutdown()
+    _stage = None
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from . import config
+from .metrics import FETCHED_BYTES, observe
+
+
+class ImageFetchError(Exception):
+    """
+    Raised when an image cannot be downloaded, or the response is not an acceptable image.
+    """
+
+
+class ImageFetcher:
+    """
+    Downloads images without blocking the event loop. All downloads share one keep-alive
+    connection pool, the number of concurrent downloads from any single host is capped, and every
+    download is bounded by connect/read timeouts and a maximum body size.
+
+    Bodies are streamed into buffers that are reused from one download to the next, and responses
+    that are not images are rejected from their headers, before the body is read.
+
+    :param connect_timeout: Seconds allowed to establish a connection
+    :param read_timeout: Seconds allowed between two chunks of the response
+    :param max_bytes: The largest image body accepted
+    :param max_connections: The size of the shared connection pool
+    :param max_connections_per_host: The maximum number of concurrent downloads from one host
+    :param transport: An optional httpx transport, used by the tests
+    """
+
+    # Idle buffers kept around for the next downloads
+    max_idle_buffers = 4
+
+    def __init__(
+        self,
+        connect_timeout=5.0,
+        read_timeout=10.0,
+        max_bytes=20 * 1024 * 1024,
+        max_connections=100,
+        max_connections_per_host=10,
+        transport=None,
+    ):
+        self.max_bytes = max_bytes
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            follow_redirects=True,
+            transport=transport,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        # host -> [semaphore, number of downloads holding or waiting for it]
+        self._hosts = {}
+        self._buffers = []
+
+    @asynccontextmanager
+    async def fetch(self, url):
+        """
+        Download an image. The body is only valid inside the `async with` block, after which its
+        buffer is handed to the next download.
+
+        :param url: The URL of the image you want to download
+        :return: a context manager yielding the body as a memoryview.
+        """
+        buffer = self._buffers.pop() if self._buffers else bytearray()
+        try:
+            size = await self._download(url, buffer)
+            data = memoryview(buffer)[:size]
+            try:
+                yield data
+            finally:
+                data.release()
+        finally:
+            if len(self._buffers) < self.max_idle_buffers:
+                self._buffers.append(buffer)
+
+    @asynccontextmanager
+    async def _host_slot(self, host):
+        # Only the hosts with downloads in progress keep a semaphore, so the table does not grow
+        # with every host ever seen
+        slot = self._hosts.get(host)
+        if slot is None:
+            slot = self._hosts[host] = [
+                asyncio.Semaphore(self.max_connections_per_host),
+                0,
+            ]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._hosts[host]
+
+    async def _download(self, url, buffer):
+        try:
+            host = httpx.URL(url).host
+            async with self._host_slot(host):
+                # Time the download itself, not the wait for a free slot on a busy host
+                started = time.perf_counter()
+                async with self.client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    self._check_headers(response)
+                    size = 0
+                    async for chunk in response.aiter_bytes():
+                        end = size + len(chunk)
+                        if end > self.max_bytes:
+                            raise ImageFetchError(
+                                f"Image is larger than {self.max_bytes} bytes"
+                            )
+                        buffer[size:end] = chunk
+                        size = end
+                observe("fetch", time.perf_counter() - started)
+                FETCHED_BYTES.inc(size)
+                return size
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            raise ImageFetchError(str(e) or type(e).__name__) from e
+
+    def _check_headers(self, response):
+        content_type = response.headers.get("content-type", "")
+        if not content_type.startswith("image/"):
+            raise ImageFetchError(f"Unsupported content type '{content_type}'")
+        content_length = response.headers.get("content-length")
+        if content_length is None:
+            return
+        try:
+            content_length = int(content_length)
+        except ValueError as e:
+            raise ImageFetchError(f"Invalid content length '{content_length}'") from e
+        if content_length > self.max_bytes:
+            raise ImageFetchError(f"Image is larger than {self.max_bytes} bytes")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_fetcher = None
+_fetcher_loop = None
+
+
+def get_fetcher():
+    """
+    Return the image fetcher of the running event loop, creating it on first use.
+
+    :return: an `ImageFetcher` configured from the `FETCH_*` settings.
+    """
+    global _fetcher, _fetcher_loop
+    # Connections belong to the event loop that opened them
+    loop = asyncio.get_running_loop()
+    if _fetcher is None or _fetcher_loop is not loop:
+        _fetcher = ImageFetcher(
+            connect_timeout=config.FETCH_CONNECT_TIMEOUT,
+            read_timeout=config.FETCH_READ_TIMEOUT,
+            max_bytes=config.FETCH_MAX_BYTES,
+            max_connections=config.FETCH_MAX_CONNECTIONS,
+            max_connections_per_host=config.FETCH_MAX_CONNECTIONS_PER_HOST,
+        )
+        _fetcher_loop = loop
+    return _fetcher
+
+
+async def close_fetcher():
+    """
+    Close the shared connection pool.
+    """
+    global _fetcher, _fetcher_loop
+    if _fetcher is not None:
+        await _fetcher.close()
+    _fetcher = None
+    _fetcher_loop = None
@@ -1,23 +1,18 @@
 import io
+import threading
 
 import numpy as np
-import requests
-import tflite_runtime.interpreter as tflite
-from fastapi import HTTPException
 from PIL import Image
 
 
-def download_image(url):
+def decode_image(data):
     """
-    The function `download_image` takes a URL as input, downloads the image from that URL, and returns
-    the image object.
+    The function `decode_image` opens encoded image bytes (JPEG, PNG, ...) as a PIL image.
 
-    :param url: The URL of the image you want to download
+    :param data: The encoded image bytes
     :return: an image object.
     """
-    response = requests.get(url)
-    image = Image.open(io.BytesIO(response.content))
-    return image
+    return Image.open(io.BytesIO(data))
 
 
 def preprocess_image(image, target_size=(513, 513)):
@@ -53,99 +48,142 @@ def preprocess_image(image, target_size=(513, 513)):
     return image
 
 
-# Function to interpret the model's output and check for cake (sweets/desserts or snacks)
-def interpret_output(output_data, threshold=0.1):
+def preprocess_image_fast(image, target_size=(513, 513), out=None):
     """
-    The function `interpret_output` takes in the output data from a neural network model and calculates
-    the proportion of pixels classified as either 'sweets/desserts' or 'snacks', and determines if this
-    proportion exceeds a given threshold.
-
-    :param output_data: The output_data parameter is the raw output from a neural network model. It is
-    expected to be a multi-dimensional array, typically with shape (batch_size, height, width,
-    num_classes), where batch_size is the number of images in the batch, height and width are the
-    dimensions of each image,
-    :param threshold: The threshold parameter is a value between 0 and 1 that determines the minimum
-    proportion of cake pixels required for the function to classify the image as containing cake. If the
-    proportion of cake pixels exceeds the threshold, the function will return True for the is_cake
-    variable
-    :return: The function `interpret_output` returns a tuple containing two values: `is_cake` and
-    `proportion_cake_pixels`.
+    A faster equivalent of `preprocess_image`. JPEGs are decoded directly at the smallest reduced
+    scale that is still at least `target_size`, the alpha channel is dropped by the colour
+    conversion of the already resized image, and the pixels are written straight into `out`
+    without going through intermediate numpy arrays.
+
+    :param image: The input PIL image. It should not be loaded yet, so that JPEG draft decoding can
+    take effect
+    :param target_size: The (width, height) the image is resized to
+    :param out: An optional uint8 array of shape (1, height, width, 3), such as a view of the
+    interpreter's input tensor, to write the pixels into
+    :return: the preprocessed image, that is `out` when it was given.
     """
-    # Convert the raw output to a numpy array (if it's not already)
-    output_array = np.array(output_data)
+    # Let the JPEG decoder downscale by up to 8x while decoding (a no-op for other formats)
+    image.draft("RGB", target_size)
 
-    # Remove the batch dimension
-    output_array = np.squeeze(output_array)
+    image = image.resize(target_size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
 
-    # Find the class with the highest probability for each pixel
-    class_map = np.argmax(output_array, axis=-1)
+    if out is None:
+        out = np.empty((1, target_size[1], target_size[0], 3), dtype=np.uint8)
+    out[0] = image
+    return out
 
-    # IDs for 'sweets/desserts' and 'snacks'
-    sweets_desserts_id = 20
-    snacks_id = 19
 
-    # Count how many pixels are classified as 'sweets/desserts' or 'snacks'
-    sweets_desserts_pixels = np.sum(class_map == sweets_desserts_id)
-    snacks_pixels = np.sum(class_map == snacks_id)
+# IDs for 'snacks' and 'sweets/desserts'
+CAKE_CLASS_IDS = (19, 20)
 
-    # Calculate the total number of pixels classified as either 'sweets/desserts' or 'snacks'
-    total_cake_pixels = sweets_desserts_pixels + snacks_pixels
+# Per-thread scratch space for the class map, reused across calls of the same shape
+_scratch = threading.local()
 
-    # Total number of pixels in the image
-    total_pixels = class_map.size
 
-    # Calculate the proportion of cake pixels
-    proportion_cake_pixels = total_cake_pixels / total_pixels
+def _class_map(output_array):
+    # Winning class of every pixel, written into a reused buffer instead of a fresh array.
+    # Quantized (uint8/int8) outputs are an increasing affine map of the scores, so their argmax
+    # is the same as the dequantized one and they are used as they are.
+    shape = output_array.shape[:-1]
+    class_map = getattr(_scratch, "class_map", None)
+    if class_map is None or class_map.shape != shape:
+        class_map = np.empty(shape, dtype=np.intp)
+        _scratch.class_map = class_map
+    return np.argmax(output_array, axis=-1, out=class_map)
 
-    # Check if the proportion of cake pixels exceeds the threshold
-    is_cake = proportion_cake_pixels > threshold
-    return is_cake, proportion_cake_pixels  # Return both the result and the proportion
+
+def class_histograms(output_data):
+    """
+    The function `class_histograms` counts, in a single pass over the model output, how many pixels
+    of each image in a batch the model assigned to each class.
+
+    :param output_data: The raw output of the model, float or quantized, with shape (batch_size,
+    height, width, num_classes). A single image without a batch dimension is accepted too
+    :return: a numpy array of shape (batch_size, num_classes) holding the pixel count of every class
+    for every image.
+    """
+    output_array = np.asarray(output_data)
+    if output_array.ndim == 3:
+        output_array = output_array[np.newaxis]
+    num_classes = output_array.shape[-1]
+
+    class_map = _class_map(output_array)
+    histograms = np.empty((len(class_map), num_classes), dtype=np.int64)
+    for histogram, image_class_map in zip(histograms, class_map):
+        histogram[:] = np.bincount(image_class_map.ravel(), minlength=num_classes)
+    return histograms
 
 
-# Function to classify image
-def is_cake(
-    url, model_path, threshold=0.1
-):  # You can change the default threshold here
+def class_histogram(output_data):
     """
-    The `is_cake` function takes in a URL of an image, a model path for a TFLite model, and an optional
-    threshold value, and returns whether the image contains a cake or not, along with the proportion of
-    confidence.
+    The function `class_histogram` counts how many pixels of a single image the model assigned to
+    each class. Unlike the thresholded result, the histogram can be cached and answer a query for
+    any threshold or class set later on.
 
-    :param url: The URL of the image you want to classify as a cake or not
-    :param model_path: The `model_path` parameter is the path to the TFLite model file that you want to
-    use for cake detection. This file should have the extension `.tflite` and contain the trained model
-    that can classify images as cake or not cake
-    :param threshold: The threshold parameter is used to determine the minimum confidence level required
-    for an image to be classified as a cake. If the proportion of the cake class in the output tensor is
-    above the threshold, the image will be classified as a cake. You can adjust the threshold value to
-    make the classification more or less
-    :return: a tuple containing two values: a boolean indicating whether the image is classified as a
-    cake or not, and a proportion value indicating the confidence level of the classification.
+    :param output_data: The raw output of the model for one image, with shape (1, height, width,
+    num_classes)
+    :return: a numpy array of length num_classes holding the pixel count of every class.
     """
-    try:
-        image = download_image(url)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error downloading image: {e}")
+    return class_histograms(output_data)[0]
 
-    processed_image = preprocess_image(image)
 
-    # Load TFLite model and allocate tensors
-    interpreter = tflite.Interpreter(model_path=model_path)
-    interpreter.allocate_tensors()
+def interpret_histogram(histogram, threshold=0.1, class_ids=CAKE_CLASS_IDS):
+    """
+    The function `interpret_histogram` works like `interpret_output`, but starts from per-class
+    pixel histograms instead of the raw model output.
+
+    :param histogram: The per-class pixel counts returned by `class_histogram`, or a batch of them
+    returned by `class_histograms`
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param class_ids: The classes that count as cake
+    :return: a tuple containing `is_cake` and `proportion_cake_pixels`, with one entry per image for
+    a batch of histograms.
+    """
+    cake_pixels = histogram[..., list(class_ids)].sum(axis=-1)
+    proportion_cake_pixels = cake_pixels / histogram.sum(axis=-1)
+    is_cake = proportion_cake_pixels > threshold
+    return is_cake, proportion_cake_pixels
+
+
+def needs_full_resolution(proportion, threshold, margin):
+    """
+    The function `needs_full_resolution` decides whether a proportion measured by the low resolution
+    stage of the cascade is too close to the threshold to be trusted.
 
-    # Get input and output tensors
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
+    :param proportion: The proportion of cake pixels at low resolution
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param margin: How far from the threshold the proportion must be to decide at low resolution
+    :return: `True` when the image should be segmented again at full resolution.
+    """
+    return abs(proportion - threshold) <= margin
 
-    # Set the input tensor
-    interpreter.set_tensor(input_details[0]["index"], processed_image)
 
-    # Run the model
-    interpreter.invoke()
+# Function to interpret the model's output and check for cake (sweets/desserts or snacks)
+def interpret_output(output_data, threshold=0.1):
+    """
+    The function `interpret_output` takes in the output data from a neural network model and calculates
+    the proportion of pixels classified as either 'sweets/desserts' or 'snacks', and determines if this
+    proportion exceeds a given threshold. The full per-class pixel histogram is returned as well, so
+    callers can apply other thresholds or class sets without looking at the output again.
 
-    # Get the output tensor
-    output_data = interpreter.get_tensor(output_details[0]["index"])
+    :param output_data: The output_data parameter is the raw output from a neural network model. It is
+    expected to be a multi-dimensional array, typically with shape (batch_size, height, width,
+    num_classes), where batch_size is the number of images in the batch, height and width are the
+    dimensions of each image. Both float and quantized outputs are supported
+    :param threshold: The threshold parameter is a value between 0 and 1 that determines the minimum
+    proportion of cake pixels required for the function to classify the image as containing cake. If the
+    proportion of cake pixels exceeds the threshold, the function will return True for the is_cake
+    variable
+    :return: The function `interpret_output` returns a tuple containing three values: `is_cake`,
+    `proportion_cake_pixels` and the class `histogram`. For a batch of more than one image, each of
+    them has one entry per image.
+    """
+    histograms = class_histograms(output_data)
+    is_cake, proportion_cake_pixels = interpret_histogram(histograms, threshold)
 
-    # Interpret results with the custom threshold
-    is_cake_result, proportion = interpret_output(output_data, threshold)
-    return bool(is_cake_result), proportion
+    # A single image is reported without its batch dimension
+    if len(histograms) == 1:
+        return is_cake[0], proportion_cake_pixels[0], histograms[0]
+    return is_cake, proportion_cake_pixels, histograms
@@ -0,0 +1,189 @@
+import queue
+from contextlib import contextmanager
+
+import tflite_runtime.interpreter as tflite
+
+from . import config
+
+
+class InterpreterPool:
+    """
+    A fixed-size pool of TFLite interpreters that have already parsed the model and allocated their
+    tensors. A TFLite interpreter must not be used by two threads at once, so each interpreter is
+    checked out to a single caller and returned to the pool when the caller is done with it.
+
+    :param model_path: The path to the TFLite model file loaded by every interpreter in the pool
+    :param size: The number of interpreters to load
+    :param model_content: The already read model file. When given, the interpreters are built from it
+    instead of reading `model_path` again
+    :param num_threads: The intra-op threads of each interpreter. Defaults to the share of the host's
+    cores of a pool that is the only one in its worker, see `interpreter_threads`
+    :param xnnpack: Whether to run on the XNNPACK delegate. Defaults to the `INTERPRETER_XNNPACK`
+    setting
+    """
+
+    def __init__(
+        self, model_path, size=1, model_content=None, num_threads=None, xnnpack=None
+    ):
+        if size < 1:
+            raise ValueError("The interpreter pool size must be at least 1")
+        self.model_path = model_path
+        self.model_content = model_content
+        self.size = size
+        self.num_threads = num_threads or interpreter_threads(size)
+        self.xnnpack = config.INTERPRETER_XNNPACK if xnnpack is None else xnnpack
+        self._idle = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(self._load())
+
+    def _load(self):
+        # Parse the model and allocate tensors once, up front. XNNPACK is one of TFLite's default
+        # delegates and uses the interpreter's thread count; leaving out the defaults disables it
+        if self.model_content is not None:
+            source = {"model_content": self.model_content}
+        else:
+            source = {"model_path": self.model_path}
+        interpreter = tflite.Interpreter(
+            **source,
+            num_threads=self.num_threads,
+            experimental_op_resolver_type=(
+                tflite.OpResolverType.AUTO
+                if self.xnnpack
+                else tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+            ),
+        )
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def settings(self):
+        """
+        Report how the interpreters of the pool were created.
+        """
+        return {
+            "interpreters": self.size,
+            "num_threads": self.num_threads,
+            "xnnpack": self.xnnpack,
+        }
+
+    @property
+    def available(self):
+        """
+        The number of interpreters that are currently idle in the pool.
+        """
+        return self._idle.qsize()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Borrow an interpreter from the pool, blocking until one is free. The interpreter is
+        returned to the pool when the `with` block exits, even if the block raises.
+
+        :param timeout: The maximum number of seconds to wait for a free interpreter. `None` waits
+        forever
+        :return: a context manager yielding a loaded TFLite interpreter.
+        """
+        try:
+            interpreter = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No interpreter became available in time")
+        try:
+            yield interpreter
+        finally:
+            self._idle.put(interpreter)
+
+
+def interpreters_per_worker():
+    """
+    Return the number of interpreters each worker loads: its `INTERPRETER_POOL_SIZE` interpreters,
+    plus the `CASCADE_POOL_SIZE` interpreters of the low resolution model when the cascade is on.
+    """
+    interpreters = config.INTERPRETER_POOL_SIZE
+    if config.CASCADE_SIZE > 0:
+        interpreters += config.CASCADE_POOL_SIZE
+    return interpreters
+
+
+def interpreter_threads(interpreters=None):
+    """
+    Return the number of intra-op threads each interpreter should run, so that all the interpreters
+    of all the uvicorn workers on the host together use each core about once.
+
+    :param interpreters: The number of interpreters in each worker, `interpreters_per_worker()` by
+    default
+    :return: the `INTERPRETER_THREADS` setting, or an even share of `HOST_CPUS` when it is 0.
+    """
+    if config.INTERPRETER_THREADS > 0:
+        return config.INTERPRETER_THREADS
+    interpreters = config.WEB_CONCURRENCY * (interpreters or interpreters_per_worker())
+    return max(1, config.HOST_CPUS // interpreters)
+
+
+def cpu_budget():
+    """
+    Report how the host's cores are split between the workers and their interpreters.
+
+    :return: a dictionary of the CPU settings in effect.
+    """
+    interpreters = interpreters_per_worker()
+    threads = interpreter_threads(interpreters)
+    return {
+        "host_cpus": config.HOST_CPUS,
+        "web_concurrency": config.WEB_CONCURRENCY,
+        "interpreter_pool_size": config.INTERPRETER_POOL_SIZE,
+        "cascade_pool_size": config.CASCADE_POOL_SIZE if config.CASCADE_SIZE > 0 else 0,
+        "interpreter_threads": threads,
+        # Every intra-op thread of every interpreter of every worker on the host
+        "total_interpreter_threads": config.WEB_CONCURRENCY * interpreters * threads,
+        "xnnpack": config.INTERPRETER_XNNPACK,
+        "executor_workers": config.EXECUTOR_WORKERS,
+    }
+
+
+def _prepare_input(interpreter, shape):
+    # Resize the input tensor when the batch does not match the shape it was last allocated for
+    input_details = interpreter.get_input_details()[0]
+    if tuple(input_details["shape"]) != tuple(shape):
+        interpreter.resize_tensor_input(input_details["index"], shape)
+        interpreter.allocate_tensors()
+    return input_details["index"]
+
+
+def _output(interpreter):
+    output_details = interpreter.get_output_details()
+    return interpreter.get_tensor(output_details[0]["index"])
+
+
+def run_inference(interpreter, input_data):
+    """
+    Run the model on a batch of preprocessed images. The interpreter's input tensor is resized
+    first when the batch does not match the shape it was last allocated for.
+
+    :param interpreter: A loaded TFLite interpreter, checked out of a pool
+    :param input_data: A numpy array of shape (batch_size, height, width, 3)
+    :return: the model's output tensor, with one entry per image in the batch.
+    """
+    input_index = _prepare_input(interpreter, input_data.shape)
+    interpreter.set_tensor(input_index, input_data)
+    interpreter.invoke()
+    return _output(interpreter)
+
+
+def run_batch(interpreter, images):
+    """
+    Run the model on several preprocessed images at once. Every image is copied straight into its
+    slot of the interpreter's input tensor, so the batch is never assembled in a separate array.
+
+    :param interpreter: A loaded TFLite interpreter, checked out of a pool
+    :param images: A list of numpy arrays of shape (1, height, width, 3), all of the same size
+    :return: the model's output tensor, with one entry per image.
+    """
+    input_index = _prepare_input(interpreter, (len(images),) + images[0].shape[1:])
+
+    input_tensor = interpreter.tensor(input_index)()
+    for slot, image in zip(input_tensor, images):
+        slot[...] = image[0]
+    # The interpreter refuses to run while a view of its buffers is alive
+    del input_tensor, slot
+
+    interpreter.invoke()
+    return _output(interpreter)
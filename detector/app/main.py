@@ -1,7 +1,41 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hmac
+import logging
+from contextlib import asynccontextmanager, suppress
+from typing import List, Literal, Optional
+
+from fastapi import (
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+)
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
+from uvicorn.logging import DefaultFormatter
+
+from . import config
+from .executor import Overloaded, close_stage, get_stage
+from .fetch import close_fetcher
+from .interpreters import cpu_budget
+from .metrics import ServerTimingMiddleware, count_error, render
+from .model import (
+    ModelNotReady,
+    close_model,
+    get_model,
+    is_ready,
+    reload_model,
+    start_model,
+    status,
+    watch_model,
+)
+from .pipeline import detect, detect_bytes, detect_many, detect_path
 
-from .images import is_cake
+logger = logging.getLogger(__name__)
 
 description = """
 This API is designed to detect cakes in images. Upload an image URL,
@@ -9,6 +43,51 @@ and it will return whether there is a cake in the image and the
 proportion of the image that is cake.
 """
 
+
+def configure_logging():
+    """
+    Send the detector's own log records to stderr the way uvicorn prints its own, at uvicorn's log
+    level. Uvicorn's default logging configuration only sets up the `uvicorn` loggers, so without
+    this the records of the `app` loggers are dropped by the root logger's WARNING level. Nothing is
+    changed when a `--log-config` or the embedding application already configured logging.
+    """
+    app_logger = logging.getLogger(__package__)
+    if (
+        app_logger.handlers
+        or app_logger.level != logging.NOTSET
+        or logging.getLogger().handlers
+    ):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(DefaultFormatter("%(levelprefix)s %(message)s"))
+    app_logger.addHandler(handler)
+    app_logger.setLevel(logging.getLogger("uvicorn.error").getEffectiveLevel())
+    app_logger.propagate = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    logger.info("CPU budget: %s", cpu_budget())
+    get_stage()
+    # Load and warm up the model in the background; /ready reports when it is done
+    tasks = [asyncio.ensure_future(start_model(config.MODEL_PATH))]
+    if config.MODEL_WATCH_INTERVAL > 0:
+        tasks.append(
+            asyncio.ensure_future(
+                watch_model(config.MODEL_PATH, config.MODEL_WATCH_INTERVAL)
+            )
+        )
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await close_model()
+    await close_fetcher()
+    close_stage()
+
+
 app = FastAPI(
     title="Cake Image Detector API",
     description=description,
@@ -23,7 +102,9 @@ app = FastAPI(
         "name": "MIT",
         "url": "https://opensource.org/licenses/MIT",
     },
+    lifespan=lifespan,
 )
+app.add_middleware(ServerTimingMiddleware)
 
 
 # Pydantic model for the query parameters
@@ -55,6 +136,29 @@ class CakeResponse(BaseModel):
     proportion: float = Field(
         ..., description="The proportion of the image classified as cake."
     )
+    stage: Literal["cascade", "full"] = Field(
+        default="full",
+        description="""
+            Which resolution decided: the low resolution first stage of the cascade, or the full
+            resolution model.
+            """,
+    )
+
+
+def as_http_exception(e):
+    """
+    Translate an error raised while detecting a cake into the HTTP error reported to the client.
+    """
+    count_error(e)
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, (Overloaded, ModelNotReady)):
+        return HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return HTTPException(status_code=500, detail=f"Error processing image: {e}")
 
 
 @app.post("/detect-cake/", tags=["Cakes"], response_model=CakeResponse)
@@ -68,9 +172,324 @@ async def detect_cake(query: CakeQuery):
 
     - **url**: The URL of the image to detect cake in.
     - **threshold**: The confidence threshold to classify an image as containing a cake.
+
+    When the detector runs a cascade, **stage** tells whether the low resolution first pass was
+    conclusive (`cascade`) or the image had to be run at full resolution (`full`).
+    """
+    try:
+        is_cake_result, proportion, stage = await detect(query.url, query.threshold)
+        return CakeResponse(is_cake=is_cake_result, proportion=proportion, stage=stage)
+    except Exception as e:
+        raise as_http_exception(e)
+
+
+# Pydantic model for the query parameters of a local file
+class CakeLocalQuery(BaseModel):
+    path: str = Field(
+        ...,
+        title="Image path",
+        description="The path of the image file, relative to the detector's local image root.",
+        json_schema_extra={"example": "catalog/image.jpg"},
+    )
+    threshold: float = Field(
+        default=0.1,
+        ge=0.0,
+        le=1.0,
+        title="Detection Threshold",
+        description="""
+            The threshold for detecting cake in the image,
+            ranging from 0.0 (no confidence) to 1.0 (full confidence).
+            """,
+        json_schema_extra={"example": 0.1},
+    )
+
+
+def check_image_content_type(content_type):
+    if not (content_type or "").startswith("image/"):
+        raise HTTPException(
+            status_code=415, detail=f"Unsupported content type '{content_type}'"
+        )
+
+
+def too_large():
+    return HTTPException(
+        status_code=413,
+        detail=f"Image is larger than {config.UPLOAD_MAX_BYTES} bytes",
+    )
+
+
+@app.post("/detect-cake/upload", tags=["Cakes"], response_model=CakeResponse)
+async def detect_cake_upload(
+    file: UploadFile = File(..., description="The image to analyze for cake presence."),
+    threshold: float = Form(
+        default=0.1,
+        ge=0.0,
+        le=1.0,
+        description="The threshold for detecting cake in the image.",
+    ),
+):
+    """
+    Detect whether an uploaded image contains a cake.
+
+    Works like `/detect-cake/`, but the image is sent as a multipart form upload instead of being
+    downloaded from a URL.
+
+    - **file**: The image to detect cake in.
+    - **threshold**: The confidence threshold to classify an image as containing a cake.
+    """
+    check_image_content_type(file.content_type)
+    if file.size is not None and file.size > config.UPLOAD_MAX_BYTES:
+        raise too_large()
+    try:
+        data = await file.read()
+        is_cake_result, proportion, stage = await detect_bytes(data, threshold)
+        return CakeResponse(is_cake=is_cake_result, proportion=proportion, stage=stage)
+    except Exception as e:
+        raise as_http_exception(e)
+
+
+@app.post(
+    "/detect-cake/raw",
+    tags=["Cakes"],
+    response_model=CakeResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"image/*": {"schema": {"type": "string", "format": "binary"}}},
+        }
+    },
+)
+async def detect_cake_raw(
+    request: Request,
+    threshold: float = Query(
+        default=0.1,
+        ge=0.0,
+        le=1.0,
+        description="The threshold for detecting cake in the image.",
+    ),
+):
+    """
+    Detect whether an image sent as the raw request body contains a cake.
+
+    The body is the encoded image itself, with an `image/*` content type.
+
+    - **threshold**: The confidence threshold to classify an image as containing a cake.
+    """
+    check_image_content_type(request.headers.get("content-type"))
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if content_length > config.UPLOAD_MAX_BYTES:
+            raise too_large()
+
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > config.UPLOAD_MAX_BYTES:
+            raise too_large()
+
+    try:
+        is_cake_result, proportion, stage = await detect_bytes(data, threshold)
+        return CakeResponse(is_cake=is_cake_result, proportion=proportion, stage=stage)
+    except Exception as e:
+        raise as_http_exception(e)
+
+
+@app.post("/detect-cake/local", tags=["Cakes"], response_model=CakeResponse)
+async def detect_cake_local(query: CakeLocalQuery):
+    """
+    Detect whether an image file on the detector's own disk contains a cake.
+
+    Only available on trusted deployments that set `LOCAL_IMAGE_ROOT`; the path is resolved
+    relative to it and may not escape it. The file is memory mapped rather than read.
+
+    - **path**: The path of the image, relative to the local image root.
+    - **threshold**: The confidence threshold to classify an image as containing a cake.
+    """
+    try:
+        is_cake_result, proportion, stage = await detect_path(
+            query.path, query.threshold
+        )
+        return CakeResponse(is_cake=is_cake_result, proportion=proportion, stage=stage)
+    except Exception as e:
+        raise as_http_exception(e)
+
+
+# Pydantic model for the batch query
+class CakeBatchQuery(BaseModel):
+    items: List[CakeQuery] = Field(
+        ...,
+        min_length=1,
+        max_length=config.BATCH_REQUEST_MAX_ITEMS,
+        description="The images to analyze, each with its own detection threshold.",
+    )
+
+
+class CakeBatchError(BaseModel):
+    status_code: int = Field(..., description="The HTTP status of the failure.")
+    detail: str = Field(..., description="What went wrong with this image.")
+
+
+# Pydantic model for one line of the batch response
+class CakeBatchResult(BaseModel):
+    index: int = Field(..., description="The position of the image in the query.")
+    url: str = Field(..., description="The URL of the image.")
+    is_cake: Optional[bool] = Field(
+        default=None,
+        description="Whether the image is classified as containing a cake.",
+    )
+    proportion: Optional[float] = Field(
+        default=None, description="The proportion of the image classified as cake."
+    )
+    stage: Optional[Literal["cascade", "full"]] = Field(
+        default=None, description="Which resolution of the cascade decided."
+    )
+    error: Optional[CakeBatchError] = Field(
+        default=None, description="Set instead of the result when the image failed."
+    )
+
+
+@app.post(
+    "/detect-cake/batch",
+    tags=["Cakes"],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "One `CakeBatchResult` JSON object per line, in completion order.",
+            "content": {"application/x-ndjson": {}},
+        }
+    },
+)
+async def detect_cake_batch(query: CakeBatchQuery):
+    """
+    Detect cakes in many images with a single request.
+
+    The images are downloaded concurrently and their inferences are batched together. Results are
+    streamed back as newline-delimited JSON as soon as each image is done, so they may arrive in a
+    different order than the query; use `index` to match them up. An image that fails gets an
+    `error` instead of a result, without affecting the rest of the batch.
+
+    - **items**: The images to analyze, each with a **url** and a **threshold**.
+    """
+
+    # Fail the whole request up front, rather than every line, while the model is loading
+    try:
+        get_model()
+    except Exception as e:
+        raise as_http_exception(e)
+
+    def result_line(index, result):
+        line = CakeBatchResult(index=index, url=query.items[index].url)
+        if isinstance(result, Exception):
+            error = as_http_exception(result)
+            line.error = CakeBatchError(
+                status_code=error.status_code, detail=error.detail
+            )
+        else:
+            line.is_cake, line.proportion, line.stage = result
+        return line.model_dump_json(exclude_none=True) + "\n"
+
+    async def results():
+        # The response only starts streaming later, so the model is resolved and marked in use
+        # here, in one step: a hot-swap in between cannot retire it under the batch
+        try:
+            model = get_model()
+        except Exception as e:
+            for index in range(len(query.items)):
+                yield result_line(index, e)
+            return
+        with model.use():
+            queries = [(item.url, item.threshold) for item in query.items]
+            async for index, result in detect_many(
+                queries, config.BATCH_REQUEST_CONCURRENCY, model
+            ):
+                yield result_line(index, result)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/diagnostics", tags=["Diagnostics"])
+async def diagnostics():
+    """
+    Report the detector's runtime settings and load.
+
+    - **executor**: The CPU stage settings, its queue depth and recent queue wait times.
+    - **model**: Whether the model is ready, and the path, version and interpreter settings of the
+    one serving.
+    - **cpu**: How the host's cores are split between workers, interpreters and their threads.
+    """
+    return {"executor": get_stage().stats(), "model": status(), "cpu": cpu_budget()}
+
+
+@app.get("/ready", tags=["Diagnostics"])
+async def ready():
     """
+    Report whether the detector is ready to serve requests.
+
+    Answers 503 until the model has been loaded and warmed up, so a load balancer or orchestrator
+    only sends traffic to workers that will not make the first requests wait.
+    """
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail=status()["error"] or "The model is still loading",
+            headers={"Retry-After": "5"},
+        )
+    return {"status": "ready", "model": get_model().info()}
+
+
+def check_reload_token(authorization):
+    # Only deployments that set a token may reload the model over HTTP
+    if not config.MODEL_RELOAD_TOKEN:
+        raise HTTPException(
+            status_code=403,
+            detail="Reloading the model is not enabled on this detector",
+        )
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), config.MODEL_RELOAD_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid reload token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@app.post("/model/reload", tags=["Diagnostics"])
+async def model_reload(authorization: Optional[str] = Header(None)):
+    """
+    Load the model file again and swap it in without downtime.
+
+    Requests already in progress finish on the previous version. This only reloads the worker that
+    receives the request; with several workers, rely on `MODEL_WATCH_INTERVAL` instead.
+
+    The request must carry the `MODEL_RELOAD_TOKEN` setting as a bearer token
+    (`Authorization: Bearer <token>`). Without that setting, the endpoint is disabled.
+    """
+    check_reload_token(authorization)
     try:
-        is_cake_result, proportion = is_cake(query.url, "1.tflite", query.threshold)
-        return CakeResponse(is_cake=is_cake_result, proportion=proportion)
+        model = await reload_model(config.MODEL_PATH)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {e}")
+        raise HTTPException(status_code=500, detail=f"Error loading model: {e}")
+    return {"status": "reloaded", "model": model.info()}
+
+
+@app.get("/metrics", tags=["Diagnostics"])
+async def metrics():
+    """
+    Export the detector's metrics in the Prometheus text format.
+
+    - **detector_stage_seconds**: Histograms of the fetch, decode, preprocess, invoke and
+    postprocess times.
+    - **detector_fetched_bytes_total**: Bytes downloaded from image hosts.
+    - **detector_cache_lookups_total**: Detections answered from the cache (`hit`) or not (`miss`).
+    - **detector_errors_total**: Failed detections, by type of error.
+
+    Every response also carries a `Server-Timing` header with the time spent in each stage.
+    """
+    content, media_type = render()
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,139 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# The stages of a detection, in the order they run
+STAGES = ("fetch", "decode", "preprocess", "invoke", "postprocess")
+
+STAGE_SECONDS = Histogram(
+    "detector_stage_seconds",
+    "Time spent in each stage of a detection.",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+FETCHED_BYTES = Counter(
+    "detector_fetched_bytes", "Bytes of images downloaded from image hosts."
+)
+CACHE_LOOKUPS = Counter(
+    "detector_cache_lookups",
+    "Detections answered from the result cache (hit) or run through the model (miss).",
+    ["result"],
+)
+ERRORS = Counter("detector_errors", "Failed detections, by type of error.", ["type"])
+
+# The stage timings of the request being handled
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def observe(stage, seconds):
+    """
+    Record the time a stage took, in the stage histogram and the timings of the current request.
+
+    :param stage: One of `STAGES`
+    :param seconds: How long the stage took
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        # A request may run a stage more than once, e.g. at both resolutions of the cascade
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time the body of the `with` block as one run of a stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def count_cache_lookup(hit):
+    CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+def count_error(e):
+    """
+    Count a failed detection. Errors reported as HTTP errors are counted by their cause, or by
+    their status code when they have none.
+    """
+    error = e.__cause__ or e
+    if isinstance(error, HTTPException):
+        error_type = f"http_{error.status_code}"
+    else:
+        error_type = type(error).__name__
+    ERRORS.labels(error_type).inc()
+
+
+def server_timing(timings):
+    """
+    Format stage timings as a `Server-Timing` header value.
+
+    :param timings: A dictionary of stage names to seconds
+    :return: the header value, with durations in milliseconds.
+    """
+    return ", ".join(
+        f"{stage};dur={1000 * seconds:.1f}" for stage, seconds in timings.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the stage timings of each request and reports them, along with the total time spent
+    before the response started, in a `Server-Timing` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = {}
+        token = _timings.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = {"total": time.perf_counter() - started}
+                header = server_timing({**timings, **total}).encode()
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header)
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+
+
+def render():
+    """
+    Render the metrics in the Prometheus text format. With several uvicorn workers, set
+    `PROMETHEUS_MULTIPROC_DIR` so that every worker's metrics are aggregated.
+
+    :return: a tuple of the metrics and their content type.
+    """
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
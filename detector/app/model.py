@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from . import config
+from .batching import BatchScheduler
+from .cache import DetectionCache
+from .images import class_histogram, decode_image, preprocess_image_fast
+from .interpreters import InterpreterPool, interpreter_threads, run_inference
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotReady(Exception):
+    """
+    Raised when a request arrives before the model has been loaded and warmed up.
+    """
+
+    def __init__(self, retry_after=5):
+        super().__init__("The model is still loading, retry later")
+        self.retry_after = retry_after
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Resolution:
+    """
+    The model run at one input resolution: interpreters whose input tensors are allocated at that
+    size, the batch scheduler running on them, and a result cache of its own, since histograms
+    computed at different resolutions cannot stand in for each other.
+
+    :param path: The path to the TFLite model file
+    :param content: The content of the model file
+    :param input_size: The (width, height) images are resized to
+    :param namespace: The name of the result cache
+    :param pool_size: The number of interpreters to load
+    :param num_threads: The intra-op threads of each interpreter, see `InterpreterPool`
+    """
+
+    def __init__(
+        self, path, content, input_size, namespace, pool_size, num_threads=None
+    ):
+        self.input_size = input_size
+        self.pool = InterpreterPool(
+            path, pool_size, model_content=content, num_threads=num_threads
+        )
+        self.scheduler = BatchScheduler(
+            self.pool,
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS,
+        )
+        self.cache = DetectionCache(
+            namespace,
+            max_bytes=config.CACHE_MAX_BYTES,
+            ttl=config.CACHE_TTL_SECONDS,
+            directory=config.CACHE_DIR,
+            disk_max_bytes=config.CACHE_DISK_MAX_BYTES,
+        )
+
+    def warm_up(self, data):
+        """
+        Run an encoded image through decoding, preprocessing and every interpreter of the pool.
+        """
+        processed_image = preprocess_image_fast(decode_image(data), self.input_size)
+
+        # Check out every interpreter at once, otherwise the pool hands out the same one each time
+        with ExitStack() as stack:
+            for _ in range(self.pool.size):
+                interpreter = stack.enter_context(self.pool.checkout())
+                class_histogram(run_inference(interpreter, processed_image))
+
+    async def close(self):
+        await self.scheduler.close()
+        self.cache.close()
+
+
+class LoadedModel:
+    """
+    One version of the model file, with everything that depends on it: the interpreter pool, the
+    batch scheduler running on that pool, and the result cache, which is namespaced by a hash of
+    the model so a new version never serves results computed by an old one.
+
+    When the `CASCADE_SIZE` setting is set, `cascade` holds a second, low resolution, set of
+    interpreters that images go through first.
+
+    Requests hold on to the version they started with through `use()`, so a hot-swap lets them
+    finish on the old model before it is released.
+
+    :param path: The path to the TFLite model file
+    """
+
+    # The resolution the model was trained at
+    input_size = (513, 513)
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = _file_stamp(path)
+        with open(path, "rb") as file:
+            content = file.read()
+        self.version = hashlib.sha256(content).hexdigest()[:12]
+        self.loaded_at = time.time()
+        namespace = os.path.splitext(os.path.basename(path))[0]
+
+        # Both resolutions share the worker's cores, see `interpreters_per_worker`
+        num_threads = interpreter_threads()
+        self.full = Resolution(
+            path,
+            content,
+            self.input_size,
+            f"{namespace}-{self.version}",
+            config.INTERPRETER_POOL_SIZE,
+            num_threads=num_threads,
+        )
+        # The full resolution is what most callers need
+        self.pool, self.scheduler, self.cache = (
+            self.full.pool,
+            self.full.scheduler,
+            self.full.cache,
+        )
+
+        self.cascade = None
+        self.cascade_margin = config.CASCADE_MARGIN
+        if config.CASCADE_SIZE > 0:
+            size = config.CASCADE_SIZE
+            self.cascade = Resolution(
+                path,
+                content,
+                (size, size),
+                f"{namespace}-{self.version}-{size}px",
+                config.CASCADE_POOL_SIZE,
+                num_threads=num_threads,
+            )
+
+        self.users = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def resolutions(self):
+        return [self.full] if self.cascade is None else [self.cascade, self.full]
+
+    def warm_up(self):
+        """
+        Run a synthetic image through decoding, preprocessing and every interpreter of the model,
+        so that the first real requests do not pay for lazy initialisation.
+        """
+        buf = io.BytesIO()
+        Image.new("RGB", (640, 480), color=(200, 120, 80)).save(buf, format="JPEG")
+        for resolution in self.resolutions:
+            resolution.warm_up(buf.getvalue())
+
+    @contextmanager
+    def use(self):
+        """
+        Mark the model as in use for the duration of the `with` block.
+        """
+        self.users += 1
+        self._idle.clear()
+        try:
+            yield self
+        finally:
+            self.users -= 1
+            if self.users == 0:
+                self._idle.set()
+
+    def info(self):
+        return {
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "users": self.users,
+            **self.pool.settings(),
+            "cascade": (
+                None
+                if self.cascade is None
+                else {
+                    "size": self.cascade.input_size[0],
+                    "margin": self.cascade_margin,
+                    **self.cascade.pool.settings(),
+                }
+            ),
+        }
+
+    async def retire(self, remove_cache=False):
+        """
+        Wait for the requests still using this version to finish, then release it.
+
+        :param remove_cache: Whether to delete the result cache as well, when the version that
+        replaces this one caches its results under another namespace
+        """
+        while self.users:
+            await self._idle.wait()
+        await self.close()
+        if remove_cache:
+            for resolution in self.resolutions:
+                resolution.cache.remove()
+
+    async def close(self):
+        for resolution in self.resolutions:
+            await resolution.close()
+
+
+def load_model(path):
+    """
+    Load and warm up a model.
+
+    :param path: The path to the TFLite model file
+    :return: a `LoadedModel` that is ready to serve requests.
+    """
+    model = LoadedModel(path)
+    model.warm_up()
+    logger.info(
+        "Loaded model %s (version %s) with %d interpreters of %d threads, XNNPACK %s",
+        path,
+        model.version,
+        model.pool.size,
+        model.pool.num_threads,
+        "on" if model.pool.xnnpack else "off",
+    )
+    return model
+
+
+_model = None
+_error = None
+_retiring = set()
+
+
+def get_model():
+    """
+    Return the model version new requests should use.
+
+    :return: the current `LoadedModel`.
+    """
+    if _model is None:
+        raise ModelNotReady()
+    return _model
+
+
+def is_ready():
+    return _model is not None
+
+
+def status():
+    """
+    Report whether the model is ready, and which version is serving.
+    """
+    return {
+        "ready": is_ready(),
+        "model": _model.info() if _model is not None else None,
+        "error": _error,
+    }
+
+
+async def start_model(path):
+    """
+    Load and warm up the model in a worker thread. Until this finishes, the detector is not ready
+    and detection requests are answered with `ModelNotReady`.
+
+    :param path: The path to the TFLite model file
+    """
+    global _model, _error
+    try:
+        _model = await run_in_threadpool(load_model, path)
+        _error = None
+    except Exception as e:
+        logger.exception("Could not load model %s", path)
+        _error = str(e)
+
+
+async def reload_model(path):
+    """
+    Load a new version of the model next to the current one, then swap it in atomically. Requests
+    that already started keep running on the old version, which is released once they are done.
+
+    :param path: The path to the TFLite model file
+    :return: the newly loaded `LoadedModel`.
+    """
+    global _model, _error
+    model = await run_in_threadpool(load_model, path)
+    previous, _model, _error = _model, model, None
+    if previous is not None:
+        # A new version never reads the results of the old one, so their cache can go with it
+        task = asyncio.ensure_future(
+            previous.retire(remove_cache=previous.version != model.version)
+        )
+        _retiring.add(task)
+        task.add_done_callback(_retiring.discard)
+    return model
+
+
+async def watch_model(path, interval):
+    """
+    Poll the model file and hot-swap it whenever it changes. Replace the file atomically (write a
+    new file, then rename it over the old one) so a half-written model is never picked up.
+
+    :param path: The path to the TFLite model file
+    :param interval: The number of seconds between two checks
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stamp = _file_stamp(path)
+            if _model is None or stamp != _model.stamp:
+                await reload_model(path)
+        except Exception:
+            logger.exception("Could not reload model %s", path)
+
+
+async def close_model():
+    """
+    Release the current model and any version still being retired.
+    """
+    global _model
+    if _model is not None:
+        await _model.close()
+    _model = None
+    for task in list(_retiring):
+        task.cancel()
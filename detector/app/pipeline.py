@@ -0,0 +1,288 @@
+import asyncio
+import mmap
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from . import config
+from .cache import content_key
+from .executor import get_stage
+from .fetch import ImageFetchError, get_fetcher
+from .images import (
+    class_histogram,
+    decode_image,
+    interpret_histogram,
+    needs_full_resolution,
+    preprocess_image_fast,
+)
+from .metrics import count_cache_lookup, observe, timed
+from .model import get_model
+
+# Whether the current request already holds a slot in the CPU stage
+_admitted = ContextVar("admitted", default=False)
+
+
+@contextmanager
+def _admit():
+    # One slot per request, whether it was taken before the download or by the first segment() of
+    # an image already at hand. The other segment() calls of the same request reuse it
+    if _admitted.get():
+        yield
+        return
+    with get_stage().admit():
+        token = _admitted.set(True)
+        try:
+            yield
+        finally:
+            _admitted.reset(token)
+
+
+def _preprocess(data, target_size):
+    # Runs on the CPU stage, so it reports its own timings rather than the caller timing the queue
+    started = time.perf_counter()
+    image = decode_image(data)
+    image.draft("RGB", target_size)
+    image.load()
+    decoded = time.perf_counter()
+    processed_image = preprocess_image_fast(image, target_size)
+    return processed_image, decoded - started, time.perf_counter() - decoded
+
+
+def _postprocess(output_data):
+    started = time.perf_counter()
+    histogram = class_histogram(output_data)
+    return histogram, time.perf_counter() - started
+
+
+async def segment(data, model=None, resolution=None):
+    """
+    Return the per-class pixel histogram of an encoded image, running the model only when the same
+    image bytes have not been segmented before. Decoding, preprocessing and postprocessing run on
+    the CPU stage, which raises `Overloaded` when it cannot take another request.
+
+    :param data: The encoded image bytes, or any other bytes-like object
+    :param model: The `LoadedModel` to use, the current one by default
+    :param resolution: The `Resolution` of the model to run, `model.full` by default
+    :return: a tuple of the image's `content_key` and its class histogram.
+    """
+    model = model or get_model()
+    resolution = resolution or model.full
+    with model.use():
+        digest = content_key(data)
+        histogram = await run_in_threadpool(resolution.cache.get, digest)
+        if histogram is None:
+            stage = get_stage()
+            # Hold a slot in the CPU stage until the model output has been reduced to a histogram
+            with _admit():
+                processed_image, decode_seconds, preprocess_seconds = await stage.run(
+                    _preprocess, data, resolution.input_size
+                )
+                observe("decode", decode_seconds)
+                observe("preprocess", preprocess_seconds)
+                # Includes the wait for the batch to fill up and for an idle interpreter
+                with timed("invoke"):
+                    output_data = await resolution.scheduler.submit(processed_image)
+                histogram, postprocess_seconds = await stage.run(
+                    _postprocess, output_data
+                )
+                observe("postprocess", postprocess_seconds)
+            await run_in_threadpool(resolution.cache.set, digest, histogram)
+    return digest, histogram
+
+
+def _interpret(histogram, threshold, stage="full"):
+    is_cake_result, proportion = interpret_histogram(histogram, threshold)
+    return bool(is_cake_result), float(proportion), stage
+
+
+def _decide(model, histogram, threshold):
+    # The cascade stage only decides when the proportion is clearly on one side of the threshold
+    result = _interpret(histogram, threshold, "cascade")
+    if needs_full_resolution(result[1], threshold, model.cascade_margin):
+        return None
+    return result
+
+
+def _cached_result(model, digest, threshold):
+    histogram = model.cache.get(digest)
+    if histogram is not None:
+        return _interpret(histogram, threshold)
+    if model.cascade is not None:
+        histogram = model.cascade.cache.get(digest)
+        if histogram is not None:
+            return _decide(model, histogram, threshold)
+    return None
+
+
+async def classify(data, threshold=0.1, model=None):
+    """
+    Decide whether an encoded image is a cake. When the model has a cascade, the image is first
+    segmented at low resolution, and only segmented again at full resolution when its cake
+    proportion is within the cascade margin of the threshold.
+
+    :param data: The encoded image bytes, or any other bytes-like object
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param model: The `LoadedModel` to use, the current one by default
+    :return: a tuple of the image's `content_key` and the (is_cake, proportion, stage) result, where
+    stage is `"cascade"` or `"full"` depending on which resolution decided.
+    """
+    model = model or get_model()
+    with model.use():
+        digest = content_key(data)
+        result = await run_in_threadpool(_cached_result, model, digest, threshold)
+        count_cache_lookup(result is not None)
+        if result is None and model.cascade is not None:
+            _, histogram = await segment(data, model, model.cascade)
+            result = _decide(model, histogram, threshold)
+        if result is None:
+            _, histogram = await segment(data, model)
+            result = _interpret(histogram, threshold)
+    return digest, result
+
+
+async def detect(url, threshold=0.1, model=None):
+    """
+    Classify the image at a URL. The segmentation of every image is cached by content and by URL,
+    so a repeated image is answered for any threshold without being downloaded or run through the
+    model again. Otherwise the image is downloaded without blocking the event loop, preprocessed on
+    the CPU stage, then handed to the model's batch scheduler so that it shares an inference with
+    any other request arriving at the same time.
+
+    The slot in the CPU stage is taken before the download, so an overloaded detector raises
+    `Overloaded` without holding the image in memory first.
+
+    :param url: The URL of the image you want to classify as a cake or not
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param model: The `LoadedModel` to use, the current one by default
+    :return: a tuple containing a boolean indicating whether the image is classified as a cake, the
+    proportion of the image classified as cake, and the cascade stage that decided (see `classify`).
+    """
+    # Stick to one model version for the whole request, even if it is swapped in the meantime
+    model = model or get_model()
+    with model.use():
+        result = None
+        digest = await run_in_threadpool(model.cache.get_digest, url)
+        if digest is not None:
+            result = await run_in_threadpool(_cached_result, model, digest, threshold)
+        if result is not None:
+            count_cache_lookup(True)
+        else:
+            try:
+                with _admit():
+                    async with get_fetcher().fetch(url) as data:
+                        digest, result = await classify(data, threshold, model)
+            except ImageFetchError as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Error downloading image: {e}"
+                ) from e
+            await run_in_threadpool(model.cache.set_url, url, digest)
+    return result
+
+
+async def detect_bytes(data, threshold=0.1, model=None):
+    """
+    Like `detect`, for an image whose encoded bytes are already at hand, such as an upload.
+
+    :param data: The encoded image bytes, or any other bytes-like object
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param model: The `LoadedModel` to use, the current one by default
+    :return: the (is_cake, proportion, stage) tuple returned by `detect`.
+    """
+    _, result = await classify(data, threshold, model)
+    return result
+
+
+def resolve_local_path(path):
+    """
+    Resolve a path relative to the `LOCAL_IMAGE_ROOT` setting, making sure it does not escape it.
+    Reading local files is only possible on trusted deployments that set a root.
+
+    :param path: The path of the image, relative to the root
+    :return: the absolute path of the image.
+    """
+    if not config.LOCAL_IMAGE_ROOT:
+        raise HTTPException(
+            status_code=403,
+            detail="Reading local files is not enabled on this detector",
+        )
+    root = os.path.realpath(config.LOCAL_IMAGE_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=403, detail="Path is outside of the image root")
+    return resolved
+
+
+@contextmanager
+def _map_file(path):
+    # Map the file into memory instead of reading it; pages are loaded as they are hashed and decoded
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image file not found")
+    except OSError as e:
+        raise HTTPException(status_code=400, detail=f"Error reading image: {e}")
+    with file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise HTTPException(status_code=400, detail="Image file is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = memoryview(mapped)
+            try:
+                yield data
+            finally:
+                data.release()
+
+
+async def detect_path(path, threshold=0.1, model=None):
+    """
+    Like `detect`, for an image file on the detector's own disk, read through a memory mapping.
+
+    :param path: The path of the image, relative to the `LOCAL_IMAGE_ROOT` setting
+    :param threshold: The minimum proportion of cake pixels for the image to count as a cake
+    :param model: The `LoadedModel` to use, the current one by default
+    :return: the (is_cake, proportion, stage) tuple returned by `detect`.
+    """
+    with _map_file(resolve_local_path(path)) as data:
+        _, result = await classify(data, threshold, model)
+    return result
+
+
+async def detect_many(queries, concurrency, model=None):
+    """
+    Run `detect` for many images concurrently and yield each result as soon as it is ready. Up to
+    `concurrency` images are downloaded and processed at once; the batch scheduler groups their
+    inferences. A failing image does not stop the others: its exception is yielded in place of a
+    result.
+
+    :param queries: A list of (url, threshold) pairs
+    :param concurrency: The maximum number of images processed at the same time
+    :param model: The `LoadedModel` to use, the current one by default
+    :return: an async generator of (index, result) pairs in completion order, where result is either
+    the (is_cake, proportion, stage) tuple returned by `detect` or the exception it raised.
+    """
+    # The whole batch runs on the model version that was current when it started
+    model = model or get_model()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _detect(index, url, threshold):
+        async with semaphore:
+            try:
+                return index, await detect(url, threshold, model)
+            except Exception as e:
+                return index, e
+
+    with model.use():
+        tasks = [
+            asyncio.ensure_future(_detect(index, url, threshold))
+            for index, (url, threshold) in enumerate(queries)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # The client went away: stop working on the remaining images
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,116 @@
+"""
+Measure how often the low resolution cascade agrees with the full resolution model.
+
+The images are read from a labelled folder with one sub-folder per label: images in the
+`--positive` sub-folder (`cake` by default) are cakes, images in any other sub-folder are not.
+Every image is run through the model at full resolution and at the cascade resolution, then the
+cascade is replayed for each margin: its decision, how many images it escalated, its agreement
+with the full resolution decision, both accuracies against the labels, and the average time per
+image.
+
+Usage (from the detector directory):
+
+    python -m benchmarks.cascade path/to/labelled --size 129 --margin 0.02 0.05 0.1
+"""
+
+import argparse
+import os
+import time
+
+from app import config
+from app.images import (
+    class_histogram,
+    decode_image,
+    interpret_histogram,
+    needs_full_resolution,
+    preprocess_image_fast,
+)
+from app.interpreters import InterpreterPool, run_inference
+from app.model import LoadedModel
+
+
+def labelled_images(folder, positive):
+    for label in sorted(os.listdir(folder)):
+        directory = os.path.join(folder, label)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            yield os.path.join(directory, name), label == positive
+
+
+def measure(pool, data, size, threshold):
+    start = time.perf_counter()
+    processed_image = preprocess_image_fast(decode_image(data), size)
+    with pool.checkout() as interpreter:
+        histogram = class_histogram(run_inference(interpreter, processed_image))
+    elapsed = time.perf_counter() - start
+    is_cake, proportion = interpret_histogram(histogram, threshold)
+    return bool(is_cake), float(proportion), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "folder", help="A folder with one sub-folder of images per label"
+    )
+    parser.add_argument("--model", default=config.MODEL_PATH)
+    parser.add_argument("--size", type=int, default=config.CASCADE_SIZE or 129)
+    parser.add_argument(
+        "--margin", type=float, nargs="+", default=[config.CASCADE_MARGIN]
+    )
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--positive", default="cake")
+    args = parser.parse_args()
+
+    full_pool = InterpreterPool(args.model)
+    cascade_pool = InterpreterPool(args.model)
+    full_size = LoadedModel.input_size
+    cascade_size = (args.size, args.size)
+
+    results = []
+    for path, label in labelled_images(args.folder, args.positive):
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            full = measure(full_pool, data, full_size, args.threshold)
+            cascade = measure(cascade_pool, data, cascade_size, args.threshold)
+        except OSError as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        results.append((label, full, cascade))
+
+    if not results:
+        parser.error(f"No images found in {args.folder}")
+
+    count = len(results)
+    full_accuracy = sum(full[0] == label for label, full, _ in results) / count
+    full_ms = 1000 * sum(full[2] for _, full, _ in results) / count
+    print(
+        f"{count} images, threshold {args.threshold}, cascade at {args.size}x{args.size}"
+    )
+    print(f"full resolution: accuracy {full_accuracy:.1%}, {full_ms:.1f} ms per image")
+    print()
+    print(
+        f"{'margin':>8}{'escalated':>11}{'agreement':>11}{'accuracy':>10}{'ms':>8}{'speedup':>9}"
+    )
+    for margin in args.margin:
+        escalated = agreed = correct = 0
+        elapsed = 0.0
+        for label, full, cascade in results:
+            is_cake, proportion, cascade_elapsed = cascade
+            elapsed += cascade_elapsed
+            if needs_full_resolution(proportion, args.threshold, margin):
+                escalated += 1
+                is_cake = full[0]
+                elapsed += full[2]
+            agreed += is_cake == full[0]
+            correct += is_cake == label
+        cascade_ms = 1000 * elapsed / count
+        print(
+            f"{margin:>8.3f}{escalated / count:>11.1%}{agreed / count:>11.1%}"
+            f"{correct / count:>10.1%}{cascade_ms:>8.1f}{full_ms / cascade_ms:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Benchmark every stage of the detection pipeline, offline.
+
+Synthetic JPEG and PNG images of several sizes are served by a local HTTP server standing in for
+the image hosts. The suite reports:
+
+- the latency percentiles of each stage run on its own: the download through `ImageFetcher`,
+  `preprocess_image`,
+  `preprocess_image_fast`, the interpreter's `invoke()` and `interpret_output`,
+- the throughput and latency of the whole asynchronous pipeline (`detect`) at several
+  concurrencies, with the result cache disabled,
+- the peak resident set size of the process after each part.
+
+The results are written as JSON so that two commits can be compared with any diff tool.
+
+Usage (from the detector directory):
+
+    python -m benchmarks.pipeline --model 1.tflite --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from app import config
+from app.executor import close_stage
+from app.fetch import close_fetcher, get_fetcher
+from app.images import (
+    decode_image,
+    interpret_output,
+    preprocess_image,
+    preprocess_image_fast,
+)
+from app.interpreters import run_inference
+from app.model import load_model
+from app.pipeline import detect
+from benchmarks.preprocess import SIZES, synthetic_image
+
+FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png")}
+
+
+class ImageHost(ThreadingHTTPServer):
+    """
+    A local HTTP server serving a fixed set of images, standing in for the image hosts.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, images):
+        # images maps a path to a (content type, body) pair
+        self.images = images
+        super().__init__(("127.0.0.1", 0), ImageHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        image = self.server.images.get(self.path)
+        if image is None:
+            self.send_error(404)
+            return
+        content_type, body = image
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return {
+        "count": len(timings),
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p90_ms": float(np.percentile(timings, 90)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "max_ms": float(timings.max()),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+async def download(url):
+    async with get_fetcher().fetch(url) as data:
+        return decode_image(bytes(data))
+
+
+def benchmark_stages(host, images, pool, repeat):
+    """
+    Time each stage of the pipeline separately, for every image.
+    """
+    # A single event loop for every download, so the fetcher keeps its connections open
+    loop = asyncio.new_event_loop()
+    results = {}
+    for path in images:
+        label = path.rsplit("/", 1)[-1]
+        timings = {
+            stage: []
+            for stage in (
+                "download",
+                "preprocess_image",
+                "preprocess_image_fast",
+                "invoke",
+                "interpret_output",
+            )
+        }
+        for _ in range(repeat):
+            elapsed, image = timed(loop.run_until_complete, download(host.url(path)))
+            timings["download"].append(elapsed)
+            elapsed, _ = timed(preprocess_image, image)
+            timings["preprocess_image"].append(elapsed)
+
+            _, data = host.images[path]
+            elapsed, processed_image = timed(preprocess_image_fast, decode_image(data))
+            timings["preprocess_image_fast"].append(elapsed)
+
+            with pool.checkout() as interpreter:
+                # Set the input up first, so only the inference itself is timed
+                run_inference(interpreter, processed_image)
+                elapsed, _ = timed(interpreter.invoke)
+                output_details = interpreter.get_output_details()
+                output_data = interpreter.get_tensor(output_details[0]["index"])
+            timings["invoke"].append(elapsed)
+
+            elapsed, _ = timed(interpret_output, output_data)
+            timings["interpret_output"].append(elapsed)
+        results[label] = {stage: percentiles(t) for stage, t in timings.items()}
+    loop.run_until_complete(close_fetcher())
+    loop.close()
+    return results
+
+
+async def _run_concurrently(urls, concurrency, model):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def _detect(url):
+        async with semaphore:
+            start = time.perf_counter()
+            await detect(url, 0.1, model)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_detect(url) for url in urls))
+    elapsed = time.perf_counter() - start
+    for resolution in model.resolutions:
+        await resolution.scheduler.close()
+    await close_fetcher()
+    return elapsed, latencies
+
+
+def benchmark_throughput(urls, concurrencies, model):
+    """
+    Run the whole asynchronous pipeline over the images at several concurrencies.
+    """
+    results = []
+    for concurrency in concurrencies:
+        elapsed, latencies = asyncio.run(_run_concurrently(urls, concurrency, model))
+        results.append(
+            {
+                "concurrency": concurrency,
+                "requests": len(urls),
+                "images_per_second": len(urls) / elapsed,
+                "latency": percentiles(latencies),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=config.MODEL_PATH)
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="Runs of each stage per image"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=64, help="Requests per concurrency"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--output", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    # Every request must go through the model, not the result cache
+    config.CACHE_DIR = ""
+    config.CACHE_MAX_BYTES = 0
+
+    images = {}
+    for format, (extension, content_type) in FORMATS.items():
+        for width, height in SIZES:
+            data = synthetic_image((width, height), format)
+            images[f"/{width}x{height}.{extension}"] = (content_type, data)
+    # The largest synthetic PNGs are noisier, and so bigger, than real photos
+    config.FETCH_MAX_BYTES = max(
+        config.FETCH_MAX_BYTES, *(len(d) for _, d in images.values())
+    )
+
+    model = load_model(args.model)
+    started = peak_rss_mb()
+
+    with ImageHost(images) as host:
+        stages = benchmark_stages(host, images, model.pool, args.repeat)
+        stages_rss = peak_rss_mb()
+        urls = [host.url(path) for path in images]
+        urls = (urls * (args.requests // len(urls) + 1))[: args.requests]
+        throughput = benchmark_throughput(urls, args.concurrency, model)
+    close_stage()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "model": args.model,
+            "model_version": model.version,
+            "interpreter": model.pool.settings(),
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "stages": stages,
+        "throughput": throughput,
+        "peak_rss_mb": {
+            "after_loading": started,
+            "after_stages": stages_rss,
+            "after_throughput": peak_rss_mb(),
+        },
+    }
+
+    print(f"{'image':<16}{'stage':<24}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for label, timings in stages.items():
+        for stage, stats in timings.items():
+            print(
+                f"{label:<16}{stage:<24}{stats['p50_ms']:>9.2f}{stats['p90_ms']:>9.2f}"
+                f"{stats['p99_ms']:>9.2f}"
+            )
+    print()
+    print(
+        f"{'concurrency':>12}{'images/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'peak RSS MB':>13}"
+    )
+    for run in throughput:
+        print(
+            f"{run['concurrency']:>12}{run['images_per_second']:>10.1f}"
+            f"{run['latency']['p50_ms']:>9.1f}{run['latency']['p99_ms']:>9.1f}"
+            f"{run['peak_rss_mb']:>13.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
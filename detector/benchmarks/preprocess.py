@@ -0,0 +1,76 @@
+"""
+Compare `preprocess_image` with `preprocess_image_fast` on synthetic JPEG and PNG images.
+
+Both functions are timed from the encoded bytes, since the draft decoding of the fast path only
+pays off when decoding is included. The maximum per-pixel difference between the two results is
+reported next to the timings.
+
+Usage (from the detector directory):
+
+    python -m benchmarks.preprocess --repeat 20
+"""
+
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.images import preprocess_image, preprocess_image_fast
+
+SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+
+
+def synthetic_image(size, format, seed=0):
+    """
+    Encode a smooth gradient with some noise, which compresses like a photo rather than a flat
+    colour.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    pixels += rng.normal(0, 12, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+    if format == "PNG":
+        image = image.convert("RGBA")
+    buf = io.BytesIO()
+    image.save(buf, format=format, quality=90)
+    return buf.getvalue()
+
+
+def time_function(fn, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(Image.open(io.BytesIO(data)))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(
+        f"{'image':<16}{'bytes':>10}{'current ms':>12}{'fast ms':>10}{'speedup':>9}{'max diff':>10}"
+    )
+    for format in ("JPEG", "PNG"):
+        for size in SIZES:
+            data = synthetic_image(size, format)
+            current, reference = time_function(preprocess_image, data, args.repeat)
+            fast, result = time_function(preprocess_image_fast, data, args.repeat)
+            difference = np.abs(result.astype(np.int16) - reference).max()
+            label = f"{format} {size[0]}x{size[1]}"
+            print(
+                f"{label:<16}{len(data):>10}{current:>12.1f}{fast:>10.1f}"
+                f"{current / fast:>8.1f}x{difference:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# tests/conftest.py
+
+import io
+import time
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import config
+from app.fetch import ImageFetcher
+from app.main import app
+from app.model import LoadedModel
+
+
+class FakeInterpreter:
+    """
+    Stands in for a TFLite interpreter. Pixels with a non-zero red channel are segmented as
+    'sweets/desserts' (class 20), everything else as background (class 0).
+    """
+
+    def __init__(self, model_path=None, batchable=True, size=8, **kwargs):
+        self.model_path = model_path
+        self.batchable = batchable
+        self.input_shape = np.array([1, size, size, 3])
+        self.invocations = []
+        self._input = None
+        self._output = None
+
+    def allocate_tensors(self):
+        self._input = np.zeros(tuple(self.input_shape), dtype=np.uint8)
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": self.input_shape, "dtype": np.uint8}]
+
+    def get_output_details(self):
+        return [{"index": 1}]
+
+    def resize_tensor_input(self, index, shape):
+        if not self.batchable and shape[0] != 1:
+            raise ValueError("Cannot set tensor: Dimension mismatch")
+        self.input_shape = np.array(shape)
+        self._input = None
+
+    def set_tensor(self, index, value):
+        if tuple(self.input_shape) != value.shape:
+            raise ValueError("Cannot set tensor: Dimension mismatch")
+        self._input[...] = value
+
+    def tensor(self, index):
+        return lambda: self._input
+
+    def invoke(self):
+        self.invocations.append(len(self._input))
+        output = np.zeros(self._input.shape[:3] + (21,), dtype=np.float32)
+        output[..., 0] = 0.5
+        output[..., 20] = self._input[..., 0] / 255
+        self._output = output
+
+    def get_tensor(self, index):
+        return self._output.copy()
+
+
+@pytest.fixture
+def fake_interpreter():
+    """
+    Patch the TFLite runtime so every interpreter loaded by a pool is a `FakeInterpreter`.
+    """
+    with patch("tflite_runtime.interpreter.Interpreter", FakeInterpreter):
+        yield FakeInterpreter
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """
+    Keep the on-disk detection cache of every test in its own temporary directory.
+    """
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def model_file(tmp_path, monkeypatch):
+    """
+    A model file for the `FakeInterpreter`, which ignores its content, set as the `MODEL_PATH`.
+    """
+    path = tmp_path / "model.tflite"
+    path.write_bytes(b"fake model")
+    monkeypatch.setattr(config, "MODEL_PATH", str(path))
+    return path
+
+
+@pytest.fixture
+def model(fake_interpreter, model_file):
+    """
+    A `LoadedModel` running on `FakeInterpreter`s.
+    """
+    model = LoadedModel(str(model_file))
+    yield model
+    model.cache.close()
+
+
+def image_bytes(color="red", size=(100, 100), format="PNG"):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buf, format=format)
+    return buf.getvalue()
+
+
+class ImageServer:
+    """
+    An in-memory image host for the fetcher, built on httpx's mock transport.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+
+    def add(self, url, content, content_type="image/png", status_code=200):
+        self.responses[url] = httpx.Response(
+            status_code, headers={"content-type": content_type}, content=content
+        )
+
+    def handler(self, request):
+        self.requests.append(str(request.url))
+        response = self.responses.get(str(request.url))
+        return response if response is not None else httpx.Response(404)
+
+
+@pytest.fixture
+def image_server():
+    """
+    Serve images to the detection pipeline from an `ImageServer` instead of the network.
+    """
+    server = ImageServer()
+    fetcher = ImageFetcher(transport=httpx.MockTransport(server.handler))
+    with patch("app.pipeline.get_fetcher", return_value=fetcher):
+        yield server
+
+
+def wait_until_ready(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while client.get("/ready").status_code != 200:
+        assert time.monotonic() < deadline, "The model was never ready"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def live_client(fake_interpreter, model_file, monkeypatch):
+    """
+    Run the app's lifespan so the (fake) model is loaded and everything is shut down afterwards.
+    """
+    monkeypatch.setattr(config, "MODEL_WATCH_INTERVAL", 0)
+    with TestClient(app) as live_client:
+        wait_until_ready(live_client)
+        yield live_client
@@ -0,0 +1,78 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.batching import BatchScheduler
+from app.images import interpret_output
+from app.interpreters import InterpreterPool
+
+
+def make_image(red, size=8):
+    image = np.zeros((1, size, size, 3), dtype=np.uint8)
+    image[..., 0] = red
+    return image
+
+
+def run_concurrently(scheduler, images):
+    async def _run():
+        try:
+            return await asyncio.gather(*(scheduler.submit(image) for image in images))
+        finally:
+            await scheduler.close()
+
+    return asyncio.run(_run())
+
+
+def test_concurrent_requests_share_one_inference(fake_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+    scheduler = BatchScheduler(pool, max_batch_size=4, max_wait_ms=50)
+
+    outputs = run_concurrently(
+        scheduler, [make_image(255), make_image(0), make_image(255)]
+    )
+
+    with pool.checkout() as interpreter:
+        assert interpreter.invocations == [3]
+    # Every caller gets its own slice of the batched output back
+    assert [output.shape for output in outputs] == [(1, 8, 8, 21)] * 3
+    assert [interpret_output(output)[0] for output in outputs] == [True, False, True]
+
+
+def test_batches_are_capped_at_max_batch_size(fake_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+    scheduler = BatchScheduler(pool, max_batch_size=2, max_wait_ms=50)
+
+    outputs = run_concurrently(scheduler, [make_image(255)] * 5)
+
+    assert len(outputs) == 5
+    with pool.checkout() as interpreter:
+        assert sorted(interpreter.invocations) == [1, 2, 2]
+
+
+def test_falls_back_to_single_invokes_for_fixed_batch_models(fake_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+    with pool.checkout() as interpreter:
+        interpreter.batchable = False
+    scheduler = BatchScheduler(pool, max_batch_size=4, max_wait_ms=50)
+
+    outputs = run_concurrently(scheduler, [make_image(255), make_image(0)])
+
+    assert not scheduler.batchable
+    assert [interpret_output(output)[0] for output in outputs] == [True, False]
+    with pool.checkout() as interpreter:
+        assert interpreter.invocations == [1, 1]
+
+
+def test_inference_errors_reach_every_caller(fake_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+    scheduler = BatchScheduler(pool, max_batch_size=4, max_wait_ms=50)
+
+    # The wrong image size cannot be stacked with the others
+    with pytest.raises(ValueError):
+        run_concurrently(scheduler, [make_image(255), make_image(255, size=4)])
+
+
+def test_rejects_empty_batch_size(fake_interpreter):
+    with pytest.raises(ValueError):
+        BatchScheduler(InterpreterPool("model.tflite"), max_batch_size=0)
@@ -0,0 +1,124 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app.cache import DetectionCache, DiskCache, LRUCache, content_key
+
+
+def test_content_key_depends_only_on_bytes():
+    assert content_key(b"cake") == content_key(b"cake")
+    assert content_key(b"cake") != content_key(b"pie")
+
+
+def test_lru_cache_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", "A", 4)
+    cache.set("b", "B", 4)
+    cache.get("a")
+    cache.set("c", "C", 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.size == 8
+
+
+def test_lru_cache_skips_values_larger_than_budget():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", "A", 11)
+
+    assert len(cache) == 0
+
+
+@patch("app.cache.time.monotonic")
+def test_lru_cache_expires_entries(mock_monotonic):
+    mock_monotonic.return_value = 100
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", "A", 1)
+
+    mock_monotonic.return_value = 159
+    assert cache.get("a") == "A"
+    mock_monotonic.return_value = 160
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+@patch("app.cache.time.time")
+def test_disk_cache_expires_entries(mock_time, tmp_path):
+    mock_time.return_value = 100
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set("a", b"A")
+
+    assert cache.get("a") == b"A"
+    mock_time.return_value = 160
+    assert cache.get("a") is None
+
+
+def test_detection_cache_round_trip(tmp_path):
+    histogram = np.arange(21)
+    cache = DetectionCache("model", max_bytes=1024, ttl=60, directory=str(tmp_path))
+    cache.set("digest", histogram)
+    cache.set_url("http://example.com/image.jpg", "digest")
+
+    np.testing.assert_array_equal(cache.get("digest"), histogram)
+    np.testing.assert_array_equal(
+        cache.get_url("http://example.com/image.jpg"), histogram
+    )
+    assert cache.get_url("http://example.com/other.jpg") is None
+
+
+def test_detection_cache_shares_disk_tier(tmp_path):
+    histogram = np.arange(21)
+    writer = DetectionCache("model", max_bytes=1024, ttl=60, directory=str(tmp_path))
+    writer.set("digest", histogram)
+    writer.set_url("http://example.com/image.jpg", "digest")
+
+    reader = DetectionCache("model", max_bytes=1024, ttl=60, directory=str(tmp_path))
+    np.testing.assert_array_equal(
+        reader.get_url("http://example.com/image.jpg"), histogram
+    )
+    # The hit is promoted into the reader's memory tier
+    assert len(reader.memory) == 2
+
+
+def test_detection_cache_without_disk_tier():
+    cache = DetectionCache("model", max_bytes=1024, ttl=60)
+    cache.set("digest", np.arange(21))
+
+    assert cache.disk is None
+    assert cache.get("digest") is not None
+
+
+@patch("app.cache.time.time")
+def test_disk_cache_purges_expired_entries_on_write(mock_time, tmp_path):
+    mock_time.return_value = 100
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), ttl=60, purge_interval=30)
+    cache.set("a", b"A")
+    mock_time.return_value = 170
+    cache.set("b", b"B")
+
+    rows = cache._connection.execute("SELECT key FROM entries").fetchall()
+    assert rows == [("b",)]
+
+
+@patch("app.cache.time.time")
+def test_disk_cache_evicts_oldest_entries_beyond_max_bytes(mock_time, tmp_path):
+    mock_time.return_value = 100
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), ttl=60, max_bytes=256 * 1024)
+    for i in range(200):
+        mock_time.return_value = 100 + i
+        cache.set(f"key{i}", bytes(4096))
+
+    assert cache.size <= 256 * 1024
+    assert cache.get("key199") is not None
+    assert cache.get("key0") is None
+
+
+def test_detection_cache_remove_deletes_disk_tier(tmp_path):
+    cache = DetectionCache("model", max_bytes=1024, ttl=60, directory=str(tmp_path))
+    cache.set("digest", np.arange(21))
+
+    cache.remove()
+
+    assert list(tmp_path.iterdir()) == []
+    assert len(cache.memory) == 0
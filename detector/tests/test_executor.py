@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.executor import CPUStage, Overloaded
+
+
+def test_run_in_threads():
+    stage = CPUStage(kind="thread", workers=2)
+
+    result = asyncio.run(stage.run(threading.current_thread))
+
+    assert result.name.startswith("detector-cpu")
+    assert stage.stats()["wait_ms"]["max"] >= 0
+    stage.shutdown()
+
+
+def test_run_in_processes():
+    stage = CPUStage(kind="process", workers=1)
+
+    # Memoryviews are copied into bytes before crossing into the worker process
+    result = asyncio.run(stage.run(bytes.upper, memoryview(b"cake")))
+
+    assert result == b"CAKE"
+    stage.shutdown()
+
+
+def test_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        CPUStage(kind="fibers")
+
+
+def test_admission_fails_fast_when_full():
+    stage = CPUStage(kind="thread", workers=1, max_queue=1, retry_after=2)
+
+    with stage.admit(), stage.admit():
+        assert stage.stats()["queued"] == 1
+        with pytest.raises(Overloaded) as exc_info:
+            with stage.admit():
+                pass
+        assert exc_info.value.retry_after == 2
+
+    assert stage.admitted == 0
+    assert stage.rejected == 1
+    # Room is made again as soon as requests leave the stage
+    with stage.admit():
+        pass
+    stage.shutdown()
+
+
+def test_queue_wait_is_measured():
+    stage = CPUStage(kind="thread", workers=1, max_queue=4)
+    release = threading.Event()
+
+    async def _run():
+        blocker = asyncio.ensure_future(stage.run(release.wait))
+        waiter = asyncio.ensure_future(stage.run(len, b"cake"))
+        await asyncio.sleep(0.05)
+        assert stage.stats()["waiting_jobs"] == 2
+        release.set()
+        return await asyncio.gather(blocker, waiter)
+
+    assert asyncio.run(_run()) == [True, 4]
+    stats = stage.stats()
+    assert stats["waiting_jobs"] == 0
+    # The second job waited for the first one to finish
+    assert stats["wait_ms"]["max"] >= 40
+    stage.shutdown()
@@ -0,0 +1,144 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.fetch import ImageFetcher, ImageFetchError
+from tests.conftest import ImageServer, image_bytes
+
+URL = "http://example.com/image.png"
+
+
+def fetch(fetcher, url):
+    async def _fetch():
+        async with fetcher.fetch(url) as data:
+            return bytes(data)
+
+    return asyncio.run(_fetch())
+
+
+@pytest.fixture
+def server():
+    return ImageServer()
+
+
+def test_fetch(server):
+    content = image_bytes()
+    server.add(URL, content)
+    fetcher = ImageFetcher(transport=httpx.MockTransport(server.handler))
+
+    assert fetch(fetcher, URL) == content
+
+
+def test_fetch_reuses_buffers(server):
+    server.add(URL, image_bytes(size=(200, 200)))
+    server.add("http://example.com/small.png", image_bytes(size=(10, 10)))
+    fetcher = ImageFetcher(transport=httpx.MockTransport(server.handler))
+
+    fetch(fetcher, URL)
+    buffer = fetcher._buffers[-1]
+    # A smaller image lands in the same, already allocated, buffer
+    assert fetch(fetcher, "http://example.com/small.png") == image_bytes(size=(10, 10))
+    assert fetcher._buffers == [buffer]
+
+
+@pytest.mark.parametrize("content_type", ["text/html", "application/json", ""])
+def test_fetch_rejects_non_images(server, content_type):
+    server.add(URL, b"not an image", content_type=content_type)
+    fetcher = ImageFetcher(transport=httpx.MockTransport(server.handler))
+
+    with pytest.raises(ImageFetchError, match="Unsupported content type"):
+        fetch(fetcher, URL)
+
+
+def test_fetch_rejects_large_declared_body(server):
+    server.add(URL, b"x" * 101)
+    fetcher = ImageFetcher(max_bytes=100, transport=httpx.MockTransport(server.handler))
+
+    with pytest.raises(ImageFetchError, match="larger than 100 bytes"):
+        fetch(fetcher, URL)
+
+
+def test_fetch_rejects_invalid_declared_length():
+    def handler(request):
+        return httpx.Response(
+            200,
+            headers={"content-type": "image/png", "content-length": "lots"},
+            content=b"x",
+        )
+
+    fetcher = ImageFetcher(transport=httpx.MockTransport(handler))
+
+    with pytest.raises(ImageFetchError, match="Invalid content length"):
+        fetch(fetcher, URL)
+    assert fetcher._hosts == {}
+
+
+def test_fetch_rejects_large_streamed_body():
+    async def chunks():
+        for _ in range(2):
+            yield b"x" * 60
+
+    def handler(request):
+        # No content-length: the limit is enforced while streaming
+        return httpx.Response(
+            200, headers={"content-type": "image/png"}, content=chunks()
+        )
+
+    fetcher = ImageFetcher(max_bytes=100, transport=httpx.MockTransport(handler))
+
+    with pytest.raises(ImageFetchError, match="larger than 100 bytes"):
+        fetch(fetcher, URL)
+
+
+def test_fetch_http_errors(server):
+    server.add(URL, b"", status_code=500)
+    fetcher = ImageFetcher(transport=httpx.MockTransport(server.handler))
+
+    with pytest.raises(ImageFetchError):
+        fetch(fetcher, URL)
+    with pytest.raises(ImageFetchError):
+        fetch(fetcher, "http://example.com/missing.png")
+
+
+def test_fetch_timeouts():
+    def handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    fetcher = ImageFetcher(transport=httpx.MockTransport(handler))
+
+    with pytest.raises(ImageFetchError, match="timed out"):
+        fetch(fetcher, URL)
+
+
+def test_fetch_limits_concurrency_per_host():
+    in_flight = {"example.com": 0, "other.com": 0}
+    peak = dict(in_flight)
+
+    async def handler(request):
+        host = request.url.host
+        in_flight[host] += 1
+        peak[host] = max(peak[host], in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return httpx.Response(200, headers={"content-type": "image/png"}, content=b"x")
+
+    fetcher = ImageFetcher(
+        max_connections_per_host=2, transport=httpx.MockTransport(handler)
+    )
+
+    async def _fetch_all():
+        async def _fetch(url):
+            async with fetcher.fetch(url):
+                pass
+
+        await asyncio.gather(
+            *(_fetch(f"http://example.com/{i}.png") for i in range(6)),
+            *(_fetch(f"http://other.com/{i}.png") for i in range(2)),
+        )
+
+    asyncio.run(_fetch_all())
+
+    assert peak == {"example.com": 2, "other.com": 2}
+    # Hosts without downloads in progress do not keep a semaphore
+    assert fetcher._hosts == {}
@@ -1,32 +1,17 @@
 import io
-from unittest.mock import MagicMock, patch
 
 import numpy as np
 import pytest
 from PIL import Image
 
-from app.images import download_image, interpret_output, is_cake, preprocess_image
-
-
-@patch("requests.get")
-def test_download_image(mock_get):
-    # Create a simple image and save it to a bytes buffer
-    image = Image.new("RGB", (100, 100), color="red")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-
-    # Mock the response
-    mock_response = MagicMock()
-    mock_response.content = buf.read()
-    mock_get.return_value = mock_response
-
-    # Call the function
-    image = download_image("http://example.com/image.jpg")
-
-    # Assertions
-    assert image is not None
-    mock_get.assert_called_with("http://example.com/image.jpg")
+from app.images import (
+    class_histogram,
+    interpret_histogram,
+    interpret_output,
+    preprocess_image,
+    preprocess_image_fast,
+)
+from tests.conftest import image_bytes
 
 
 def test_preprocess_image():
@@ -52,6 +37,47 @@ def test_preprocess_image():
     assert processed_image.shape[0] == 1  # Batch dimension check
 
 
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P"])
+def test_preprocess_image_fast_matches_preprocess_image(mode):
+    pixels = np.random.default_rng(0).integers(0, 255, (120, 80, 4), dtype=np.uint8)
+    image = Image.fromarray(pixels, "RGBA")
+    if mode != "RGBA":
+        image = image.convert("RGB").convert(mode)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+
+    fast = preprocess_image_fast(Image.open(io.BytesIO(buf.getvalue())))
+    reference = preprocess_image(Image.open(io.BytesIO(buf.getvalue())))
+
+    assert fast.shape == (1, 513, 513, 3)
+    assert fast.dtype == np.uint8
+    if mode != "P":  # preprocess_image reads palette indices as grey levels
+        np.testing.assert_array_equal(fast, reference)
+
+
+def test_preprocess_image_fast_decodes_large_jpeg_at_reduced_scale():
+    data = image_bytes("orange", size=(4000, 3000), format="JPEG")
+    image = Image.open(io.BytesIO(data))
+
+    processed_image = preprocess_image_fast(image, target_size=(513, 513))
+
+    # Decoded at 1/4 scale, the smallest that still covers the target size
+    assert image.size == (1000, 750)
+    reference = preprocess_image(Image.open(io.BytesIO(data)))
+    assert np.abs(processed_image.astype(int) - reference).max() <= 2
+
+
+def test_preprocess_image_fast_writes_into_out():
+    out = np.zeros((1, 20, 10, 3), dtype=np.uint8)
+
+    result = preprocess_image_fast(
+        Image.new("RGB", (100, 100), color="red"), target_size=(10, 20), out=out
+    )
+
+    assert result is out
+    assert (out[..., 0] == 255).all()
+
+
 def test_interpret_output():
     # Create mock output data from a neural network model
     # Simulate a 10x10 image with 21 classes (class IDs 0-20)
@@ -64,7 +90,9 @@ def test_interpret_output():
 
     # Call the function with a threshold
     threshold = 0.1
-    is_cake, proportion_cake_pixels = interpret_output(mock_output, threshold)
+    is_cake, proportion_cake_pixels, histogram = interpret_output(
+        mock_output, threshold
+    )
 
     # Check if the function correctly identifies the image as cake
     assert is_cake
@@ -73,45 +101,70 @@ def test_interpret_output():
     # 50% of the image is classified as cake
     assert proportion_cake_pixels == 0.5
 
+    # The full class histogram comes back too
+    assert histogram.tolist() == [50] + [0] * 18 + [25, 25]
+
     # Test with a higher threshold
     high_threshold = 0.6
-    is_cake_high_threshold, _ = interpret_output(mock_output, high_threshold)
+    is_cake_high_threshold, _, _ = interpret_output(mock_output, high_threshold)
     assert not is_cake_high_threshold
 
 
-@patch("app.images.download_image")
-@patch("app.images.preprocess_image")
-@patch("tflite_runtime.interpreter.Interpreter")
-def test_is_cake(mock_interpreter, mock_preprocess_image, mock_download_image):
-    # Mock the download_image function
-    mock_image = MagicMock()
-    mock_download_image.return_value = mock_image
+def test_interpret_output_batched():
+    mock_output = np.zeros((3, 10, 10, 21), dtype=np.float32)
+    mock_output[0, :, :, 20] = 1  # All cake
+    mock_output[1, :, :, 0] = 1  # No cake
+    mock_output[2, :5, :, 19] = 1  # Half cake
 
-    # Mock the preprocess_image function
-    mock_processed_image = np.random.rand(1, 513, 513, 3).astype(np.uint8)
-    mock_preprocess_image.return_value = mock_processed_image
+    is_cake, proportions, histograms = interpret_output(mock_output, 0.4)
 
-    # Mock the TensorFlow Lite interpreter
-    mock_interpreter_instance = MagicMock()
-    mock_interpreter.return_value = mock_interpreter_instance
+    assert is_cake.tolist() == [True, False, True]
+    assert proportions.tolist() == [1.0, 0.0, 0.5]
+    assert histograms.shape == (3, 21)
 
-    # Mock the output of the model
-    mock_output_data = np.random.rand(1, 10, 10, 21)  # Adjust dimensions as needed
-    mock_interpreter_instance.get_tensor.return_value = mock_output_data
 
-    # Call the is_cake function
-    url = "http://example.com/image.jpg"
-    model_path = "path/to/model.tflite"
-    threshold = 0.1
-    is_cake_result, proportion = is_cake(url, model_path, threshold)
-
-    # Assertions
-    assert isinstance(is_cake_result, bool)
-    assert 0 <= proportion <= 1
-    mock_download_image.assert_called_with(url)
-    mock_preprocess_image.assert_called_with(mock_image)
-    mock_interpreter.assert_called_with(model_path=model_path)
-    mock_interpreter_instance.allocate_tensors.assert_called()
-    mock_interpreter_instance.set_tensor.assert_called()
-    mock_interpreter_instance.invoke.assert_called()
-    mock_interpreter_instance.get_tensor.assert_called()
+def test_interpret_output_quantized():
+    # Quantized models emit uint8 scores; their argmax is the same as the dequantized one
+    mock_output = np.zeros((1, 10, 10, 21), dtype=np.uint8)
+    mock_output[0, :, :, 0] = 10
+    mock_output[0, :5, :, 20] = 200
+
+    is_cake, proportion, _ = interpret_output(mock_output)
+
+    assert is_cake
+    assert proportion == 0.5
+
+
+def test_interpret_output_without_batch_dimension():
+    mock_output = np.zeros((10, 10, 21))
+    mock_output[:, :, 19] = 1
+
+    is_cake, proportion, histogram = interpret_output(mock_output)
+
+    assert is_cake
+    assert proportion == 1.0
+    assert histogram[19] == 100
+
+
+def test_interpret_histogram_other_classes():
+    histogram = np.zeros(21, dtype=np.int64)
+    histogram[[0, 7]] = 50
+
+    assert interpret_histogram(histogram, 0.4, class_ids=(7,)) == (True, 0.5)
+
+
+def test_class_histogram_and_interpret_histogram():
+    mock_output = np.zeros((1, 10, 10, 21))
+    mock_output[0, :5, :5, 20] = 1
+    mock_output[0, 5:, 5:, 19] = 1
+
+    histogram = class_histogram(mock_output)
+
+    assert histogram.shape == (21,)
+    assert histogram.sum() == 100
+    assert histogram[19] == histogram[20] == 25
+    # Matches interpret_output for any threshold
+    for threshold in (0.1, 0.6):
+        assert interpret_histogram(histogram, threshold) == tuple(
+            interpret_output(mock_output, threshold)[:2]
+        )
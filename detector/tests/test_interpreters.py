@@ -0,0 +1,155 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+import tflite_runtime.interpreter as tflite
+
+from app import config
+from app.interpreters import (
+    InterpreterPool,
+    cpu_budget,
+    interpreter_threads,
+    run_batch,
+    run_inference,
+)
+from tests.conftest import FakeInterpreter
+
+
+@pytest.fixture
+def mock_interpreter():
+    with patch("tflite_runtime.interpreter.Interpreter") as mock_interpreter:
+        mock_interpreter.side_effect = lambda **kwargs: MagicMock()
+        yield mock_interpreter
+
+
+def test_pool_loads_every_interpreter_up_front(mock_interpreter):
+    pool = InterpreterPool("model.tflite", size=3)
+
+    assert mock_interpreter.call_count == 3
+    assert mock_interpreter.call_args.kwargs["model_path"] == "model.tflite"
+    assert pool.available == 3
+
+
+def test_pool_splits_host_cpus_between_interpreters(mock_interpreter, monkeypatch):
+    monkeypatch.setattr(config, "HOST_CPUS", 16)
+    monkeypatch.setattr(config, "WEB_CONCURRENCY", 2)
+    monkeypatch.setattr(config, "INTERPRETER_THREADS", 0)
+
+    pool = InterpreterPool("model.tflite", size=4)
+
+    assert pool.num_threads == 2
+    assert mock_interpreter.call_args.kwargs["num_threads"] == 2
+
+
+@pytest.mark.parametrize(
+    "host_cpus, workers, interpreters, setting, expected",
+    [
+        (16, 1, 2, 0, 8),
+        (16, 4, 2, 0, 2),
+        (4, 4, 2, 0, 1),
+        (16, 1, 2, 3, 3),
+    ],
+)
+def test_interpreter_threads(
+    monkeypatch, host_cpus, workers, interpreters, setting, expected
+):
+    monkeypatch.setattr(config, "HOST_CPUS", host_cpus)
+    monkeypatch.setattr(config, "WEB_CONCURRENCY", workers)
+    monkeypatch.setattr(config, "INTERPRETER_THREADS", setting)
+
+    assert interpreter_threads(interpreters) == expected
+
+
+def test_cpu_budget_counts_cascade_interpreters(monkeypatch):
+    monkeypatch.setattr(config, "HOST_CPUS", 16)
+    monkeypatch.setattr(config, "WEB_CONCURRENCY", 2)
+    monkeypatch.setattr(config, "INTERPRETER_THREADS", 0)
+    monkeypatch.setattr(config, "INTERPRETER_POOL_SIZE", 2)
+    monkeypatch.setattr(config, "CASCADE_POOL_SIZE", 2)
+
+    monkeypatch.setattr(config, "CASCADE_SIZE", 0)
+    assert cpu_budget()["interpreter_threads"] == 4
+    assert cpu_budget()["total_interpreter_threads"] == 16
+
+    monkeypatch.setattr(config, "CASCADE_SIZE", 129)
+    budget = cpu_budget()
+    assert budget["cascade_pool_size"] == 2
+    assert budget["interpreter_threads"] == 2
+    assert budget["total_interpreter_threads"] == 16
+
+
+def test_pool_without_xnnpack(mock_interpreter):
+    pool = InterpreterPool("model.tflite", num_threads=1, xnnpack=False)
+
+    assert pool.settings() == {"interpreters": 1, "num_threads": 1, "xnnpack": False}
+    assert (
+        mock_interpreter.call_args.kwargs["experimental_op_resolver_type"]
+        == tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    )
+
+
+def test_pool_rejects_empty_size(mock_interpreter):
+    with pytest.raises(ValueError):
+        InterpreterPool("model.tflite", size=0)
+
+
+def test_checkout_is_exclusive(mock_interpreter):
+    pool = InterpreterPool("model.tflite", size=2)
+
+    with pool.checkout() as first, pool.checkout() as second:
+        assert first is not second
+        assert pool.available == 0
+        # Nothing is left to borrow until one of them is returned
+        with pytest.raises(TimeoutError):
+            with pool.checkout(timeout=0.01):
+                pass
+
+    assert pool.available == 2
+
+
+def test_checkout_returns_interpreter_on_error(mock_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.checkout():
+            raise RuntimeError("inference failed")
+
+    assert pool.available == 1
+
+
+def test_checkout_waits_for_a_free_interpreter(mock_interpreter):
+    pool = InterpreterPool("model.tflite", size=1)
+    borrowed = []
+
+    with pool.checkout() as interpreter:
+        waiter = threading.Thread(
+            target=lambda: borrowed.append(pool.checkout().__enter__())
+        )
+        waiter.start()
+        waiter.join(timeout=0.05)
+        assert borrowed == []
+
+    waiter.join(timeout=1)
+    assert borrowed == [interpreter]
+
+
+def test_run_inference_resizes_input():
+    interpreter = FakeInterpreter(size=8)
+    interpreter.allocate_tensors()
+
+    output = run_inference(interpreter, np.zeros((2, 8, 8, 3), dtype=np.uint8))
+
+    assert output.shape == (2, 8, 8, 21)
+    assert interpreter.input_shape.tolist() == [2, 8, 8, 3]
+
+
+def test_run_batch_writes_images_into_input_tensor():
+    interpreter = FakeInterpreter(size=8)
+    interpreter.allocate_tensors()
+    images = [np.full((1, 8, 8, 3), red, dtype=np.uint8) for red in (255, 0, 255)]
+
+    output = run_batch(interpreter, images)
+
+    assert interpreter.invocations == [3]
+    assert output[:, 0, 0, 20].tolist() == [1.0, 0.0, 1.0]
@@ -1,11 +1,27 @@
+import asyncio
+import json
+import logging
+import logging.config
+from contextlib import contextmanager
 from io import BytesIO
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import numpy as np
+import pytest
+import uvicorn.config
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from PIL import Image
 
-from app.main import app  # Ensure this import points to your FastAPI app instance
+from app import config
+from app.executor import Overloaded
+from app.main import (  # Ensure this import points to your FastAPI app instance
+    CakeBatchQuery,
+    app,
+    detect_cake_batch,
+)
+from app.model import ModelNotReady
+from tests.conftest import image_bytes, wait_until_ready
 
 client = TestClient(app)
 
@@ -19,11 +35,360 @@ def test_detect_cake_success():
     dummy_image.save(img_byte_arr, format="JPEG")
     img_byte_arr.seek(0)  # Reset the buffer to the beginning after writing
 
-    with patch("app.main.is_cake", return_value=(True, 0.75)) as mock_is_cake:
+    with patch("app.main.detect", return_value=(True, 0.75, "full")) as mock_detect:
         response = client.post(
             "/detect-cake/",
             json={"url": "http://example.com/image.jpg", "threshold": 0.1},
         )
 
         assert response.status_code == 200
-        assert response.json() == {"is_cake": True, "proportion": 0.75}
+        assert response.json() == {"is_cake": True, "proportion": 0.75, "stage": "full"}
+        mock_detect.assert_awaited_with("http://example.com/image.jpg", 0.1)
+
+
+def test_detect_cake_download_error():
+    error = HTTPException(status_code=400, detail="Error downloading image: timed out")
+    with patch("app.main.detect", side_effect=error):
+        response = client.post(
+            "/detect-cake/",
+            json={"url": "http://example.com/image.jpg", "threshold": 0.1},
+        )
+
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Error downloading image: timed out"}
+
+
+def test_detect_cake_overloaded():
+    with patch("app.main.detect", side_effect=Overloaded(retry_after=3)):
+        response = client.post(
+            "/detect-cake/",
+            json={"url": "http://example.com/image.jpg", "threshold": 0.1},
+        )
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "3"
+
+
+def test_diagnostics():
+    response = client.get("/diagnostics")
+
+    assert response.status_code == 200
+    executor = response.json()["executor"]
+    assert executor["kind"] == "thread"
+    assert executor["admitted"] == 0
+    assert "wait_ms" in executor
+    assert response.json()["cpu"]["interpreter_threads"] >= 1
+
+
+def test_detect_cake_batch_streams_results_and_errors():
+    async def fake_detect(url, threshold, model):
+        if url.endswith("broken.jpg"):
+            raise HTTPException(status_code=400, detail="Error downloading image: 404")
+        return (
+            url.endswith("cake.jpg"),
+            0.75 if url.endswith("cake.jpg") else 0.0,
+            "full",
+        )
+
+    with (
+        patch("app.main.get_model", return_value=MagicMock()),
+        patch("app.pipeline.detect", side_effect=fake_detect),
+    ):
+        response = client.post(
+            "/detect-cake/batch",
+            json={
+                "items": [
+                    {"url": "http://example.com/cake.jpg", "threshold": 0.5},
+                    {"url": "http://example.com/broken.jpg"},
+                    {"url": "http://example.com/shoe.jpg", "threshold": 0.2},
+                ]
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = sorted(
+        (json.loads(line) for line in response.text.splitlines()),
+        key=lambda line: line["index"],
+    )
+    assert lines == [
+        {
+            "index": 0,
+            "url": "http://example.com/cake.jpg",
+            "is_cake": True,
+            "proportion": 0.75,
+            "stage": "full",
+        },
+        {
+            "index": 1,
+            "url": "http://example.com/broken.jpg",
+            "error": {"status_code": 400, "detail": "Error downloading image: 404"},
+        },
+        {
+            "index": 2,
+            "url": "http://example.com/shoe.jpg",
+            "is_cake": False,
+            "proportion": 0.0,
+            "stage": "full",
+        },
+    ]
+
+
+class StubModel:
+    def __init__(self):
+        self.users = 0
+
+    @contextmanager
+    def use(self):
+        self.users += 1
+        try:
+            yield self
+        finally:
+            self.users -= 1
+
+
+def batch_query(*urls):
+    return CakeBatchQuery(items=[{"url": url} for url in urls])
+
+
+def test_detect_cake_batch_holds_model_while_streaming():
+    old, current = StubModel(), StubModel()
+    seen = []
+
+    async def fake_detect(url, threshold, model):
+        seen.append((model, model.users))
+        return True, 1.0, "full"
+
+    async def _run():
+        with patch("app.main.get_model", return_value=old):
+            response = await detect_cake_batch(batch_query("http://example.com/a.jpg"))
+        # The model is swapped after the handler returned, before the response streams
+        with (
+            patch("app.main.get_model", return_value=current),
+            patch("app.pipeline.detect", side_effect=fake_detect),
+        ):
+            return [line async for line in response.body_iterator]
+
+    lines = asyncio.run(_run())
+
+    assert json.loads(lines[0])["is_cake"] is True
+    # The batch ran on the model that was current when it started, marked as in use
+    assert seen == [(current, 2)]
+    assert old.users == current.users == 0
+
+
+def test_detect_cake_batch_reports_model_gone_before_streaming():
+    async def _run():
+        with patch("app.main.get_model", return_value=StubModel()):
+            response = await detect_cake_batch(
+                batch_query("http://example.com/a.jpg", "http://example.com/b.jpg")
+            )
+        with patch("app.main.get_model", side_effect=ModelNotReady()):
+            return [json.loads(line) async for line in response.body_iterator]
+
+    lines = asyncio.run(_run())
+
+    assert [line["index"] for line in lines] == [0, 1]
+    assert all(line["error"]["status_code"] == 503 for line in lines)
+
+
+def test_detect_cake_batch_rejects_empty_batch():
+    response = client.post("/detect-cake/batch", json={"items": []})
+
+    assert response.status_code == 422
+
+
+def test_detect_cake_batch_not_ready():
+    response = client.post(
+        "/detect-cake/batch", json={"items": [{"url": "http://example.com/cake.jpg"}]}
+    )
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_detect_cake_not_ready():
+    # Without the lifespan, no model has been loaded
+    response = client.post(
+        "/detect-cake/",
+        json={"url": "http://example.com/image.jpg", "threshold": 0.1},
+    )
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_not_ready_before_warm_up():
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert client.get("/diagnostics").json()["model"]["ready"] is False
+
+
+def test_ready(live_client, model_file):
+    response = live_client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json()["model"]["path"] == str(model_file)
+    assert live_client.get("/diagnostics").json()["model"]["ready"] is True
+
+
+def test_model_reload(live_client, model_file, monkeypatch):
+    monkeypatch.setattr(config, "MODEL_RELOAD_TOKEN", "s3cret")
+    version = live_client.get("/ready").json()["model"]["version"]
+    model_file.write_bytes(b"fake model, version 2")
+
+    response = live_client.post(
+        "/model/reload", headers={"Authorization": "Bearer s3cret"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["model"]["version"] != version
+    assert live_client.get("/ready").json()["model"]["version"] != version
+
+
+@pytest.mark.parametrize(
+    "token, authorization, status_code",
+    [
+        ("", "Bearer s3cret", 403),
+        ("s3cret", None, 401),
+        ("s3cret", "Bearer wrong", 401),
+        ("s3cret", "Basic s3cret", 401),
+    ],
+)
+def test_model_reload_requires_token(
+    live_client, model_file, monkeypatch, token, authorization, status_code
+):
+    monkeypatch.setattr(config, "MODEL_RELOAD_TOKEN", token)
+    version = live_client.get("/ready").json()["model"]["version"]
+    model_file.write_bytes(b"fake model, version 2")
+    headers = {"Authorization": authorization} if authorization else {}
+
+    response = live_client.post("/model/reload", headers=headers)
+
+    assert response.status_code == status_code
+    assert live_client.get("/ready").json()["model"]["version"] == version
+
+
+def test_detect_cake_upload(live_client):
+    response = live_client.post(
+        "/detect-cake/upload",
+        files={"file": ("cake.png", image_bytes("red"), "image/png")},
+        data={"threshold": "0.5"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"is_cake": True, "proportion": 1.0, "stage": "full"}
+
+
+def test_detect_cake_upload_rejects_non_images(live_client):
+    response = live_client.post(
+        "/detect-cake/upload",
+        files={"file": ("cake.txt", b"cake", "text/plain")},
+    )
+
+    assert response.status_code == 415
+
+
+def test_detect_cake_raw(live_client):
+    response = live_client.post(
+        "/detect-cake/raw",
+        content=image_bytes("blue"),
+        headers={"content-type": "image/png"},
+        params={"threshold": 0.1},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"is_cake": False, "proportion": 0.0, "stage": "full"}
+
+
+def test_detect_cake_raw_rejects_large_images(live_client, monkeypatch):
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 10)
+
+    response = live_client.post(
+        "/detect-cake/raw",
+        content=image_bytes("blue"),
+        headers={"content-type": "image/png"},
+    )
+
+    assert response.status_code == 413
+
+
+def test_detect_cake_raw_rejects_invalid_content_length(live_client):
+    response = live_client.post(
+        "/detect-cake/raw",
+        content=image_bytes("blue"),
+        headers={"content-type": "image/png", "content-length": "lots"},
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid Content-Length header"
+
+
+def test_detect_cake_local(live_client, monkeypatch, tmp_path):
+    (tmp_path / "catalog").mkdir()
+    (tmp_path / "catalog" / "cake.png").write_bytes(image_bytes("red"))
+    monkeypatch.setattr(config, "LOCAL_IMAGE_ROOT", str(tmp_path))
+
+    response = live_client.post(
+        "/detect-cake/local", json={"path": "catalog/cake.png", "threshold": 0.1}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"is_cake": True, "proportion": 1.0, "stage": "full"}
+
+
+@pytest.mark.parametrize(
+    "root, path, status_code",
+    [
+        ("", "cake.png", 403),
+        ("images", "../secret.png", 403),
+        ("images", "/etc/passwd", 403),
+        ("images", "missing.png", 404),
+    ],
+)
+def test_detect_cake_local_errors(
+    live_client, monkeypatch, tmp_path, root, path, status_code
+):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "secret.png").write_bytes(image_bytes("red"))
+    monkeypatch.setattr(
+        config, "LOCAL_IMAGE_ROOT", str(tmp_path / root) if root else ""
+    )
+
+    response = live_client.post("/detect-cake/local", json={"path": path})
+
+    assert response.status_code == status_code
+
+
+@pytest.fixture
+def uvicorn_logging():
+    """
+    Log the way `uvicorn app.main:app` does without a `--log-config`: only the uvicorn loggers are
+    configured.
+    """
+    logging.config.dictConfig(uvicorn.config.LOGGING_CONFIG)
+    app_logger = logging.getLogger("app")
+    yield
+    for handler in app_logger.handlers[:]:
+        app_logger.removeHandler(handler)
+    app_logger.setLevel(logging.NOTSET)
+    app_logger.propagate = True
+
+
+def test_startup_settings_are_logged_under_uvicorn_logging(
+    uvicorn_logging, fake_interpreter, model_file, monkeypatch, capsys
+):
+    monkeypatch.setattr(config, "MODEL_WATCH_INTERVAL", 0)
+
+    # Nor does the root logger have handlers, unlike under pytest
+    with (
+        patch.object(logging.getLogger(), "handlers", []),
+        TestClient(app) as live_client,
+    ):
+        wait_until_ready(live_client)
+
+    logged = capsys.readouterr().err
+    assert "INFO:     CPU budget: {'host_cpus'" in logged
+    assert "'interpreter_threads'" in logged
+    assert "threads, XNNPACK on" in logged
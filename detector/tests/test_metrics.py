@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from app.metrics import count_error, server_timing
+from app.pipeline import detect
+from tests.conftest import image_bytes
+
+URL = "http://example.com/image.jpg"
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_server_timing():
+    assert server_timing({"fetch": 0.0123, "invoke": 0.5}) == (
+        "fetch;dur=12.3, invoke;dur=500.0"
+    )
+
+
+def test_count_error_by_cause():
+    before = sample("detector_errors_total", type="ValueError")
+    try:
+        try:
+            raise ValueError("broken")
+        except ValueError as e:
+            raise HTTPException(status_code=400) from e
+    except HTTPException as e:
+        count_error(e)
+    count_error(HTTPException(status_code=404))
+
+    assert sample("detector_errors_total", type="ValueError") == before + 1
+    assert sample("detector_errors_total", type="http_404") >= 1
+
+
+def test_detect_records_stages_and_cache(image_server, model):
+    image_server.add(URL, image_bytes("red"))
+    data = len(image_bytes("red"))
+    fetched = sample("detector_fetched_bytes_total")
+    invokes = sample("detector_stage_seconds_count", stage="invoke")
+    hits = sample("detector_cache_lookups_total", result="hit")
+    misses = sample("detector_cache_lookups_total", result="miss")
+
+    async def _run():
+        try:
+            await detect(URL, 0.1, model)
+            await detect(URL, 0.5, model)
+        finally:
+            await model.scheduler.close()
+
+    asyncio.run(_run())
+
+    assert sample("detector_fetched_bytes_total") == fetched + data
+    assert sample("detector_stage_seconds_count", stage="invoke") == invokes + 1
+    assert sample("detector_cache_lookups_total", result="miss") == misses + 1
+    assert sample("detector_cache_lookups_total", result="hit") == hits + 1
+
+
+def test_server_timing_header(live_client):
+    response = live_client.post(
+        "/detect-cake/upload",
+        files={"file": ("cake.png", image_bytes("red"), "image/png")},
+    )
+
+    assert response.status_code == 200
+    stages = [
+        entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")
+    ]
+    assert stages == ["decode", "preprocess", "invoke", "postprocess", "total"]
+
+
+@pytest.mark.parametrize(
+    "name", ["detector_stage_seconds_bucket", "detector_errors_total"]
+)
+def test_metrics_endpoint(live_client, name):
+    live_client.post("/detect-cake/local", json={"path": "cake.png"})
+
+    response = live_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert name in response.text
@@ -0,0 +1,126 @@
+import asyncio
+import os
+from contextlib import ExitStack
+
+import pytest
+
+from app import config
+from app import model as model_module
+from app.model import LoadedModel, ModelNotReady, get_model, reload_model, watch_model
+
+
+@pytest.fixture
+def manager():
+    """
+    Reset the current model around each test.
+    """
+    asyncio.run(model_module.close_model())
+    yield model_module
+    asyncio.run(model_module.close_model())
+
+
+def test_warm_up_runs_every_interpreter(model):
+    model.warm_up()
+
+    with ExitStack() as stack:
+        interpreters = [
+            stack.enter_context(model.pool.checkout()) for _ in range(model.pool.size)
+        ]
+    assert all(interpreter.invocations == [1] for interpreter in interpreters)
+
+
+def test_version_follows_content(model, model_file):
+    same = LoadedModel(str(model_file))
+    model_file.write_bytes(b"another fake model")
+    other = LoadedModel(str(model_file))
+
+    assert same.version == model.version
+    assert other.version != model.version
+    same.cache.close()
+    other.cache.close()
+
+
+def test_cascade_shares_cpus_with_full_resolution(
+    fake_interpreter, model_file, monkeypatch
+):
+    monkeypatch.setattr(config, "HOST_CPUS", 12)
+    monkeypatch.setattr(config, "WEB_CONCURRENCY", 1)
+    monkeypatch.setattr(config, "INTERPRETER_THREADS", 0)
+    monkeypatch.setattr(config, "INTERPRETER_POOL_SIZE", 2)
+    monkeypatch.setattr(config, "CASCADE_SIZE", 129)
+    monkeypatch.setattr(config, "CASCADE_POOL_SIZE", 1)
+
+    model = LoadedModel(str(model_file))
+
+    assert model.cascade.pool.size == 1
+    # 12 cores over 3 interpreters in all, not 12 over the 2 full resolution ones
+    assert model.pool.num_threads == model.cascade.pool.num_threads == 4
+    assert model.info()["cascade"]["interpreters"] == 1
+    for resolution in model.resolutions:
+        resolution.cache.close()
+
+
+def test_get_model_before_loading(manager):
+    with pytest.raises(ModelNotReady):
+        get_model()
+    assert manager.status()["ready"] is False
+
+
+def test_reload_lets_requests_finish_on_old_model(
+    manager, fake_interpreter, model_file
+):
+    closed = []
+
+    async def _run():
+        old = await reload_model(str(model_file))
+        close = old.close
+        old.close = lambda: closed.append(old) or close()
+        with old.use():
+            model_file.write_bytes(b"fake model, version 2")
+            new = await reload_model(str(model_file))
+            # New requests get the new version while the old one is still in use
+            assert get_model() is new
+            await asyncio.sleep(0.01)
+            assert closed == []
+        await asyncio.sleep(0.01)
+        return old, new
+
+    old, new = asyncio.run(_run())
+
+    assert closed == [old]
+    assert new.version != old.version
+    # The cache of the old version is deleted, the new one's is kept
+    assert not os.path.exists(old.cache.disk.path)
+    assert os.path.exists(new.cache.disk.path)
+
+
+def test_reload_of_same_version_keeps_cache(manager, fake_interpreter, model_file):
+    async def _run():
+        old = await reload_model(str(model_file))
+        new = await reload_model(str(model_file))
+        await asyncio.sleep(0.01)
+        return old, new
+
+    old, new = asyncio.run(_run())
+
+    assert new.version == old.version
+    assert os.path.exists(new.cache.disk.path)
+
+
+def test_watch_model_picks_up_changes(manager, fake_interpreter, model_file):
+    async def _run():
+        first = await reload_model(str(model_file))
+        watcher = asyncio.ensure_future(watch_model(str(model_file), 0.01))
+        model_file.write_bytes(b"fake model, version 2")
+        os.utime(model_file, ns=(0, 0))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if get_model() is not first:
+                break
+        watcher.cancel()
+        return first, get_model()
+
+    first, current = asyncio.run(_run())
+
+    assert current is not first
+    assert current.version != first.version
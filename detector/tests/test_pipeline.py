@@ -0,0 +1,224 @@
+import asyncio
+import io
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from app import config
+from app.executor import CPUStage, Overloaded
+from app.images import class_histogram
+from app.model import LoadedModel
+from app.pipeline import detect, detect_many
+from tests.conftest import image_bytes
+
+URL = "http://example.com/image.jpg"
+
+
+def run(coroutine, model):
+    async def _run():
+        try:
+            return await coroutine
+        finally:
+            for resolution in model.resolutions:
+                await resolution.scheduler.close()
+
+    return asyncio.run(_run())
+
+
+def test_detect(image_server, model):
+    image_server.add(URL, image_bytes("red"))
+
+    is_cake_result, proportion, stage = run(detect(URL, 0.1, model), model)
+
+    assert is_cake_result is True
+    assert proportion == 1.0
+    assert stage == "full"
+    assert image_server.requests == [URL]
+
+
+def test_detect_download_error(image_server, model):
+    with pytest.raises(HTTPException) as exc_info:
+        run(detect(URL, 0.1, model), model)
+
+    assert exc_info.value.status_code == 400
+
+
+def test_detect_rejects_non_images(image_server, model):
+    image_server.add(URL, b"<html></html>", content_type="text/html")
+
+    with pytest.raises(HTTPException) as exc_info:
+        run(detect(URL, 0.1, model), model)
+
+    assert exc_info.value.status_code == 400
+    assert "Unsupported content type" in exc_info.value.detail
+
+
+def test_detect_answers_repeated_url_from_cache(image_server, model):
+    image_server.add(URL, image_bytes("blue"))
+
+    assert run(detect(URL, 0.1, model), model) == (False, 0.0, "full")
+    # A different threshold is answered from the cached histogram
+    assert run(detect(URL, 0.0, model), model) == (False, 0.0, "full")
+
+    assert image_server.requests == [URL]
+
+
+@patch("app.pipeline.class_histogram", wraps=class_histogram)
+def test_detect_shares_results_between_urls(mock_class_histogram, image_server, model):
+    mirror = "http://mirror.example.com/image.jpg"
+    image_server.add(URL, image_bytes("red"))
+    image_server.add(mirror, image_bytes("red"))
+
+    run(detect(URL, 0.1, model), model)
+    run(detect(mirror, 0.1, model), model)
+
+    # Same bytes from a second URL: downloaded again, but not run through the model
+    assert image_server.requests == [URL, mirror]
+    assert mock_class_histogram.call_count == 1
+
+
+def test_detect_cache_survives_restart(image_server, model):
+    image_server.add(URL, image_bytes("red"))
+    run(detect(URL, 0.1, model), model)
+
+    # Another worker (or a restart) finds the result in the on-disk tier
+    model.cache.close()
+    restarted = LoadedModel(model.path)
+    with patch.object(restarted.scheduler, "submit") as mock_submit:
+        assert run(detect(URL, 0.5, restarted), restarted) == (True, 1.0, "full")
+        mock_submit.assert_not_called()
+    restarted.cache.close()
+    assert image_server.requests == [URL]
+
+
+def test_detect_fails_fast_when_overloaded(image_server, model):
+    image_server.add(URL, image_bytes("red"))
+    stage = CPUStage(kind="thread", workers=1, max_queue=0)
+
+    with patch("app.pipeline.get_stage", return_value=stage), stage.admit():
+        with pytest.raises(Overloaded):
+            run(detect(URL, 0.1, model), model)
+    stage.shutdown()
+
+    # Rejected before downloading anything
+    assert image_server.requests == []
+
+
+def test_detect_holds_one_slot_per_request(image_server, model):
+    image_server.add(URL, image_bytes("red"))
+    # Room for a single request, so a second slot for the same request would be rejected
+    stage = CPUStage(kind="thread", workers=1, max_queue=0)
+
+    with patch("app.pipeline.get_stage", return_value=stage):
+        assert run(detect(URL, 0.1, model), model) == (True, 1.0, "full")
+        # A download error gives the slot back
+        with pytest.raises(HTTPException):
+            run(detect("http://example.com/missing.png", 0.1, model), model)
+        assert stage.admitted == 0
+
+        # Cache hits are answered without a slot, even when the stage is full
+        with stage.admit():
+            assert run(detect(URL, 0.1, model), model) == (True, 1.0, "full")
+    assert stage.rejected == 0
+    stage.shutdown()
+
+
+def test_detect_many_matches_detect(image_server, model):
+    urls = [f"http://example.com/{i}.png" for i in range(6)]
+    for i, url in enumerate(urls):
+        image_server.add(
+            url, image_bytes("red" if i % 2 else "blue", size=(50 + i, 50))
+        )
+    image_server.add("http://example.com/page.html", b"<html/>", "text/html")
+    queries = [(url, 0.1) for url in urls] + [("http://example.com/page.html", 0.1)]
+
+    async def _collect():
+        return [result async for result in detect_many(queries, 8, model)]
+
+    results = dict(run(_collect(), model))
+
+    assert sorted(results) == list(range(7))
+    assert [results[i] for i in range(6)] == [
+        (bool(i % 2), float(i % 2), "full") for i in range(6)
+    ]
+    # The failing item is reported in place, not raised
+    assert isinstance(results[6], HTTPException)
+    # The concurrent images shared inferences
+    pool = model.pool
+    invocations = []
+    with ExitStack() as stack:
+        for _ in range(pool.size):
+            invocations += stack.enter_context(pool.checkout()).invocations
+    assert sum(invocations) == 6
+    assert len(invocations) < 6
+
+
+@pytest.fixture
+def cascade_model(fake_interpreter, model_file, monkeypatch):
+    monkeypatch.setattr(config, "CASCADE_SIZE", 4)
+    monkeypatch.setattr(config, "CASCADE_MARGIN", 0.1)
+    model = LoadedModel(str(model_file))
+    yield model
+    for resolution in model.resolutions:
+        resolution.cache.close()
+
+
+def half_cake_bytes():
+    image = Image.new("RGB", (100, 100), color="blue")
+    image.paste((255, 0, 0), (0, 0, 50, 100))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_cascade_decides_clear_images(image_server, cascade_model):
+    image_server.add(URL, image_bytes("red"))
+
+    with patch.object(cascade_model.scheduler, "submit") as mock_submit:
+        assert run(detect(URL, 0.1, cascade_model), cascade_model) == (
+            True,
+            1.0,
+            "cascade",
+        )
+        # Answered again from the cached low resolution histogram
+        assert run(detect(URL, 0.5, cascade_model), cascade_model) == (
+            True,
+            1.0,
+            "cascade",
+        )
+        mock_submit.assert_not_called()
+    assert image_server.requests == [URL]
+
+
+def test_cascade_escalates_close_calls(image_server, cascade_model):
+    image_server.add(URL, half_cake_bytes())
+
+    is_cake_result, proportion, stage = run(
+        detect(URL, 0.5, cascade_model), cascade_model
+    )
+
+    assert stage == "full"
+    assert proportion == pytest.approx(0.5, abs=0.01)
+    # A threshold far from the proportion is then decided by either cached histogram
+    assert run(detect(URL, 0.9, cascade_model), cascade_model)[:2] == (
+        False,
+        proportion,
+    )
+    assert image_server.requests == [URL]
+
+
+def test_cascade_escalation_keeps_the_request_slot(image_server, cascade_model):
+    image_server.add(URL, half_cake_bytes())
+    stage = CPUStage(kind="thread", workers=1, max_queue=0)
+
+    with patch("app.pipeline.get_stage", return_value=stage):
+        result = run(detect(URL, 0.5, cascade_model), cascade_model)
+
+    # Both resolutions ran within the single slot taken before the download
+    assert result[2] == "full"
+    assert stage.rejected == 0
+    assert stage.admitted == 0
+    stage.shutdown()